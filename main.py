@@ -1,17 +1,32 @@
+import asyncio
+import functools
 import logging
 import time
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from colorama import Fore, init
 from voice_assistant.audio import record_audio, play_audio
 from voice_assistant.transcription import transcribe_audio
-from voice_assistant.response_generation import generate_response
-from voice_assistant.text_to_speech import text_to_speech
-from voice_assistant.utils import delete_file
+from voice_assistant.audio_ingest import ingest_stats
+from voice_assistant.local_stt import get_local_transcriber, local_stt_metrics
+from voice_assistant.response_generation import generate_response_stream, summarize_conversation
+from voice_assistant.history import ConversationHistory, count_tokens, history_stats
+from voice_assistant.intent_router import IntentRouter, router_stats
+from voice_assistant.agent_actions import availability, schedule_meeting, sync_availability
+from voice_assistant.text_to_speech import text_to_speech_stream, get_tts_stream_format, prewarm_tts_cache, tts_cache
+from voice_assistant.pipeline import run_stage
+from voice_assistant.routing import get_router, routing_metrics
+from voice_assistant.sentences import SentenceSegmenter, split_sentences
+from voice_assistant.providers import pool_metrics
+from voice_assistant import metrics, protocol
+from voice_assistant.protocol import SendQueue, ProtocolError, protocol_stats
+from voice_assistant.vad import VoiceActivityDetector
+from voice_assistant.sessions import SessionStore, new_session_id, valid_session_id
+from voice_assistant.streaming_transcription import StreamingTranscriber, finish_utterances
+from voice_assistant.speculation import Speculator, speculation_metrics
 from voice_assistant.config import Config
-from voice_assistant.api_key_manager import get_transcription_api_key, get_response_api_key, get_tts_api_key
-import os
+from voice_assistant.api_key_manager import get_response_api_key, get_tts_api_key
 from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from starlette.requests import Request
 
@@ -23,110 +38,648 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 init(autoreset=True)
 app = FastAPI()
-active_users = {}
+
+# Conversation state, shared by every worker process so a session can resume on any of them
+session_store = SessionStore(Config.SESSION_DB, ttl=Config.SESSION_TTL)
 
 class ConnectionManager:
+    """
+    The sockets connected to this worker process, with their session ids and send queues.
+
+    Clients that offer the `protocol.SUBPROTOCOL` subprotocol speak the framed
+    binary protocol; others get the original JSON and text messages.
+    Everything sent to a socket goes through its `SendQueue`.
+    """
     def __init__(self):
         self.active_connections: dict = {}
+        self.send_queues: dict = {}
 
     async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[websocket] = []
-        logging.info(Fore.GREEN + f"Client connected: {websocket}" + Fore.RESET)
+        version, subprotocol = protocol.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        self.active_connections[websocket] = None
+        self.send_queues[websocket] = SendQueue(websocket, version, max_bytes=Config.WS_SEND_QUEUE_BYTES, send_timeout=Config.WS_SEND_TIMEOUT)
+        logging.info(Fore.GREEN + f"Client connected: {websocket} (protocol version {version})" + Fore.RESET)
+        return self.send_queues[websocket]
 
-    def disconnect(self, websocket: WebSocket):
+    async def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             del self.active_connections[websocket]
+        sender = self.send_queues.pop(websocket, None)
+        if sender is not None:
+            await sender.close()
         logging.info(Fore.RED + f"Client disconnected: {websocket}" + Fore.RESET)
 
-    async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    async def send_message(self, message_type: int, payload, websocket: WebSocket, codec: int = protocol.NO_CODEC):
+        """
+        Queue a message for a socket; audio waits while the socket's queue is full (see `SendQueue`).
+        """
+        await self.send_queues[websocket].send(message_type, payload, codec)
+
+    async def broadcast(self, message: str, timeout: float = Config.BROADCAST_SEND_TIMEOUT):
+        """
+        Queue a chat message for every socket at once; sockets that were dropped or take longer than `timeout` are disconnected.
+
+        Returns:
+        int: The number of sockets the message was queued for.
+        """
+        connections = list(self.send_queues)
+        results = await asyncio.gather(*(self._send_with_timeout(connection, message, timeout) for connection in connections))
+        for connection, delivered in zip(connections, results):
+            if not delivered:
+                await self.disconnect(connection)
+        return sum(results)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def _send_with_timeout(self, websocket: WebSocket, message: str, timeout: float):
+        try:
+            await asyncio.wait_for(self.send_message(protocol.TEXT, message, websocket), timeout)
+            return True
+        except Exception as e:
+            logging.warning(f"Dropping client {websocket} from broadcast: {e!r}")
+            return False
 
 manager = ConnectionManager()
 
+# Turns cut short by the caller, and the provider work that was cancelled or never started
+interruption_stats = {
+    "interrupted": 0,
+    "by_speech": 0,
+    "by_upload": 0,
+    "by_stop": 0,
+    "transcriptions_cancelled": 0,
+    "llm_cancelled": 0,
+    "tts_cancelled": 0,
+    "tts_skipped": 0,
+    "tts_chars_skipped": 0,
+    "audio_bytes_sent": 0,
+    "audio_frames_dropped": 0,
+}
+
+async def stream_speech(sender: SendQueue, sentences: asyncio.Queue, turn_started: float, speculator: Speculator = None):
+    """
+    Synthesize sentences from a queue and forward the audio frames as they arrive.
+
+    The queue is terminated by None. All sentences of a response share one
+    stream framed by "audio_start" (with the PCM format) and "audio_end"
+    messages. Chunks wait for room in the socket's send queue, so a slow
+    client slows synthesis down instead of piling audio up in memory. Sentences go to the first TTS backend to answer (see
+    `routing`); a fallback's audio is resampled to the announced rate.
+    Sentences a `speculator` synthesized ahead of time play from the TTS cache.
+    """
+    stream_format = get_tts_stream_format(Config.TTS_MODEL)
+    started = False
+    sent = 0
+    while True:
+        sentence = await sentences.get()
+        if sentence is None:
+            break
+        if speculator is not None:
+            speculator.spoken(sentence)
+        if not started:
+            await sender.send(protocol.AUDIO_START, stream_format)
+            started = True
+        with metrics.span("tts", provider=Config.TTS_MODEL, chars=len(sentence)) as span:
+            sentence_bytes = 0
+            stream = get_router("tts").stream(text_to_speech_stream, sentence, Config.LOCAL_MODEL_PATH, sample_rate=stream_format['sample_rate'])
+            try:
+                async for chunk in stream:
+                    if not sent:
+                        metrics.observe("first_audio", time.perf_counter() - turn_started)
+                        logging.info(f"First audio byte after {(time.perf_counter() - turn_started) * 1000:.0f} ms")
+                    await sender.send(protocol.AUDIO, chunk, codec=protocol.PCM_S16LE)
+                    sent += len(chunk)
+                    sentence_bytes += len(chunk)
+            except asyncio.CancelledError:
+                # Barged in on: this sentence is cut short and the queued ones are never synthesized
+                span.set(error="CancelledError", bytes=sentence_bytes)
+                interruption_stats['tts_cancelled'] += 1
+                interruption_stats['audio_bytes_sent'] += sent
+                while not sentences.empty():
+                    queued = sentences.get_nowait()
+                    if queued is not None:
+                        interruption_stats['tts_skipped'] += 1
+                        interruption_stats['tts_chars_skipped'] += len(queued)
+                raise
+            except asyncio.TimeoutError:
+                span.set(error="TimeoutError")
+                await sender.send(protocol.ERROR, "Text to speech timed out.")
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logging.error(f"Failed to convert text to speech: {e}")
+                span.set(error=type(e).__name__)
+                await sender.send(protocol.ERROR, "Unable to generate speech.")
+            finally:
+                await stream.aclose()
+            span.set(bytes=sentence_bytes)
+    if started:
+        await sender.send(protocol.AUDIO_END)
+    logging.info(f"Streamed {sent} bytes of audio")
+    return sent
+
+async def stream_response(sender: SendQueue, chat_history: list, turn_started: float, prompt_tokens: int = 0, speculator: Speculator = None):
+    """
+    Stream the LLM reply to the client and hand each finished sentence to TTS.
+
+    Text deltas are sent as "response_delta" messages followed by one
+    "response_end"; speech for the first sentence starts while the model is
+    still generating the rest.
+
+    Returns:
+    str: The full response text, empty if the model produced nothing.
+    """
+    sentences = asyncio.Queue()
+    speaker = asyncio.create_task(stream_speech(sender, sentences, turn_started, speculator))
+    segmenter = SentenceSegmenter()
+    parts = []
+    try:
+        with metrics.span("llm", provider=Config.RESPONSE_MODEL, tokens_in=prompt_tokens) as span:
+            stream = get_router("response").stream(generate_response_stream, chat_history, Config.LOCAL_MODEL_PATH, raise_errors=True)
+            try:
+                async for delta in stream:
+                    if not parts:
+                        metrics.observe("first_token", time.perf_counter() - turn_started, provider=Config.RESPONSE_MODEL)
+                        logging.info(f"First response token after {(time.perf_counter() - turn_started) * 1000:.0f} ms")
+                    parts.append(delta)
+                    await sender.send(protocol.RESPONSE_DELTA, delta)
+                    for sentence in segmenter.feed(delta):
+                        sentences.put_nowait(sentence)
+            except asyncio.CancelledError:
+                # Barged in on mid-generation: keep what was said so far in the conversation
+                span.set(error="CancelledError", tokens_out=count_tokens("".join(parts)))
+                interruption_stats['llm_cancelled'] += 1
+                if parts:
+                    chat_history.append({"role": "assistant", "content": "".join(parts)})
+                raise
+            except asyncio.TimeoutError:
+                span.set(error="TimeoutError")
+                logging.error(Fore.RED + "Response generation timed out." + Fore.RESET)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                span.set(error=type(e).__name__)
+                logging.error(Fore.RED + f"Response generation failed on every backend: {e}" + Fore.RESET)
+            finally:
+                await stream.aclose()
+            span.set(tokens_out=count_tokens("".join(parts)))
+    except BaseException:
+        speaker.cancel()
+        raise
+    finally:
+        tail = segmenter.flush()
+        if tail:
+            sentences.put_nowait(tail)
+        sentences.put_nowait(None)
+    if parts:
+        await sender.send(protocol.RESPONSE_END)
+    await speaker
+    return "".join(parts)
+
+async def speak_text(sender: SendQueue, text: str, turn_started: float, speculator: Speculator = None):
+    """
+    Send a ready-made reply with the same messages and audio framing as `stream_response`.
+    """
+    sentences = asyncio.Queue()
+    for sentence in split_sentences(text):
+        sentences.put_nowait(sentence)
+    sentences.put_nowait(None)
+    speaker = asyncio.create_task(stream_speech(sender, sentences, turn_started, speculator))
+    try:
+        await sender.send(protocol.RESPONSE_DELTA, text)
+        await sender.send(protocol.RESPONSE_END)
+    except BaseException:
+        speaker.cancel()
+        raise
+    await speaker
+
+@app.on_event("startup")
+async def start_tts_prewarm():
+    async def prewarm():
+        try:
+            synthesized = await run_stage("tts", prewarm_tts_cache, Config.TTS_MODEL, get_tts_api_key(), Config.TTS_PREWARM_PHRASES)
+            logging.info(f"Prewarmed TTS cache with {synthesized} phrases")
+        except Exception as e:
+            logging.error(f"Failed to prewarm TTS cache: {e}")
+    asyncio.create_task(prewarm())
+
+@app.on_event("startup")
+async def load_local_stt():
+    # Load the in-process Whisper model now rather than on the first utterance
+    if 'local' not in [Config.TRANSCRIPTION_MODEL, *Config.TRANSCRIPTION_FALLBACKS]:
+        return
+    async def load():
+        try:
+            await run_stage("transcription", get_local_transcriber, Config.LOCAL_MODEL_PATH)
+            logging.info("Local Whisper model loaded")
+        except Exception as e:
+            logging.error(f"Failed to load local Whisper model: {e}")
+    asyncio.create_task(load())
+
+@app.on_event("startup")
+async def purge_sessions():
+    purged = await run_stage("session", session_store.purge)
+    if purged:
+        logging.info(f"Removed {purged} expired sessions")
+
+@app.get("/tts-cache/metrics")
+async def tts_cache_metrics():
+    return tts_cache.stats
+
+@app.get("/history/metrics")
+async def history_metrics():
+    turns = history_stats['turns']
+    return dict(history_stats, prompt_tokens_avg=history_stats['prompt_tokens_total'] / turns if turns else 0)
+
+@app.get("/router/metrics")
+async def intent_router_metrics():
+    return router_stats
+
+@app.get("/providers/metrics")
+async def provider_metrics():
+    return pool_metrics()
+
+@app.get("/audio/metrics")
+async def audio_ingest_metrics():
+    return ingest_stats
+
+@app.get("/stt/metrics")
+async def stt_metrics():
+    return local_stt_metrics()
+
+@app.get("/speculation/metrics")
+async def speculative_tts_metrics():
+    return speculation_metrics()
+
+@app.get("/interruptions/metrics")
+async def interruption_metrics():
+    return interruption_stats
+
+@app.get("/protocol/metrics")
+async def websocket_protocol_metrics():
+    return dict(protocol_stats, queued_bytes=sum(sender.queued_bytes for sender in manager.send_queues.values()))
+
+@app.get("/sessions/metrics")
+async def session_metrics():
+    return {"connected": len(manager.active_connections), "stored": await run_stage("session", len, session_store)}
+
+@app.get("/routing/metrics")
+async def provider_routing_metrics():
+    return routing_metrics()
+
+@app.get("/stages/metrics")
+async def stage_metrics():
+    return metrics.stage_metrics()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Stage latency histograms and every /x/metrics counter in the Prometheus text format.
+    """
+    samples = [
+        *metrics.stats_samples("history", await history_metrics()),
+        *metrics.stats_samples("router", router_stats),
+        *metrics.stats_samples("audio_ingest", ingest_stats),
+        *metrics.stats_samples("local_stt", local_stt_metrics()),
+        *metrics.stats_samples("speculation", speculation_metrics()),
+        *metrics.stats_samples("interruptions", interruption_stats),
+        *metrics.stats_samples("protocol", await websocket_protocol_metrics()),
+        *metrics.stats_samples("tts_cache", tts_cache.stats),
+        *metrics.stats_samples("sessions", await session_metrics()),
+    ]
+    pools = pool_metrics()
+    for provider, counters in pools['providers'].items():
+        samples += metrics.stats_samples("provider_clients", counters, provider=provider)
+    samples += metrics.stats_samples("provider", {key: value for key, value in pools.items() if key != 'providers'})
+    for stage, routing in routing_metrics().items():
+        samples += metrics.stats_samples("routing", routing, stage=stage)
+        for provider, health in routing['providers'].items():
+            samples += metrics.stats_samples("routing_backend", dict(health, circuit_open=health['state'] != "closed"), stage=stage, provider=provider)
+    return PlainTextResponse(metrics.render_prometheus(samples), media_type="text/plain; version=0.0.4")
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+async def run_turn(sender: SendQueue, history: ConversationHistory, router: IntentRouter, user_input: str, turn_started: float,
+                   speculator: Speculator = None):
+    """
+    Answer one user utterance.
+
+    With a `speculator`, its round of speculation is closed once the reply
+    has been spoken and a new one starts for the next turn.
+
+    Returns:
+    bool: False once the user has ended the conversation.
+    """
+    logging.info(Fore.GREEN + f"You said: {user_input}" + Fore.RESET)
+
+    if "goodbye" in user_input.lower():
+        await sender.send(protocol.TEXT, "Goodbye!")
+        return False
+
+    history.append({"role": "user", "content": user_input})
+    if speculator is not None:
+        speculator.stop()
+
+    # Deterministic scheduling turns are answered without the LLM; bookings wait for the database commit
+    routed = None
+    if Config.INTENT_ROUTER_ENABLED:
+        with metrics.span("route", provider="intent_router") as span:
+            route = asyncio.ensure_future(run_stage("response", router.route, user_input))
+            try:
+                routed = await asyncio.shield(route)
+            except asyncio.CancelledError:
+                # Barged in on: the router's thread runs on and may book, so wait
+                # for it and keep its reply in the history like the LLM path does
+                span.set(error="CancelledError")
+                try:
+                    routed = await route
+                except Exception:
+                    routed = None
+                if routed is not None:
+                    history.append({"role": "assistant", "content": routed['response']})
+                raise
+            span.set(intent=routed['intent'] if routed else None)
+    if routed is not None:
+        logging.info(Fore.CYAN + f"Routed ({routed['intent']}): " + routed['response'] + Fore.RESET)
+        history.append({"role": "assistant", "content": routed['response']})
+        await speak_text(sender, routed['response'], turn_started, speculator)
+        speculate_next(speculator, routed['response'])
+        return True
+
+    # Tool calls and results are appended to the prompt; keep them in the history
+    prompt = history.build_prompt()
+    prompt_length = len(prompt)
+    try:
+        response_text = await stream_response(sender, prompt, turn_started, prompt_tokens=history.last_prompt_tokens, speculator=speculator)
+    finally:
+        # Also when barged in on: tool calls may have booked a meeting already
+        history.extend(prompt[prompt_length:])
+    speculate_next(speculator, response_text)
+
+    if not response_text:
+        await sender.send(protocol.ERROR, "Unable to generate a response.")
+        logging.error(Fore.RED + f"Response generation failed." + Fore.RESET)
+        return True
+
+    logging.info(Fore.CYAN + "Response: " + response_text + Fore.RESET)
+
+    history.append({"role": "assistant", "content": response_text})
+    schedule_compaction(history)
+
+    print(f"Response spoken via {Config.TTS_MODEL}")
+    return True
+
+def speculate_next(speculator: Speculator, response: str):
+    # Score the round that just ended and start predicting the reply after next
+    if speculator is not None:
+        speculator.settle(response)
+        speculator.speculate()
+
+def schedule_compaction(history: ConversationHistory):
+    """
+    Summarize turns that left the prompt window, off the response path.
+    """
+    if history.compaction is not None and not history.compaction.done():
+        return
+
+    async def compact():
+        try:
+            await run_stage("response", history.compact)
+        except Exception as e:
+            logging.error(f"Failed to compact conversation history: {e}")
+    history.compaction = asyncio.create_task(compact())
+
+async def save_session(session_id: str, history: ConversationHistory, router: IntentRouter, active: bool = True):
+    """
+    Persist a conversation after a turn, or forget it once the user said goodbye.
+    """
+    try:
+        with metrics.span("session_save", provider=Config.SESSION_DB):
+            if active:
+                await run_stage("session", session_store.save, session_id, {"history": history.state(), "patient_name": router.patient_name})
+            else:
+                await run_stage("session", session_store.delete, session_id)
+    except Exception as e:
+        logging.error(f"Failed to save session {session_id}: {e}")
+
 @app.websocket("/ws/assistant")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    """
+    Voice assistant session.
+
+    Messages follow `protocol`: clients that offer its subprotocol exchange
+    framed binary messages, others the original JSON and text messages.
+
+    The client either uploads each recorded utterance as one audio message,
+    or sends {"type": "start_stream", "sample_rate": ...} and then streams
+    16-bit mono PCM frames. In streaming mode a server-side VAD finds the end
+    of each utterance and its segments are transcribed while the user talks;
+    {"type": "stop_stream"} ends streaming.
+
+    While a reply is being spoken, {"type": "stop"}, a new upload or, with
+    Config.BARGE_IN_ENABLED, the user starting to speak again cancels its
+    LLM and TTS work; the server then sends {"type": "interrupted", "reason": ...}
+    and the client drops the audio it has queued.
+
+    The conversation is saved after every turn. The server first sends
+    {"type": "session", "session_id": ..., "resumed": ...}; a client that
+    reconnects with ?session_id=... to any worker continues that conversation.
+    """
+    sender = await manager.connect(websocket)
+    transcriber = None
+    turn = None
     try:
-        chat_history = [{
-            "role": "system",
-            "content": """You are Ton Ton Mocci, a meeting scheduling assistant dedicated to helping users schedule meetings with doctors. 
-            You have access to doctors' availability data, including free slots for meetings. Your task is to assist users by providing available slots and scheduling meetings with the doctors. Always begin by asking for the user's name before proceeding. Once the name is provided, guide them through selecting a doctor and booking a time slot. Assume today's date is 2024-09-24."""
-            }]
-        await websocket.send_text("Please start speaking...")
-        while True:
-            transcription_api_key = get_transcription_api_key()
-            
-            audio_data = await websocket.receive_bytes()
-
-            with open(Config.INPUT_AUDIO, "wb") as audio_file:
-                audio_file.write(audio_data)
-
-            user_input = transcribe_audio(Config.TRANSCRIPTION_MODEL, transcription_api_key, Config.INPUT_AUDIO, Config.LOCAL_MODEL_PATH)
-            
-            if not user_input:
-                await websocket.send_text("Error: Unable to transcribe audio.")
-                logging.error(Fore.RED + f"Transcription failed." + Fore.RESET)
-                continue
+        session_id = websocket.query_params.get("session_id")
+        state = await run_stage("session", session_store.load, session_id) if valid_session_id(session_id) else None
+        if state is None:
+            session_id = new_session_id()
+        manager.active_connections[websocket] = session_id
 
-            logging.info(Fore.GREEN + f"You said: {user_input}" + Fore.RESET)
+        history = ConversationHistory(
+            """You are Ton Ton Mocci, a meeting scheduling assistant dedicated to helping users schedule meetings with doctors. 
+            You have access to doctors' availability data, including free slots for meetings. Your task is to assist users by providing available slots and scheduling meetings with the doctors. Always begin by asking for the user's name before proceeding. Once the name is provided, guide them through selecting a doctor and booking a time slot. Assume today's date is """ + Config.TODAY + ".",
+            max_prompt_tokens=Config.HISTORY_MAX_PROMPT_TOKENS,
+            summary_max_tokens=Config.HISTORY_SUMMARY_MAX_TOKENS,
+            summarizer=functools.partial(summarize_conversation, Config.RESPONSE_MODEL, get_response_api_key(),
+                                         max_tokens=Config.HISTORY_SUMMARY_MAX_TOKENS),
+        )
+        router = IntentRouter(availability, schedule_meeting, Config.TODAY, refresh=sync_availability)
+        if state is not None:
+            history.restore(state['history'])
+            router.patient_name = state.get('patient_name')
+            logging.info(f"Resumed session {session_id} with {len(history.messages)} messages")
+        speculator = None
+        if Config.SPECULATION_ENABLED:
+            speculator = Speculator(router, lambda sentence: prewarm_tts_cache(Config.TTS_MODEL, get_tts_api_key(), [sentence]),
+                                    max_sentences=Config.SPECULATION_MAX_SENTENCES, max_chars=Config.SPECULATION_MAX_CHARS,
+                                    concurrency=Config.SPECULATION_CONCURRENCY)
+            if history.messages and history.messages[-1]['role'] == "assistant":
+                speculator.last_response = history.messages[-1].get('content') or ""
+        await sender.send(protocol.CONTROL, {"type": "session", "session_id": session_id, "resumed": state is not None})
+        await sender.send(protocol.TEXT, "Please start speaking...")
 
-            if "goodbye" in user_input.lower():
-                await manager.send_message("Goodbye!", websocket)
-                break
+        async def send_partial_transcript(text):
+            if speculator is not None:
+                speculator.speculate(text)
+            await sender.send(protocol.TRANSCRIPT_PARTIAL, text)
 
-            chat_history.append({"role": "user", "content": user_input})
+        async def answer_upload(audio_bytes):
+            # A whole recorded utterance
+            with metrics.span("turn", session=session_id, mode="upload"):
+                turn_started = time.perf_counter()
+                with metrics.span("transcribe", provider=Config.TRANSCRIPTION_MODEL, bytes=len(audio_bytes)) as span:
+                    try:
+                        user_input = await get_router("transcription").call(transcribe_audio, audio_bytes, Config.LOCAL_MODEL_PATH, raise_errors=True)
+                    except asyncio.CancelledError:
+                        interruption_stats['transcriptions_cancelled'] += 1
+                        raise
+                    except Exception as e:
+                        span.set(error=type(e).__name__)
+                        user_input = None
 
-            response_api_key = get_response_api_key()
-            response_text = generate_response(Config.RESPONSE_MODEL, response_api_key, chat_history, Config.LOCAL_MODEL_PATH)
+                if not user_input:
+                    await sender.send(protocol.ERROR, "Unable to transcribe audio.")
+                    logging.error(Fore.RED + f"Transcription failed." + Fore.RESET)
+                    return
+                await answer(user_input, turn_started)
 
-            if not response_text:
-                await websocket.send_text("Error: Unable to generate a response.")
-                logging.error(Fore.RED + f"Response generation failed." + Fore.RESET)
-                continue
+        async def answer_stream(utterances):
+            nonlocal carried
+            with metrics.span("turn", session=session_id, mode="stream"):
+                turn_started = time.perf_counter()
+                # Only the segments still in flight when the user stopped are waited for
+                with metrics.span("transcribe_wait", provider=Config.TRANSCRIPTION_MODEL):
+                    try:
+                        user_input = await finish_utterances(utterances)
+                    except asyncio.CancelledError:
+                        # The user went on talking after a pause: all their words so far,
+                        # still transcribing, open the next utterance
+                        carried = utterances
+                        interruption_stats['transcriptions_cancelled'] += 1
+                        raise
+                logging.info(f"Final transcript after {(time.perf_counter() - turn_started) * 1000:.0f} ms")
+                if not user_input:
+                    logging.warning("Utterance produced no transcript")
+                    return
+                await sender.send(protocol.TRANSCRIPT_FINAL, user_input)
+                await answer(user_input, turn_started)
 
-            logging.info(Fore.CYAN + "Response: " + response_text + Fore.RESET)
+        async def answer(user_input, turn_started):
+            active = True
+            try:
+                active = await run_turn(sender, history, router, user_input, turn_started, speculator)
+            finally:
+                # Saved even when barged in on; the next turn sees what was said so far
+                await save_session(session_id, history, router, active)
+            if not active:
+                await sender.drain()
+                await websocket.close()
 
-            chat_history.append({"role": "assistant", "content": response_text})
+        async def run_in_background(coroutine):
+            try:
+                await coroutine
+            except WebSocketDisconnect:
+                pass
+            except Exception as e:
+                logging.error(Fore.RED + f"An error occurred: {e}" + Fore.RESET)
 
-            await manager.send_message(response_text, websocket)
+        async def interrupt(reason):
+            # Barge-in: cancel the turn in flight and have the client drop the audio it has queued
+            speaking = turn is not None and not turn.done()
+            if speaking:
+                turn.cancel()
+                await asyncio.wait([turn])
+            # Audio of the reply still waiting for the socket is never sent, even once the turn is over
+            dropped = sender.clear(protocol.AUDIO_LANE)
+            if not speaking and not dropped:
+                return
+            interruption_stats['audio_frames_dropped'] += dropped
+            interruption_stats['interrupted'] += 1
+            interruption_stats[f'by_{reason}'] += 1
+            metrics.observe("barge_in", time.perf_counter() - turn_began, reason=reason)
+            logging.info(f"Turn interrupted by {reason} after {(time.perf_counter() - turn_began) * 1000:.0f} ms")
+            await sender.send(protocol.CONTROL, {"type": "interrupted", "reason": reason})
 
-            output_file = 'output.wav' if Config.TTS_MODEL not in ['openai', 'elevenlabs', 'melotts', 'cartesia'] else 'modeloutput.mp3'
+        # Each turn runs as a task beside this receive loop, so the caller can interrupt it
+        vad = None
+        carried = None
+        turn_began = None
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
 
-            tts_api_key = get_tts_api_key()
-            text_to_speech(Config.TTS_MODEL, tts_api_key, response_text, output_file, Config.LOCAL_MODEL_PATH)
+            try:
+                message_type, codec, payload = protocol.read_message(message, sender.version)
+            except ProtocolError as e:
+                logging.warning(f"Ignoring malformed message: {e}")
+                await sender.send(protocol.ERROR, f"Malformed message: {e}")
+                continue
 
-            if os.path.exists(output_file):
-                try:
-                    with open(output_file, "rb") as audio_file:
-                        audio_data = audio_file.read()
-                        if len(audio_data) == 0:
-                            logging.error(f"Error: {output_file} is empty")
-                            await websocket.send_text(f"Error: {output_file} is empty")
-                        else:
-                            await websocket.send_bytes(audio_data)
-                            logging.info(f"Sent audio file: {output_file}")
-                except Exception as e:
-                    logging.error(f"Error sending file: {e}")
-                    await websocket.send_text(f"Error: Unable to send {output_file}")
+            events = []
+            if message_type == protocol.CONTROL:
+                control = payload
+                if control.get("type") == "start_stream":
+                    vad = VoiceActivityDetector(
+                        sample_rate=control.get("sample_rate", Config.STREAM_SAMPLE_RATE),
+                        energy_threshold=Config.VAD_ENERGY_THRESHOLD,
+                        dynamic_energy_threshold=Config.VAD_DYNAMIC_ENERGY_THRESHOLD,
+                        pause_threshold=Config.VAD_PAUSE_THRESHOLD,
+                        phrase_threshold=Config.VAD_PHRASE_THRESHOLD,
+                        segment_pause=Config.VAD_SEGMENT_PAUSE,
+                        min_segment=Config.VAD_MIN_SEGMENT,
+                    )
+                    logging.info(f"Streaming audio at {vad.sample_rate} Hz")
+                elif control.get("type") == "stop_stream" and vad is not None:
+                    events = vad.flush()
+                    vad = None
+                elif control.get("type") == "stop":
+                    await interrupt("stop")
+            elif vad is not None and codec != protocol.ENCODED:
+                received = time.perf_counter()
+                events = vad.process(payload)
+                metrics.observe("receive", time.perf_counter() - received, bytes=len(payload))
+            elif codec == protocol.PCM_S16LE:
+                # A stream frame that was still in flight when streaming stopped
+                continue
             else:
-                await websocket.send_text(f"Error: File {output_file} not found")
+                if Config.BARGE_IN_ENABLED:
+                    await interrupt("upload")
+                elif turn is not None:
+                    await asyncio.wait([turn])
+                turn, turn_began = asyncio.create_task(run_in_background(answer_upload(payload))), time.perf_counter()
+                continue
 
-            print(f"Response spoken via {Config.TTS_MODEL}")
+            for event, pcm_bytes in events:
+                if event == "speech_start":
+                    if Config.BARGE_IN_ENABLED:
+                        await interrupt("speech")
+                    transcriber = StreamingTranscriber(get_router("transcription"), vad.sample_rate if vad else Config.STREAM_SAMPLE_RATE, Config.LOCAL_MODEL_PATH, on_partial=send_partial_transcript)
+                    if speculator is not None:
+                        speculator.speculate()
+                elif event == "segment" and transcriber is not None:
+                    transcriber.add_segment(pcm_bytes)
+                elif event == "utterance_end" and transcriber is not None:
+                    if turn is not None:
+                        await asyncio.wait([turn])
+                    turn, turn_began = asyncio.create_task(run_in_background(answer_stream((carried or []) + [transcriber]))), time.perf_counter()
+                    transcriber = carried = None
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
     except Exception as e:
         logging.error(Fore.RED + f"An error occurred: {e}" + Fore.RESET)
-        delete_file(Config.INPUT_AUDIO)
-        if 'output_file' in locals() and os.path.exists(output_file):
-            delete_file(output_file)
-        time.sleep(1)
\ No newline at end of file
+    finally:
+        for utterance in [transcriber] + (carried or []):
+            if utterance is not None:
+                utterance.cancel()
+        if turn is not None:
+            turn.cancel()
+        await manager.disconnect(websocket)
+
+if __name__ == "__main__":
+    # Several workers can share the port: conversations and bookings are kept in SQLite
+    import uvicorn
+    Config.validate_config()
+    uvicorn.run("main:app", host=Config.HOST, port=Config.PORT, workers=Config.WORKERS)
@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+from voice_assistant.config import Config
+
+# Modules that open shared databases at import time get throwaway ones
+_directory = tempfile.mkdtemp(prefix="voice-assistant-tests-")
+Config.BOOKING_DB = os.path.join(_directory, "bookings.db")
+Config.SESSION_DB = os.path.join(_directory, "sessions.db")
+Config.ROSTER_POLL_INTERVAL = 3600
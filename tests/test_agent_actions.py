@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from voice_assistant import agent_actions
+from voice_assistant.availability import AvailabilityStore
+from voice_assistant.booking_service import BookingService
+
+ROSTER = [
+    {"name": "Dr. Ali", "specialty": "Cardiologist", "available_slots": ["2024-09-25 09:00", "2024-09-25 10:00"]},
+    {"name": "Dr. Bilal", "specialty": "Dentist", "available_slots": ["2024-09-26 11:00", "2024-09-26 12:00"]},
+]
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    # The booking tools work on a store and booking database of this test's own
+    service = BookingService(str(tmp_path / "bookings.db"), hold_ttl=60)
+    monkeypatch.setattr(agent_actions, "availability", AvailabilityStore(ROSTER))
+    monkeypatch.setattr(agent_actions, "booking_service", service)
+    monkeypatch.setattr(agent_actions, "_last_event_id", 0)
+    monkeypatch.setattr(agent_actions, "_tool_cache_version", None)
+    return service
+
+
+def status(result):
+    return json.loads(result)['status']
+
+
+def test_schedule_books_slot(service):
+    assert status(agent_actions.schedule_meeting("Dr. Ali", "Bob", "2024-09-25 10:00")) == "success"
+    assert not agent_actions.check_doctor_availability("Dr. Ali", "2024-09-25 10:00")
+    assert service.meetings() == [{"doctor": "Dr. Ali", "patient": "Bob", "time": "2024-09-25 10:00"}]
+
+
+def test_unknown_hold_token_leaves_slot_free(service):
+    assert status(agent_actions.schedule_meeting("Dr. Ali", "Bob", "2024-09-25 10:00", hold_token="bogus")) == "error"
+    assert agent_actions.check_doctor_availability("Dr. Ali", "2024-09-25 10:00")
+    assert service.meetings() == []
+
+
+def test_failed_booking_of_held_slot_keeps_it_listed(service):
+    held = service.reserve("Dr. Bilal", "2024-09-26 12:00", "X")
+    assert status(agent_actions.schedule_meeting("Dr. Bilal", "Y", "2024-09-26 12:00")) == "error"
+    # A failed attempt on a held slot does not take it out of this worker's availability
+    assert agent_actions.check_doctor_availability("Dr. Bilal", "2024-09-26 12:00")
+    assert service.release(held)
+    listed = json.loads(agent_actions.show_available_doctors("Dentist"))
+    assert listed['doctors'][0]['slots'] == ["2024-09-26 11:00", "2024-09-26 12:00"]
+
+
+def test_token_for_another_slot_keeps_that_hold(service):
+    token = json.loads(agent_actions.hold_meeting("Dr. Ali", "X", "2024-09-25 09:00"))['hold_token']
+    assert status(agent_actions.schedule_meeting("Dr. Ali", "Y", "2024-09-25 10:00", hold_token=token)) == "error"
+    assert agent_actions.check_doctor_availability("Dr. Ali", "2024-09-25 10:00")
+    assert status(agent_actions.schedule_meeting("Dr. Ali", "X", "2024-09-25 09:00", hold_token=token)) == "success"
+    assert service.meetings() == [{"doctor": "Dr. Ali", "patient": "X", "time": "2024-09-25 09:00"}]
+
+
+def test_slot_booked_by_another_worker_is_taken_locally(service):
+    assert service.book("Dr. Ali", "2024-09-25 09:00", "Elsewhere")
+    assert agent_actions.check_doctor_availability("Dr. Ali", "2024-09-25 09:00") is False
+    assert status(agent_actions.schedule_meeting("Dr. Ali", "Bob", "2024-09-25 09:00")) == "error"
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+
+import pytest
+
+from voice_assistant import booking_journal
+from voice_assistant.booking_journal import BookingJournal
+
+
+def meeting(index):
+    return {"doctor": f"Dr. {index % 3}", "patient": f"P{index}", "time": f"2024-09-25 {9 + index % 8:02d}:00"}
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "meetings.journal"), str(tmp_path / "meetings.snapshot")
+
+
+def test_torn_last_record_is_dropped_on_replay(paths):
+    journal = BookingJournal(*paths, compact_every=0)
+    for index in range(5):
+        journal.append("book", meeting(index))
+    journal.append("cancel", meeting(1))
+    expected = list(journal.meetings)
+    journal.append("book", meeting(9))
+    journal.close()
+
+    # Crash halfway through writing the last record
+    with open(paths[0], "rb") as file:
+        data = file.read()
+    last = data.rstrip(b"\n").rfind(b"\n") + 1
+    with open(paths[0], "wb") as file:
+        file.write(data[:last + (len(data) - last) // 2])
+
+    journal = BookingJournal(*paths, compact_every=0)
+    assert journal.meetings == expected
+    assert os.path.getsize(paths[0]) == last
+    # The torn record's number is reused, and the journal reads back cleanly
+    assert journal.append("book", meeting(10)) == 7
+    journal.close()
+    journal = BookingJournal(*paths, compact_every=0)
+    assert journal.meetings == expected + [meeting(10)]
+    journal.close()
+
+
+def test_replay_after_compaction_restores_same_state(paths):
+    journal = BookingJournal(*paths, compact_every=0)
+    for index in range(6):
+        journal.append("book", meeting(index))
+    journal.append("cancel", meeting(2))
+    journal.compact()
+    assert os.path.getsize(paths[0]) == 0
+    journal.append("book", meeting(20))
+    journal.append("cancel", meeting(0))
+    expected = list(journal.meetings)
+    journal.close()
+
+    with open(paths[1], encoding="utf-8") as file:
+        assert json.load(file)['seq'] == 7
+    journal = BookingJournal(*paths, compact_every=0)
+    assert journal.meetings == expected
+    assert journal.append("book", meeting(21)) == 10
+    journal.close()
+
+
+def test_automatic_compaction_keeps_every_record(paths):
+    journal = BookingJournal(*paths, commit_interval=0, compact_every=4)
+    for index in range(10):
+        journal.append("book", meeting(index))
+    expected = list(journal.meetings)
+    journal.close()
+    assert os.path.exists(paths[1])
+    journal = BookingJournal(*paths)
+    assert journal.meetings == expected
+    journal.close()
+
+
+def test_concurrent_appenders_share_one_fsync(paths, monkeypatch):
+    journal = BookingJournal(*paths, commit_interval=0.3, compact_every=0)
+    fsyncs = []
+    fsync = os.fsync
+
+    def counting_fsync(fd):
+        fsyncs.append(fd)
+        fsync(fd)
+
+    monkeypatch.setattr(booking_journal.os, "fsync", counting_fsync)
+    start = threading.Barrier(8)
+    durable = []
+
+    def worker(index):
+        start.wait()
+        seq = journal.append("book", meeting(index))
+        # Once append returns the record is on disk
+        with open(paths[0], encoding="utf-8") as file:
+            durable.append(any(json.loads(line)['seq'] == seq for line in file))
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    assert durable == [True] * 8
+    assert len(fsyncs) == 1
+    journal = BookingJournal(*paths)
+    assert sorted(m['patient'] for m in journal.meetings) == sorted(f"P{index}" for index in range(8))
+    journal.close()
@@ -0,0 +1,94 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from voice_assistant.booking_service import BookingService, _stress_worker
+
+SLOTS = [("Dr. Ali", "2024-09-25 09:00"), ("Dr. Ali", "2024-09-25 10:00")]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "bookings.db")
+
+
+def test_book_takes_a_slot_once(path):
+    service = BookingService(path)
+    assert service.book("Dr. Ali", "2024-09-25 09:00", "X")
+    assert not service.book("Dr. Ali", "2024-09-25 09:00", "Y")
+    assert not service.reserve("Dr. Ali", "2024-09-25 09:00", "Y")
+    assert service.meetings() == [{"doctor": "Dr. Ali", "patient": "X", "time": "2024-09-25 09:00"}]
+
+
+def test_racing_threads_book_each_slot_once(path):
+    service = BookingService(path)
+    start = threading.Barrier(8)
+    wins = []
+
+    def worker(index):
+        start.wait()
+        for attempt in range(20):
+            doctor, slot = SLOTS[attempt % len(SLOTS)]
+            if attempt % 2:
+                token = service.reserve(doctor, slot, f"t{index}")
+                wins.append(token is not None and service.confirm(token) is not None)
+            else:
+                wins.append(service.book(doctor, slot, f"t{index}"))
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(wins) == len(SLOTS) == len(service.meetings()) == len(service.events_after(0))
+
+
+def test_racing_processes_book_each_slot_once(path):
+    service = BookingService(path)
+    results = multiprocessing.Queue()
+    start_at = time.time() + 0.5
+    processes = [multiprocessing.Process(target=_stress_worker, args=(path, SLOTS, 20, f"p{index}", start_at, results))
+                 for index in range(4)]
+    for process in processes:
+        process.start()
+    wins = sum(results.get(timeout=30) for _ in processes)
+    for process in processes:
+        process.join()
+    assert wins == len(SLOTS) == len(service.meetings()) == len(service.events_after(0))
+
+
+def test_hold_blocks_slot_until_it_expires(path):
+    service = BookingService(path)
+    token = service.reserve("Dr. Ali", "2024-09-25 09:00", "X", ttl=0.2)
+    assert token
+    assert not service.is_free("Dr. Ali", "2024-09-25 09:00")
+    assert not service.book("Dr. Ali", "2024-09-25 09:00", "Y")
+    time.sleep(0.3)
+    assert service.is_free("Dr. Ali", "2024-09-25 09:00")
+    assert service.confirm(token) is None
+    assert service.book("Dr. Ali", "2024-09-25 09:00", "Y")
+    assert service.meetings() == [{"doctor": "Dr. Ali", "patient": "Y", "time": "2024-09-25 09:00"}]
+
+
+def test_expired_hold_can_be_taken_by_another_hold(path):
+    service = BookingService(path)
+    first = service.reserve("Dr. Ali", "2024-09-25 09:00", "X", ttl=0.1)
+    time.sleep(0.2)
+    second = service.reserve("Dr. Ali", "2024-09-25 09:00", "Y")
+    assert second and second != first
+    assert not service.release(first)
+    assert service.confirm(second) == {"doctor": "Dr. Ali", "patient": "Y", "time": "2024-09-25 09:00"}
+
+
+def test_release_and_cancel_free_the_slot(path):
+    service = BookingService(path)
+    token = service.reserve("Dr. Ali", "2024-09-25 09:00", "X")
+    assert service.release(token)
+    assert service.is_free("Dr. Ali", "2024-09-25 09:00")
+    assert service.book("Dr. Ali", "2024-09-25 09:00", "Y")
+    assert service.cancel("Dr. Ali", "2024-09-25 09:00")
+    assert not service.cancel("Dr. Ali", "2024-09-25 09:00")
+    assert [event[1:] for event in service.events_after(0)] == [("book", "Dr. Ali", "2024-09-25 09:00", "Y"),
+                                                                ("cancel", "Dr. Ali", "2024-09-25 09:00", "Y")]
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from voice_assistant.availability import AvailabilityStore
+from voice_assistant.intent_router import IntentRouter, find_name
+
+ROSTER = [
+    {"name": "Dr. Ali", "specialty": "Cardiologist", "available_slots": ["2024-09-25 09:00", "2024-09-25 10:00"]},
+    {"name": "Dr. Bilal", "specialty": "Dentist", "available_slots": ["2024-09-26 11:00", "2024-09-26 12:00"]},
+]
+
+
+@pytest.fixture
+def router():
+    store = AvailabilityStore(ROSTER)
+    bookings = []
+
+    def schedule_meeting(doctor_name, patient_name, requested_time):
+        bookings.append((doctor_name, patient_name, requested_time))
+        return json.dumps({"status": "success" if store.book(doctor_name, requested_time) else "error"})
+
+    router = IntentRouter(store, schedule_meeting, "2024-09-24")
+    router.bookings = bookings
+    return router
+
+
+@pytest.mark.parametrize("text, name", [
+    ("My name is Sara Khan", "Sara Khan"),
+    ("Hi, I'm Sara.", "Sara"),
+    ("my name is john and i want to book dr ali", "John"),
+    ("Please call me tomorrow", None),
+    ("Call me back later", None),
+    ("It's Tuesday.", None),
+    ("My name is Dr. Ali", None),
+    ("I want to book a meeting", None),
+])
+def test_find_name(text, name):
+    assert find_name(text) == name
+
+
+def test_name_stops_before_rest_of_booking(router):
+    result = router.route("My name is John and I want to book Dr. Ali tomorrow at 9 am")
+    assert result['intent'] == "schedule_meeting"
+    assert router.bookings == [("Dr. Ali", "John", "2024-09-25 09:00")]
+    assert router.patient_name == "John"
+
+
+def test_non_names_are_not_learned(router):
+    router.route("My name is Sara")
+    router.route("Please call me tomorrow")
+    router.route("It's Tuesday.")
+    assert router.patient_name == "Sara"
+
+
+def test_name_on_turn_left_to_model_is_not_learned(router):
+    router.route("My name is Sara")
+    assert router.route("My name is Tom and I want to cancel my appointment") is None
+    assert router.patient_name == "Sara"
+
+
+def test_preview_does_not_learn_name(router):
+    assert router.preview("My name is Sara")['intent'] == "introduce"
+    assert router.patient_name is None
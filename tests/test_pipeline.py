@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from voice_assistant import pipeline
+from voice_assistant.config import Config
+
+
+@pytest.fixture(autouse=True)
+def stages(monkeypatch):
+    # Short timeouts, and semaphores for this test's own event loop
+    monkeypatch.setattr(Config, "STAGE_TIMEOUTS", {"test": 0.2})
+    monkeypatch.setattr(Config, "STAGE_CONCURRENCY", {"test": 1})
+    monkeypatch.setattr(pipeline, "_semaphores", {})
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_run_stage_returns_result():
+    assert asyncio.run(pipeline.run_stage("test", lambda x, y=0: x + y, 1, y=2)) == 3
+
+
+def test_run_stage_times_out():
+    started = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(pipeline.run_stage("test", time.sleep, 1))
+    assert time.perf_counter() - started < 1
+
+
+def test_run_stage_limits_concurrency():
+    running, most = [0], [0]
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    async def calls():
+        await asyncio.gather(*(pipeline.run_stage("test", call) for _ in range(4)))
+
+    asyncio.run(calls())
+    assert most[0] == 1
+
+
+def test_stream_stage_yields_items():
+    assert asyncio.run(collect(pipeline.stream_stage("test", lambda: iter([1, 2, 3])))) == [1, 2, 3]
+
+
+def test_stream_stage_times_out_and_closes_stalled_stream():
+    closed = threading.Event()
+
+    def stream():
+        try:
+            yield 1
+            time.sleep(0.5)
+            yield 2
+        finally:
+            closed.set()
+
+    items = []
+
+    async def consume():
+        async for item in pipeline.stream_stage("test", stream):
+            items.append(item)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(consume())
+    assert items == [1]
+    # The abandoned stream is closed once the stalled item arrives
+    assert closed.wait(2)
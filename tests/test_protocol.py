@@ -0,0 +1,191 @@
+import asyncio
+import json
+
+import pytest
+
+from voice_assistant import protocol
+from voice_assistant.protocol import (AUDIO, AUDIO_END, AUDIO_LANE, AUDIO_START, CONTROL, ENCODED, ERROR,
+                                      MESSAGE_NAMES, NO_CODEC, PCM_S16LE, RESPONSE_DELTA, TEXT, TRANSCRIPT_PARTIAL,
+                                      ProtocolError, SendQueue, decode_frame, encode_frame, read_message)
+
+PAYLOADS = {
+    CONTROL: {"type": "interrupted"},
+    AUDIO_START: {"encoding": "pcm_s16le", "sample_rate": 16000, "channels": 1},
+    AUDIO: bytes(range(256)),
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(protocol, "protocol_stats", dict.fromkeys(protocol.protocol_stats, 0))
+
+
+class FakeSocket:
+    # Records what was written; while `gate` is clear, every write waits for it
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.gate.wait()
+        self.sent.append(data)
+
+
+def sent_types(socket):
+    return [decode_frame(frame)[0] for frame in socket.sent]
+
+
+@pytest.mark.parametrize("message_type", sorted(MESSAGE_NAMES))
+def test_frame_round_trips(message_type):
+    if message_type in PAYLOADS:
+        payload = PAYLOADS[message_type]
+    elif message_type in (protocol.RESPONSE_END, AUDIO_END):
+        payload = b""
+    else:
+        payload = f"Dr. Ali is free at 9:00 ({MESSAGE_NAMES[message_type]}) ✓"
+    codec = PCM_S16LE if message_type == AUDIO else NO_CODEC
+    frame = encode_frame(message_type, payload, seq=0xFFFFFFFF, codec=codec)
+    assert decode_frame(frame) == (message_type, codec, 0xFFFFFFFF, payload)
+
+
+def test_read_message_accepts_client_frames_only():
+    control = {"bytes": encode_frame(CONTROL, {"type": "start_stream"})}
+    audio = {"bytes": encode_frame(AUDIO, b"\x00\x01", codec=ENCODED)}
+    assert read_message(control, 1) == (CONTROL, NO_CODEC, {"type": "start_stream"})
+    assert read_message(audio, 1) == (AUDIO, ENCODED, b"\x00\x01")
+    for message in ({"text": '{"type": "stop"}'}, {"bytes": encode_frame(TEXT, "hi")},
+                    {"bytes": encode_frame(CONTROL, {"no": "type"})}, {"bytes": b"\x01"}):
+        with pytest.raises(ProtocolError):
+            read_message(message, 1)
+    assert protocol.protocol_stats['protocol_errors'] == 4
+
+
+def test_legacy_text_passes_through():
+    assert read_message({"text": '{"type": "stop"}'}, 0) == (CONTROL, NO_CODEC, {"type": "stop"})
+    assert read_message({"text": "hello"}, 0) == (CONTROL, NO_CODEC, {})
+    assert read_message({"bytes": b"\x00\x01"}, 0) == (AUDIO, NO_CODEC, b"\x00\x01")
+
+    async def scenario():
+        socket = FakeSocket()
+        queue = SendQueue(socket, version=0)
+        await queue.send(TEXT, "Hello, how can I help?")
+        await queue.send(RESPONSE_DELTA, "Dr. Ali ")
+        await queue.send(ERROR, "timeout")
+        await queue.send(AUDIO, b"\x00\x01")
+        await queue.drain()
+        await queue.close()
+        return socket.sent
+
+    # The error, queued last but one, still goes out first in its lane
+    assert asyncio.run(scenario()) == ["Error: timeout", "Hello, how can I help?",
+                                       json.dumps({"type": "response_delta", "text": "Dr. Ali "}), b"\x00\x01"]
+
+
+def test_control_overtakes_queued_audio():
+    async def scenario():
+        socket = FakeSocket()
+        socket.gate.clear()
+        queue = SendQueue(socket)
+        for _ in range(3):
+            await queue.send(AUDIO, bytes(100), codec=PCM_S16LE)
+        await queue.send(AUDIO_END)
+        # The writer is stuck on the first chunk while these are queued
+        await asyncio.sleep(0.01)
+        await queue.send(RESPONSE_DELTA, "text")
+        await queue.send(CONTROL, {"type": "interrupted"})
+        socket.gate.set()
+        await queue.drain()
+        await queue.close()
+        return socket
+
+    socket = asyncio.run(scenario())
+    assert sent_types(socket) == [AUDIO, CONTROL, RESPONSE_DELTA, AUDIO, AUDIO, AUDIO_END]
+    # Sequence numbers follow the order messages were queued in
+    assert [decode_frame(frame)[2] for frame in socket.sent] == [1, 6, 5, 2, 3, 4]
+
+
+def test_clear_drops_queued_audio_on_interrupt():
+    async def scenario():
+        socket = FakeSocket()
+        socket.gate.clear()
+        queue = SendQueue(socket)
+        await queue.send(AUDIO_START, PAYLOADS[AUDIO_START])
+        for _ in range(3):
+            await queue.send(AUDIO, bytes(100), codec=PCM_S16LE)
+        await queue.send(AUDIO_END)
+        await asyncio.sleep(0.01)
+        # Barge-in: the reply's audio still waiting is dropped, the interrupted notice goes out
+        dropped = queue.clear(AUDIO_LANE)
+        await queue.send(CONTROL, {"type": "interrupted"})
+        socket.gate.set()
+        await queue.drain()
+        await queue.close()
+        return socket, queue, dropped
+
+    socket, queue, dropped = asyncio.run(scenario())
+    assert dropped == 4
+    assert sent_types(socket) == [AUDIO_START, CONTROL]
+    assert queue.queued_bytes == 0
+    assert protocol.protocol_stats['frames_cleared'] == 4
+
+
+def test_partial_transcripts_coalesce():
+    async def scenario():
+        socket = FakeSocket()
+        socket.gate.clear()
+        queue = SendQueue(socket)
+        await queue.send(TEXT, "greeting")
+        await asyncio.sleep(0.01)
+        for text in ("book", "book me", "book me with"):
+            await queue.send(TRANSCRIPT_PARTIAL, text)
+        socket.gate.set()
+        await queue.drain()
+        await queue.close()
+        return socket
+
+    socket = asyncio.run(scenario())
+    assert [decode_frame(frame)[3] for frame in socket.sent] == ["greeting", "book me with"]
+    assert protocol.protocol_stats['partials_coalesced'] == 2
+
+
+def test_audio_send_waits_for_room_and_resumes_when_drained():
+    async def scenario():
+        socket = FakeSocket()
+        socket.gate.clear()
+        queue = SendQueue(socket, max_bytes=150)
+        await queue.send(AUDIO, bytes(100), codec=PCM_S16LE)
+        # Text never waits, even over the limit
+        await asyncio.wait_for(queue.send(TEXT, "x" * 100), 1)
+        blocked = asyncio.create_task(queue.send(AUDIO, bytes(100), codec=PCM_S16LE))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        assert queue.queued_bytes == 200
+        socket.gate.set()
+        await asyncio.wait_for(blocked, 1)
+        await queue.drain()
+        await queue.close()
+        return socket
+
+    socket = asyncio.run(scenario())
+    assert sent_types(socket) == [AUDIO, TEXT, AUDIO]
+    assert protocol.protocol_stats['backpressure_waits'] == 1
+    assert protocol.protocol_stats['max_queued_bytes'] == 200
+
+
+def test_blocked_sender_is_released_when_client_is_dropped():
+    async def scenario():
+        socket = FakeSocket()
+        socket.gate.clear()
+        queue = SendQueue(socket, max_bytes=100, send_timeout=0.05)
+        await queue.send(AUDIO, bytes(100), codec=PCM_S16LE)
+        with pytest.raises(protocol.WebSocketDisconnect):
+            await asyncio.wait_for(queue.send(AUDIO, bytes(100), codec=PCM_S16LE), 1)
+        await queue.close()
+
+    asyncio.run(scenario())
+    assert protocol.protocol_stats['send_timeouts'] == 1
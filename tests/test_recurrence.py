@@ -0,0 +1,165 @@
+import datetime
+import heapq
+import itertools
+import random
+
+import pytest
+
+from voice_assistant import agent_actions
+from voice_assistant.availability import AvailabilityStore, _rule_entries, _rule_entries_before, format_slot, parse_slot
+from voice_assistant.booking_service import BookingService
+from voice_assistant.config import Config
+from voice_assistant.recurrence import DEFAULT_HORIZON_DAYS, AvailabilityRule
+
+START_DAY = datetime.date(2024, 9, 25)
+SPECIALTIES = ["Cardiologist", "Dentist"]
+
+
+def make_spec(i, days):
+    return {
+        "slot_minutes": [15, 20, 30][i % 3],
+        "from": START_DAY.isoformat(),
+        "until": (START_DAY + datetime.timedelta(days=days - 1)).isoformat(),
+        "weekly": {"monday": ["09:00-12:00", "14:00-17:00"], "wednesday": ["08:30-12:10"],
+                   "friday": [f"{9 + i % 3:02d}:00-13:00"], "saturday": ["10:00-11:00"] if i % 2 else []},
+        "exceptions": {(START_DAY + datetime.timedelta(days=2 + 7 * i)).isoformat(): ["07:00-08:00"],
+                       (START_DAY + datetime.timedelta(days=5)).isoformat(): ["13:00-15:00"]},
+        "holidays": [(START_DAY + datetime.timedelta(days=12)).isoformat()],
+    }
+
+
+def expand(rule):
+    return [format_slot(slot) for slot in rule.iter_from(today=parse_slot(Config.TODAY).date())]
+
+
+# Without "from" and "until" a rule runs from Config.TODAY, like the explicit slots it is compared with
+OPEN_SPEC = {"slot_minutes": 30, "weekly": {"monday": ["09:00-10:00"], "thursday": ["15:00-16:30"]},
+             "exceptions": {(START_DAY + datetime.timedelta(days=6)).isoformat(): ["08:00-09:00"]},
+             "holidays": [(START_DAY + datetime.timedelta(days=9)).isoformat()]}
+RULE_ROSTER = [{"name": f"Dr. Rule {i}", "specialty": SPECIALTIES[i % 2], "availability": make_spec(i, 60),
+                "available_slots": ["2024-09-26 18:00", "2024-10-07 09:00"]} for i in range(6)]
+RULE_ROSTER.append({"name": "Dr. Open", "specialty": "Dentist", "availability": OPEN_SPEC, "available_slots": ["2024-09-26 18:00"]})
+EXPLICIT_ROSTER = [{"name": entry['name'], "specialty": entry['specialty'],
+                    "available_slots": sorted(set(expand(AvailabilityRule.from_dict(entry['availability'])) + entry['available_slots']))}
+                   for entry in RULE_ROSTER]
+PLAIN = [{"name": "Dr. Plain", "specialty": "Dentist", "available_slots": ["2024-09-25 09:00", "2024-10-01 16:45"]}]
+
+
+@pytest.mark.parametrize("i", range(6))
+def test_rule_arithmetic_matches_expansion(i):
+    generator = random.Random(i)
+    rule = AvailabilityRule.from_dict(make_spec(i, 60))
+    slots = list(rule.iter_from())
+    assert all(rule.contains(slot) for slot in slots)
+    assert list(rule.iter_before(slots[-1] + datetime.timedelta(minutes=1))) == slots[::-1]
+    for _ in range(200):
+        low, high = sorted(datetime.datetime.combine(START_DAY, datetime.time()) + datetime.timedelta(minutes=generator.randrange(-2000, 90000))
+                           for _ in range(2))
+        assert rule.count(low, high) == sum(low <= slot < high for slot in slots), (low, high)
+
+
+def test_open_ended_rule_is_bounded_at_query_time():
+    rule = AvailabilityRule.from_dict({"weekly": {"monday": ["09:00-10:00"]}})
+    assert rule.start is None and rule.end is None
+    assert "from" not in rule.to_dict() and "until" not in rule.to_dict()
+    # Slots keep coming however far past today the query starts
+    later = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=3 * DEFAULT_HORIZON_DAYS), datetime.time())
+    assert rule.contains(next(rule.iter_from(later)))
+    assert next(rule.iter_from(later)) >= later
+    # Each query walks at most the horizon
+    assert rule.count(later) == len(list(rule.iter_from(later)))
+    assert len(list(rule.iter_from(later))) <= 4 * (DEFAULT_HORIZON_DAYS // 7 + 1)
+    assert len(list(rule.iter_before(later))) <= 4 * (DEFAULT_HORIZON_DAYS // 7 + 1)
+
+
+def test_open_ended_rule_doctor_counts_bookings_in_window():
+    store = AvailabilityStore([{"name": "Dr. Open", "specialty": "Dentist",
+                                "availability": {"from": START_DAY.isoformat(), "weekly": {"monday": ["09:00-10:00"]}}}])
+    start = datetime.datetime(2024, 9, 30, 9)
+    free = store.count_slots("Dr. Open", start)
+    far = start + datetime.timedelta(days=7 * (DEFAULT_HORIZON_DAYS // 7 + 10))
+    assert store.book("Dr. Open", format_slot(far))
+    assert store.count_slots("Dr. Open", start) == free
+    assert store.book("Dr. Open", format_slot(start))
+    assert store.count_slots("Dr. Open", start) == free - 1
+
+
+@pytest.fixture
+def setups(tmp_path):
+    # The same doctors, once listed slot by slot and once as rules, each with a booking database of its own
+    return [{"store": AvailabilityStore(roster + PLAIN), "service": BookingService(str(tmp_path / f"{label}.db")), "last_event": 0}
+            for label, roster in (("explicit", EXPLICIT_ROSTER), ("rule", RULE_ROSTER))]
+
+
+def test_rule_doctors_answer_like_explicit_slots(setups, monkeypatch):
+    generator = random.Random(7)
+    all_slots = sorted({slot for entry in EXPLICIT_ROSTER for slot in entry['available_slots']})
+    names = [entry['name'] for entry in RULE_ROSTER] + ["Dr. Plain", "Dr. Nobody"]
+
+    def run(setup, operation):
+        monkeypatch.setattr(agent_actions, "availability", setup['store'])
+        monkeypatch.setattr(agent_actions, "booking_service", setup['service'])
+        monkeypatch.setattr(agent_actions, "_last_event_id", setup['last_event'])
+        monkeypatch.setattr(agent_actions, "_tool_cache_version", None)
+        store = setup['store']
+        kind, name, slot, target, specialty = operation
+        if kind == "check":
+            result = agent_actions.check_doctor_availability(name, slot)
+        elif kind == "schedule":
+            result = agent_actions.schedule_meeting(name, "Patient", slot)
+        elif kind == "cancel":
+            result = setup['service'].cancel(name, slot) and store.release(name, slot)
+        elif kind == "next":
+            result = agent_actions.find_next_slots(specialty, 7, format_slot(target))
+        elif kind == "window":
+            result = agent_actions.find_slots_in_window(format_slot(target), format_slot(target + datetime.timedelta(hours=30)), specialty)
+        elif kind == "nearest":
+            result = agent_actions.find_nearest_slot(format_slot(target), specialty, name if slot.endswith("0") else None)
+        elif kind == "list":
+            result = agent_actions.show_available_doctors(specialty, target.date().isoformat(), None, 3, 1)
+        else:
+            result = (store.doctor_slots(name, target, target + datetime.timedelta(days=3), 5), store.count_slots(name, target),
+                      store.count_slots(name, None, target))
+        setup['last_event'] = agent_actions._last_event_id
+        return result
+
+    for _ in range(2000):
+        kind = generator.choice(["check", "schedule", "schedule", "cancel", "next", "window", "nearest", "list", "slots"])
+        slot = generator.choice(all_slots) if generator.random() < 0.8 else \
+            format_slot(datetime.datetime.combine(START_DAY, datetime.time(9)) + datetime.timedelta(minutes=5 * generator.randrange(20000)))
+        target = datetime.datetime.combine(START_DAY, datetime.time()) + datetime.timedelta(minutes=generator.randrange(-3000, 90000))
+        operation = (kind, generator.choice(names), slot, target, generator.choice(SPECIALTIES + [None]))
+        explicit, rule = (run(setup, operation) for setup in setups)
+        assert explicit == rule, operation
+    assert setups[0]['service'].meetings() == setups[1]['service'].meetings()
+    assert setups[0]['service'].meetings()
+
+
+def test_rule_index_matches_per_doctor_walks():
+    # The weekly index against merging one generator per rule doctor, the way queries used to run
+    generator = random.Random(3)
+    specs = [make_spec(i, 60) for i in range(3)] + [
+        OPEN_SPEC,
+        dict(OPEN_SPEC, **{"from": "2024-12-02"}),
+        dict(make_spec(4, 30), **{"from": "2023-01-02", "until": "2023-03-01"}),
+        {"weekly": {"sunday": ["23:00-23:59"]}, "slot_minutes": 20, "until": "2026-01-01"},
+    ]
+    store = AvailabilityStore([{"name": f"Dr. {i}", "specialty": SPECIALTIES[i % 2], "availability": spec} for i, spec in enumerate(specs)])
+    today = store.today
+    origin = datetime.datetime.combine(today, datetime.time())
+    for _ in range(300):
+        slot = origin + datetime.timedelta(minutes=5 * generator.randrange(-20000, 120000))
+        store.book(f"Dr. {generator.randrange(len(specs))}", slot)
+    doctors = [store.get_doctor(f"Dr. {i}") for i in range(len(specs))]
+    for _ in range(300):
+        target = origin + datetime.timedelta(minutes=generator.randrange(-600000, 1800000), seconds=generator.choice([0, 30]))
+        specialty = generator.choice(SPECIALTIES + [None])
+        chosen = [doctor for doctor in doctors if specialty in (None, doctor['specialty'])]
+        expected = list(itertools.islice(heapq.merge(*(_rule_entries(doctor, target, today) for doctor in chosen)), 8))
+        assert store.next_slots(8, specialty, target) == expected, (target, specialty)
+        before = max((entry for entry in (next(_rule_entries_before(doctor, target, today), None) for doctor in chosen) if entry), default=None)
+        after = expected[0] if expected else None
+        candidates = [entry for entry in (before, after) if entry]
+        nearest = min(candidates, key=lambda entry: (abs(entry[0] - target), entry[0])) if candidates else None
+        assert store.nearest_slot(target, specialty) == nearest, (target, specialty)
+    assert store.next_slots(8) == list(itertools.islice(heapq.merge(*(_rule_entries(doctor, None, today) for doctor in doctors)), 8))
@@ -0,0 +1,107 @@
+import json
+import os
+
+import pytest
+
+from voice_assistant.availability import AvailabilityStore
+from voice_assistant.roster import RosterWatcher, iter_roster
+
+ROSTER = [
+    {"name": "Dr. Ali", "specialty": "Dentist", "available_slots": ["2024-09-25 09:00", "2024-09-25 10:00"]},
+    {"name": "Dr. Bea", "specialty": "Cardiologist", "available_slots": ["2024-09-25 11:00"]},
+    {"name": "Dr. Cho", "specialty": "Dentist", "available_slots": ["2024-09-26 09:00"]},
+    {"name": "Dr. Rule", "specialty": "Dentist", "available_slots": [],
+     "availability": {"from": "2024-09-25", "until": "2024-10-31", "weekly": {"wednesday": ["09:00-10:00"]}}},
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "doctors_data.json")
+
+
+def write_roster(path, roster):
+    # Step the mtime too, so every write is a change even within the clock's resolution
+    previous = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(roster, file, indent=4)
+    os.utime(path, ns=(previous + 10 ** 9, previous + 10 ** 9))
+
+
+def watch(path, booked=()):
+    watcher = RosterWatcher(path, booked_slots=lambda: set(booked))
+    watcher.store = AvailabilityStore(watcher.load())
+    touched = []
+    for method in ("add_doctor", "remove_doctor", "add_slots", "remove_slots"):
+        def spy(name, *args, _method=getattr(watcher.store, method), **kwargs):
+            touched.append(name)
+            return _method(name, *args, **kwargs)
+        setattr(watcher.store, method, spy)
+    return watcher, touched
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_iter_roster_reads_objects_across_chunks(path, chunk_size):
+    write_roster(path, ROSTER)
+    streamed = list(iter_roster(path, chunk_size=chunk_size))
+    assert [doctor for doctor, _ in streamed] == ROSTER
+    # The digest depends on the object's text, not on where the chunks fell
+    assert [digest for _, digest in streamed] == [digest for _, digest in iter_roster(path)]
+    assert len({digest for _, digest in streamed}) == len(ROSTER)
+
+
+@pytest.mark.parametrize("chunk_size", [5, 1 << 20])
+def test_iter_roster_rejects_truncated_file(path, chunk_size):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(json.dumps(ROSTER)[:-40])
+    with pytest.raises(ValueError, match="Truncated roster file"):
+        list(iter_roster(path, chunk_size=chunk_size))
+
+
+def test_reload_touches_only_changed_doctors(path):
+    write_roster(path, ROSTER)
+    watcher, touched = watch(path)
+    assert watcher.reload() is None
+
+    roster = [dict(doctor) for doctor in ROSTER if doctor['name'] != "Dr. Cho"]
+    roster[0]['available_slots'] = ["2024-09-25 10:00", "2024-09-25 12:00"]
+    roster.append({"name": "Dr. Dee", "specialty": "Dentist", "available_slots": ["2024-09-27 09:00"]})
+    write_roster(path, roster)
+    result = watcher.reload()
+
+    assert sorted(set(touched)) == ["Dr. Ali", "Dr. Cho", "Dr. Dee"]
+    assert (result['doctors_changed'], result['doctors_added'], result['doctors_removed']) == (1, 1, 1)
+    assert (result['slots_added'], result['slots_removed']) == (2, 2)
+    store = watcher.store
+    assert not store.is_available("Dr. Ali", "2024-09-25 09:00")
+    assert store.is_available("Dr. Ali", "2024-09-25 12:00")
+    assert store.get_doctor("Dr. Cho") is None
+    assert store.is_available("Dr. Dee", "2024-09-27 09:00")
+    assert store.is_available("Dr. Rule", "2024-10-02 09:15")
+
+
+def test_booked_slot_stays_booked_through_reload(path):
+    write_roster(path, ROSTER)
+    booked = {("Dr. Ali", "2024-09-25 09:00"), ("Dr. Rule", "2024-09-25 09:30")}
+    watcher, _ = watch(path, booked)
+    store = watcher.store
+    for name, slot in booked:
+        assert store.book(name, slot)
+
+    # The file drops Ali's booked slot and widens the rule's hours
+    roster = [dict(doctor) for doctor in ROSTER]
+    roster[0]['available_slots'] = ["2024-09-25 10:00", "2024-09-25 11:00"]
+    roster[3]['availability'] = dict(ROSTER[3]['availability'], weekly={"wednesday": ["09:00-11:00"]})
+    write_roster(path, roster)
+    watcher.reload()
+    assert not store.is_available("Dr. Ali", "2024-09-25 09:00")
+    assert store.is_available("Dr. Ali", "2024-09-25 11:00")
+    assert not store.is_available("Dr. Rule", "2024-09-25 09:30")
+    assert store.is_available("Dr. Rule", "2024-09-25 10:30")
+
+    # Listing the booked slot again does not free it
+    roster[0]['available_slots'] = ["2024-09-25 09:00", "2024-09-25 10:00", "2024-09-25 11:00"]
+    write_roster(path, roster)
+    watcher.reload()
+    assert not store.is_available("Dr. Ali", "2024-09-25 09:00")
+    assert not store.is_available("Dr. Rule", "2024-09-25 09:30")
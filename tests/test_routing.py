@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from voice_assistant import pipeline, routing
+from voice_assistant.routing import HedgeLost, ProviderHealth, ProviderRouter, commit
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # Counters of this test's own, and semaphores for its own event loop
+    monkeypatch.setattr(routing, "routing_stats", {})
+    monkeypatch.setattr(pipeline, "_semaphores", {})
+
+
+def test_hedge_fires_after_delay_and_loser_cannot_commit():
+    started = {}
+    lost = threading.Event()
+
+    def fake(model, api_key):
+        started[model] = time.perf_counter()
+        time.sleep(0.3 if model == "slow" else 0.01)
+        try:
+            commit()
+        except HedgeLost:
+            lost.set()
+            raise
+        return model
+
+    router = ProviderRouter("test", ["slow", "fast"], hedge_delay=0.05)
+    assert asyncio.run(router.call(fake)) == "fast"
+    assert started['fast'] - started['slow'] >= 0.04
+    assert router.stats['hedged'] == 1 and router.stats['hedge_wins'] == 1
+    # The abandoned attempt reaches its side effect later and is refused
+    assert lost.wait(2)
+
+
+def test_no_hedge_when_primary_answers_in_time():
+    calls = []
+
+    def fake(model, api_key):
+        calls.append(model)
+        return model
+
+    router = ProviderRouter("test", ["primary", "backup"], hedge_delay=0.2)
+    assert asyncio.run(router.call(fake)) == "primary"
+    assert calls == ["primary"] and router.stats['hedged'] == 0
+
+
+def test_fallback_runs_when_primary_errors():
+    def fake(model, api_key):
+        if model == "primary":
+            raise ConnectionError("503")
+        return model
+
+    router = ProviderRouter("test", ["primary", "backup"])
+    assert asyncio.run(router.call(fake)) == "backup"
+    assert router.stats['failovers'] == 1 and router.stats['failures'] == 0
+
+
+def test_error_raised_when_every_backend_fails():
+    def fake(model, api_key):
+        raise ConnectionError(model)
+
+    router = ProviderRouter("test", ["primary", "backup"])
+    with pytest.raises(ConnectionError):
+        asyncio.run(router.call(fake))
+    assert router.stats['failures'] == 1
+
+
+def test_stream_uses_first_backend_to_produce_an_item():
+    def fake(model, api_key):
+        time.sleep(0.3 if model == "slow" else 0.01)
+        yield model
+        yield "."
+
+    router = ProviderRouter("test", ["slow", "fast"], hedge_delay=0.05)
+
+    async def collect():
+        return [item async for item in router.stream(fake)]
+
+    assert asyncio.run(collect()) == ["fast", "."]
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown():
+    health = ProviderHealth(window=10, min_calls=4, error_rate=0.5, cooldown=30.0)
+    assert [health.record(0.1, ok) for ok in (True, False, True)] == [False, False, False]
+    assert health.state == "closed"
+    # The fourth call makes half of the window failures
+    assert health.record(0.1, False)
+    assert health.state == "open" and not health.available()
+    assert not health.available(health.opened_at + 29)
+    # One trial call after the cooldown; a failed trial opens it again
+    assert health.available(health.opened_at + 30)
+    assert health.state == "half_open"
+    assert not health.available(health.opened_at + 30)
+    health.record(0.1, False)
+    assert health.state == "open"
+    assert health.available(health.opened_at + 30)
+    health.record(0.1, True)
+    assert health.state == "closed" and health.available()
+
+
+def test_router_skips_backend_with_open_circuit():
+    calls = []
+
+    def fake(model, api_key):
+        calls.append(model)
+        if model == "primary":
+            raise ConnectionError("503")
+        return model
+
+    router = ProviderRouter("test", ["primary", "backup"], min_calls=2, error_rate=0.5, cooldown=30.0)
+
+    async def calls_in_turn(count):
+        return [await router.call(fake) for _ in range(count)]
+
+    assert asyncio.run(calls_in_turn(4)) == ["backup"] * 4
+    assert router.health['primary'].state == "open" and router.stats['circuit_opens'] == 1
+    assert calls == ["primary", "backup", "primary", "backup", "backup", "backup"]
+    assert router.candidates() == ["backup"]
@@ -0,0 +1,64 @@
+import asyncio
+
+from voice_assistant.streaming_transcription import StreamingTranscriber, finish_utterances
+
+
+class FakeRouter:
+    # Transcribes a segment to the words encoded in it, after a delay
+    providers = ["fake"]
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def call(self, func, wav_bytes, local_model_path, raise_errors=False):
+        await asyncio.sleep(self.delay)
+        return wav_bytes[44:].decode()
+
+
+def utterance(router, *words):
+    transcriber = StreamingTranscriber(router, 16000)
+    for word in words:
+        transcriber.add_segment(word.encode())
+    return transcriber
+
+
+def test_finish_joins_segments_in_order():
+    async def scenario():
+        return await utterance(FakeRouter(0.01), "book", "doctor", "ali").finish()
+
+    assert asyncio.run(scenario()) == "book doctor ali"
+
+
+def test_turn_cancelled_during_finish_carries_its_words():
+    async def scenario():
+        router = FakeRouter(0.1)
+        first = [utterance(router, "book", "me")]
+        turn = asyncio.create_task(finish_utterances(first))
+        await asyncio.sleep(0.02)
+        # Barge-in while the first utterance is still transcribing
+        turn.cancel()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            pass
+        second = first + [utterance(router, "with", "dr. ali")]
+        turn = asyncio.create_task(finish_utterances(second))
+        await asyncio.sleep(0.02)
+        turn.cancel()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            pass
+        # Both carried utterances and the new one make up the next turn
+        return await finish_utterances(second + [utterance(router, "tomorrow")])
+
+    assert asyncio.run(scenario()) == "book me with dr. ali tomorrow"
+
+
+def test_cancelled_utterance_does_not_fail_the_turn():
+    async def scenario():
+        abandoned = utterance(FakeRouter(0.1), "noise")
+        abandoned.cancel()
+        return await finish_utterances([abandoned, utterance(FakeRouter(0.01), "hello")])
+
+    assert asyncio.run(scenario()) == "hello"
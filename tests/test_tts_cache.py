@@ -0,0 +1,29 @@
+import os
+
+from voice_assistant.tts_cache import TTSCache
+
+
+def test_same_key_written_twice_is_counted_once(tmp_path):
+    cache = TTSCache(1000, str(tmp_path), 1000)
+    cache._write_disk("a", b"x" * 100)
+    cache._write_disk("a", b"x" * 100)
+    assert cache._disk_size == 100
+    assert os.listdir(tmp_path) == ["a.audio"]
+
+
+def test_disk_hit_evicted_before_promotion_is_served(tmp_path, monkeypatch):
+    cache = TTSCache(1000, str(tmp_path), 1000)
+    cache._write_disk("a", b"x" * 100)
+    read_disk = cache._read_disk
+
+    def read_then_evict(key):
+        audio = read_disk(key)
+        # Another thread evicts the entry between the read and the promotion
+        with cache._lock:
+            cache._disk_size -= cache._disk.pop(key)
+        return audio
+
+    monkeypatch.setattr(cache, "_read_disk", read_then_evict)
+    assert cache.get("a") == b"x" * 100
+    assert cache.stats['disk_hits'] == 1
+    assert "a" in cache and cache._disk_size == 0
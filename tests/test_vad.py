@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from voice_assistant.vad import VoiceActivityDetector
+
+RATE = 16000
+FRAME = 480  # 30 ms
+
+
+def silence(frames):
+    return np.zeros(frames * FRAME, dtype="<i2")
+
+
+def tone(frames, amplitude=3000, frequency=440.0):
+    t = np.arange(frames * FRAME) / RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype("<i2")
+
+
+def noise(frames, level=500, seed=0):
+    # Loud enough to pass the energy threshold, but crossing zero on every other sample
+    return np.random.default_rng(seed).normal(0, level, frames * FRAME).clip(-32768, 32767).astype("<i2")
+
+
+def events_by_frame(detector, *parts):
+    # Feed one frame at a time and note the frame index each event fired on
+    samples = np.concatenate(parts)
+    events = []
+    for index in range(len(samples) // FRAME):
+        for kind, data in detector.process(samples[index * FRAME:(index + 1) * FRAME].tobytes()):
+            events.append((index, kind, None if data is None else len(data) // 2 // FRAME))
+    return events
+
+
+def test_tone_starts_and_silence_ends_an_utterance():
+    detector = VoiceActivityDetector(RATE)
+    events = events_by_frame(detector, silence(20), tone(30), silence(40))
+    # 4 frames (120 ms) pass the 100 ms phrase threshold; 27 silent frames pass the 800 ms pause.
+    # The segment holds the 10-frame pre-roll (6 silent and 4 speech frames), the rest of the tone and the pause.
+    assert events == [(23, "speech_start", None), (76, "segment", 10 + 26 + 27), (76, "utterance_end", None)]
+    assert not detector.speaking
+
+
+def test_short_pause_is_bridged_by_hangover():
+    detector = VoiceActivityDetector(RATE, min_segment=10.0)
+    events = events_by_frame(detector, silence(10), tone(10), silence(20), tone(10), silence(30))
+    assert [(index, kind) for index, kind, _ in events] == [(13, "speech_start"), (76, "segment"), (76, "utterance_end")]
+
+
+def test_blip_shorter_than_phrase_threshold_is_ignored():
+    detector = VoiceActivityDetector(RATE)
+    assert events_by_frame(detector, silence(10), tone(3), silence(10), tone(2), silence(10)) == []
+
+
+@pytest.mark.parametrize("dynamic", [True, False])
+def test_noise_is_not_speech(dynamic):
+    detector = VoiceActivityDetector(RATE, dynamic_energy_threshold=dynamic)
+    assert events_by_frame(detector, noise(100)) == []
+    if dynamic:
+        # The threshold rises towards the background level
+        assert detector.energy_threshold > 600
+    # A voice over the same background still starts an utterance
+    events = events_by_frame(detector, tone(10) + noise(10, seed=1))
+    assert [(index, kind) for index, kind, _ in events] == [(3, "speech_start")]
+
+
+def test_long_utterance_is_split_at_short_pauses():
+    detector = VoiceActivityDetector(RATE, segment_pause=0.25)
+    events = events_by_frame(detector, silence(10), tone(40), silence(9), tone(10), silence(30))
+    # The first segment closes once 1 s of speech is followed by a 270 ms pause
+    assert events == [(13, "speech_start", None), (58, "segment", 10 + 36 + 9),
+                      (95, "segment", 10 + 27), (95, "utterance_end", None)]
+
+
+def test_frames_split_across_chunks():
+    samples = np.concatenate([silence(20), tone(30), silence(40)]).tobytes()
+    detector = VoiceActivityDetector(RATE)
+    events = []
+    for start in range(0, len(samples), 777):
+        events.extend(kind for kind, _ in detector.process(samples[start:start + 777]))
+    assert events == ["speech_start", "segment", "utterance_end"]
+
+
+def test_flush_ends_utterance_in_progress():
+    detector = VoiceActivityDetector(RATE)
+    assert [kind for _, kind, _ in events_by_frame(detector, silence(10), tone(20))] == ["speech_start"]
+    assert [kind for kind, _ in detector.flush()] == ["segment", "utterance_end"]
+    assert not detector.speaking
+    assert detector.flush() == []
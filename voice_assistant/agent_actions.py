@@ -1,164 +1,477 @@
+import atexit
+import contextvars
 import datetime
-import csv
 import json
-from groq import Groq
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from voice_assistant.config import Config
+from voice_assistant import metrics
+from voice_assistant.routing import commit
+from voice_assistant.availability import AvailabilityStore, parse_slot, format_slot
+from voice_assistant.booking_journal import BookingJournal, read_csv
+from voice_assistant.booking_service import BookingService
+from voice_assistant.roster import RosterWatcher
 
 MODEL = 'llama3-groq-70b-8192-tool-use-preview'
 
-# Doctor availability data
-doctors_data = [
-{
-    "name": "Dr. Ali",
-    "specialty": "Cardiologist",
-    "available_slots": [
-        "2024-09-25 09:00",
-        "2024-09-25 10:00"
-    ]
-},
-{
-    "name": "Dr. Bilal",
-    "specialty": "Dentist",
-    "available_slots": [
-        "2024-09-26 11:00",
-        "2024-09-26 12:00"
-    ]
-},
-{
-    "name": "Dr. Mehar",
-    "specialty": "Dermatologist",
-    "available_slots": [
-        "2024-09-27 14:00",
-        "2024-09-27 15:00"
-    ]
-},
-{
-    "name": "Dr. Rana",
-    "specialty": "Neurologist",
-    "available_slots": [
-        "2024-09-27 14:00",
-        "2024-09-27 15:00"
-    ]
-}
-]
+# Doctor roster, streamed from Config.ROSTER_FILE and kept in step with it by `roster`
+roster = RosterWatcher(Config.ROSTER_FILE, interval=Config.ROSTER_POLL_INTERVAL)
+availability = AvailabilityStore(roster.load())
+roster.store = availability
 
-# Storage for scheduled meetings
-scheduled_meetings = []
+# Storage for scheduled meetings: a SQLite booking service shared by every worker
+# process, or an append-only journal when a single process owns the bookings.
+# Either way only bookings are stored; free slots come from the roster.
+booking_service = None
+journal = None
+if Config.BOOKING_BACKEND == 'sqlite':
+    booking_service = BookingService(Config.BOOKING_DB, hold_ttl=Config.BOOKING_HOLD_TTL)
+else:
+    journal = BookingJournal(
+        Config.MEETINGS_JOURNAL,
+        Config.MEETINGS_SNAPSHOT,
+        commit_interval=Config.JOURNAL_COMMIT_INTERVAL,
+        compact_every=Config.JOURNAL_COMPACT_EVERY,
+    )
+    atexit.register(journal.close)
 meeting_file = 'doctor_meetings.csv'
 
+# Last booking-service event applied to `availability`
+_last_event_id = 0
+_sync_lock = threading.Lock()
+
+def sync_availability():
+    """
+    Apply bookings and cancellations made by other worker processes to `availability`.
+    """
+    global _last_event_id
+    if booking_service is None:
+        return
+    with _sync_lock:
+        for event_id, op, doctor, slot, _ in booking_service.events_after(_last_event_id):
+            if op == "book":
+                availability.book(doctor, slot)
+            else:
+                availability.release(doctor, slot)
+            _last_event_id = event_id
+
+# Tool results cached until availability changes
+_tool_cache = {}
+_tool_cache_version = None
+_tool_cache_lock = threading.Lock()
+
 # Show available doctors
-def show_available_doctors():
+def show_available_doctors(specialty=None, date_from=None, date_to=None, limit=10, offset=0):
     """
-    Returns the list of available doctors and their specialties in JSON format.
+    Returns one page of doctors with free slots as compact JSON.
+
+    Args:
+    specialty (str): Only this specialty, e.g. "Dentist".
+    date_from (str): Earliest day or slot, "YYYY-MM-DD" or "YYYY-MM-DD HH:MM".
+    date_to (str): Last day (inclusive) or slot (exclusive).
+    limit (int): Doctors per page, at most Config.TOOL_MAX_PAGE_SIZE.
+    offset (int): Doctors to skip, for the next page.
+
+    Returns:
+    str: {"total", "offset", "doctors": [{"name", "specialty", "slots", "more"}]}, with
+    "next_offset" when there are more pages.
     """
-    return json.dumps(doctors_data, indent=4)
+    global _tool_cache_version
+    sync_availability()
+    limit = max(1, min(int(limit or 10), Config.TOOL_MAX_PAGE_SIZE))
+    offset = max(0, int(offset or 0))
+    key = (specialty, date_from, date_to, limit, offset)
+    with _tool_cache_lock:
+        if _tool_cache_version != availability.version:
+            _tool_cache.clear()
+            _tool_cache_version = availability.version
+        cached = _tool_cache.get(key)
+    if cached is not None:
+        return cached
 
-# Check if a doctor is available at the requested time
-def check_doctor_availability(doctor_name, requested_time):
+    version = availability.version
+    start, end = _parse_bound(date_from), _parse_bound(date_to, end=True)
+    total, doctors = availability.query(specialty, start, end, limit, offset, Config.TOOL_MAX_SLOTS)
+    result = {"total": total, "offset": offset, "doctors": doctors}
+    if offset + limit < total:
+        result["next_offset"] = offset + limit
+    result = json.dumps(result, separators=(",", ":"))
+
+    with _tool_cache_lock:
+        if _tool_cache_version == version:
+            _tool_cache[key] = result
+    return result
+
+def _parse_bound(value, end=False):
+    # A bare date as an upper bound includes that whole day
+    if not value:
+        return None
+    bound = parse_slot(value)
+    if bound is not None and end and len(str(value).strip()) == 10:
+        bound += datetime.timedelta(days=1)
+    return bound
+
+# Slot search tools
+def find_next_slots(specialty=None, count=5, after=None):
     """
-    Check if the doctor is available at the requested time.
+    Returns the earliest free slots, optionally for one specialty, as compact JSON.
+
+    Args:
+    specialty (str): Only this specialty, e.g. "Cardiologist".
+    count (int): Number of slots, at most Config.TOOL_MAX_PAGE_SIZE.
+    after (str): Earliest day or slot; defaults to the start of Config.TODAY.
     """
-    for doctor in doctors_data:
-        if doctor['name'] == doctor_name:
-            if requested_time in doctor['available_slots']:
-                return True
-            else:
-                return False
-    return False
+    sync_availability()
+    start = _parse_bound(after) or parse_slot(Config.TODAY)
+    count = max(1, min(int(count or 5), Config.TOOL_MAX_PAGE_SIZE))
+    return _slots_json(availability.next_slots(count, specialty, start))
 
-# Schedule a meeting with the doctor
-def schedule_meeting(doctor_name, patient_name, requested_time):
+def find_slots_in_window(date_from, date_to, specialty=None, limit=20):
     """
-    Schedule a meeting with a doctor, check their availability, and update the CSV file.
+    Returns free slots between two times (a bare end date is inclusive) as compact JSON.
     """
-    for doctor in doctors_data:
-        if doctor['name'] == doctor_name:
-            if requested_time in doctor['available_slots']:
-                # Remove the time slot from the doctor's available slots
-                doctor['available_slots'].remove(requested_time)
+    sync_availability()
+    start, end = _parse_bound(date_from), _parse_bound(date_to, end=True)
+    if start is None or end is None:
+        return json.dumps({"status": "error", "message": "date_from and date_to must be YYYY-MM-DD or YYYY-MM-DD HH:MM"})
+    limit = max(1, min(int(limit or 20), Config.TOOL_MAX_PAGE_SIZE))
+    return _slots_json(availability.slots_in_window(start, end, specialty, limit))
 
-                # Record the meeting
-                meeting = {
-                    "doctor": doctor_name,
-                    "patient": patient_name,
-                    "time": requested_time
-                }
-                scheduled_meetings.append(meeting)
+def find_nearest_slot(requested_time, specialty=None, doctor_name=None):
+    """
+    Returns the free slot closest to a requested time, for a doctor, a specialty or anyone.
+    """
+    sync_availability()
+    target = parse_slot(requested_time)
+    if target is None:
+        return json.dumps({"status": "error", "message": f"Invalid time {requested_time}"})
+    nearest = availability.nearest_slot(target, specialty, doctor_name)
+    return _slots_json([nearest] if nearest else [])
 
-                # Save the updated schedule to CSV
-                save_meetings_to_csv()
+def _slots_json(entries):
+    # A doctor removed since the search is simply left out
+    doctors = {name: availability.get_doctor(name) for _, name in entries}
+    slots = [
+        {"doctor": name, "specialty": doctors[name]['specialty'], "time": format_slot(slot)}
+        for slot, name in entries if doctors[name]
+    ]
+    return json.dumps({"slots": slots}, separators=(",", ":"))
 
-                return json.dumps({"status": "success", "message": f"Meeting scheduled with {doctor_name} at {requested_time}"})
-            else:
-                return json.dumps({"status": "error", "message": f"{doctor_name} is not available at {requested_time}"})
-    return json.dumps({"status": "error", "message": "Doctor not found"})
+# Check if a doctor is available at the requested time
+def check_doctor_availability(doctor_name, requested_time):
+    """
+    Check if the doctor is available at the requested time.
+    """
+    sync_availability()
+    return availability.is_available(doctor_name, requested_time)
 
-# Save scheduled meetings to CSV
-def save_meetings_to_csv():
+# Hold a slot while the patient confirms
+def hold_meeting(doctor_name, patient_name, requested_time):
     """
-    Save the scheduled meetings to a CSV file.
+    Reserve a slot for Config.BOOKING_HOLD_TTL seconds; confirm it with schedule_meeting(hold_token=...).
     """
-    with open(meeting_file, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Doctor", "Patient", "Time"])
-        for meeting in scheduled_meetings:
-            writer.writerow([meeting['doctor'], meeting['patient'], meeting['time']])
+    slot = parse_slot(requested_time)
+    if doctor_name not in availability or slot is None:
+        return json.dumps({"status": "error", "message": "Doctor not found" if slot else f"Invalid time {requested_time}"})
+    if booking_service is None:
+        return json.dumps({"status": "error", "message": "Holds need the sqlite booking backend"})
 
-# Load scheduled meetings from CSV
-def load_meetings_from_csv():
+    sync_availability()
+    if not availability.is_available(doctor_name, slot):
+        return json.dumps({"status": "error", "message": f"{doctor_name} is not available at {requested_time}"})
+    token = booking_service.reserve(doctor_name, format_slot(slot), patient_name)
+    if token is None:
+        return json.dumps({"status": "error", "message": f"{doctor_name} is not available at {requested_time}"})
+    return json.dumps({"status": "success", "hold_token": token, "expires_in": Config.BOOKING_HOLD_TTL,
+                       "message": f"{doctor_name} at {format_slot(slot)} is held for {patient_name}; ask them to confirm"})
+
+# Schedule a meeting with the doctor
+def schedule_meeting(doctor_name, patient_name, requested_time, hold_token=None):
     """
-    Load the existing scheduled meetings from the CSV file.
+    Schedule a meeting with a doctor, check their availability, and record it.
+
+    The roster decides whether the doctor works at that time at all. With
+    the sqlite backend the slot is then taken atomically in the shared
+    booking database (confirming `hold_token` if given), so two workers can
+    never book the same slot; the journal backend books in process memory.
     """
-    try:
-        with open(meeting_file, mode='r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                scheduled_meetings.append({
-                    "doctor": row['Doctor'],
-                    "patient": row['Patient'],
-                    "time": row['Time']
-                })
-    except FileNotFoundError:
-        pass  # No meetings file exists yet
+    slot = parse_slot(requested_time)
+    if doctor_name not in availability:
+        return json.dumps({"status": "error", "message": "Doctor not found"})
+    if slot is None:
+        return json.dumps({"status": "error", "message": f"Invalid time {requested_time}"})
+    requested_time = format_slot(slot)
 
-# Handle the conversation and doctor scheduling requests
-def run_conversation(messages, client):
+    if booking_service is not None:
+        sync_availability()
+        if not hold_token and not availability.is_available(doctor_name, slot):
+            return json.dumps({"status": "error", "message": f"{doctor_name} is not available at {requested_time}"})
+        if hold_token:
+            # A token for another slot is rejected without touching that slot's hold
+            booked = booking_service.confirm(hold_token, doctor_name, requested_time) is not None
+        else:
+            booked = booking_service.book(doctor_name, requested_time, patient_name)
+        if not booked:
+            # The slot may only be held, or the token expired or unknown: only a booking
+            # made by another worker takes it out of local availability, via its event
+            sync_availability()
+            return json.dumps({"status": "error", "message": f"{doctor_name} is not available at {requested_time}"})
+        availability.book(doctor_name, slot)
+        return json.dumps({"status": "success", "message": f"Meeting scheduled with {doctor_name} at {requested_time}"})
+
+    # Remove the time slot from the doctor's available slots
+    if not availability.book(doctor_name, requested_time):
+        return json.dumps({"status": "error", "message": f"{doctor_name} is not available at {requested_time}"})
+
+    # Record the meeting; returns once the journal has fsynced it
+    meeting = {
+        "doctor": doctor_name,
+        "patient": patient_name,
+        "time": requested_time
+    }
+    journal.append("book", meeting)
+
+    return json.dumps({"status": "success", "message": f"Meeting scheduled with {doctor_name} at {requested_time}"})
+
+# Load scheduled meetings
+def load_meetings():
     """
-    Simulate a conversation and handle scheduling-related actions.
+    Take the slots of already scheduled meetings out of the doctors' availability.
+
+    With the sqlite backend, meetings from an existing journal or a legacy
+    doctor_meetings.csv are imported once into an empty booking database.
+    With the journal backend the journal has replayed its snapshot and log by
+    the time this runs, and the CSV is imported once if it is still empty.
     """
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "show_available_doctors",
-                "description": "Show all available doctors",
-                "parameters": {}
+    if booking_service is not None:
+        if not booking_service.events_after(0):
+            legacy = _legacy_meetings()
+            imported = sum(booking_service.book(meeting['doctor'], meeting['time'], meeting['patient']) for meeting in legacy)
+            if imported:
+                logging.info(f"Imported {imported} meetings into {Config.BOOKING_DB}")
+        sync_availability()
+        return
+
+    if not journal.meetings and os.path.exists(meeting_file):
+        for meeting in read_csv(meeting_file):
+            journal.append("book", meeting, wait=False)
+        logging.info(f"Imported {len(journal.meetings)} meetings from {meeting_file}")
+
+    for meeting in journal.meetings:
+        availability.book(meeting['doctor'], meeting['time'])
+
+def _legacy_meetings():
+    # Meetings recorded before the booking database existed
+    if os.path.exists(Config.MEETINGS_JOURNAL) or os.path.exists(Config.MEETINGS_SNAPSHOT):
+        legacy_journal = BookingJournal(Config.MEETINGS_JOURNAL, Config.MEETINGS_SNAPSHOT)
+        meetings = list(legacy_journal.meetings)
+        legacy_journal.close()
+        return meetings
+    if os.path.exists(meeting_file):
+        return read_csv(meeting_file)
+    return []
+
+# Tools exposed to the model
+tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "show_available_doctors",
+            "description": "List doctors with free slots, soonest first, filtered and paginated",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "specialty": {"type": "string", "description": "Only doctors of this specialty, e.g. Dentist"},
+                    "date_from": {"type": "string", "description": "Earliest date (YYYY-MM-DD) or time (YYYY-MM-DD HH:MM)"},
+                    "date_to": {"type": "string", "description": "Last date (YYYY-MM-DD), inclusive"},
+                    "limit": {"type": "integer", "description": "Doctors per page (default 10)"},
+                    "offset": {"type": "integer", "description": "Doctors to skip; use next_offset for the next page"}
+                },
             },
         },
-        {
-            "type": "function",
-            "function": {
-                "name": "schedule_meeting",
-                "description": "Schedule a meeting with a doctor",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "doctor_name": {"type": "string", "description": "Name of the doctor"},
-                        "patient_name": {"type": "string", "description": "Name of the patient"},
-                        "requested_time": {"type": "string", "description": "Requested meeting time (YYYY-MM-DD HH:MM)"}
-                    },
-                    "required": ["doctor_name", "patient_name", "requested_time"],
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "schedule_meeting",
+            "description": "Schedule a meeting with a doctor",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "doctor_name": {"type": "string", "description": "Name of the doctor"},
+                    "patient_name": {"type": "string", "description": "Name of the patient"},
+                    "requested_time": {"type": "string", "description": "Requested meeting time (YYYY-MM-DD HH:MM)"},
+                    "hold_token": {"type": "string", "description": "Token from hold_meeting, when confirming a held slot"}
                 },
+                "required": ["doctor_name", "patient_name", "requested_time"],
             },
         },
+    },
+]
+
+# Slot search: earliest, within a window, closest to a time
+tools += [
+    {
+        "type": "function",
+        "function": {
+            "name": "find_next_slots",
+            "description": "Find the earliest free slots, e.g. the earliest cardiologist",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "specialty": {"type": "string", "description": "Only doctors of this specialty"},
+                    "count": {"type": "integer", "description": "Number of slots (default 5)"},
+                    "after": {"type": "string", "description": "Earliest date (YYYY-MM-DD) or time (YYYY-MM-DD HH:MM); default today"}
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_slots_in_window",
+            "description": "Find free slots in a time window, e.g. Thursday afternoon",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date_from": {"type": "string", "description": "Window start (YYYY-MM-DD or YYYY-MM-DD HH:MM)"},
+                    "date_to": {"type": "string", "description": "Window end; a date (YYYY-MM-DD) includes that whole day"},
+                    "specialty": {"type": "string", "description": "Only doctors of this specialty"},
+                    "limit": {"type": "integer", "description": "Maximum slots (default 20)"}
+                },
+                "required": ["date_from", "date_to"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_nearest_slot",
+            "description": "Find the free slot closest to a requested time, for one doctor, a specialty or any doctor",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "requested_time": {"type": "string", "description": "Requested time (YYYY-MM-DD HH:MM)"},
+                    "specialty": {"type": "string", "description": "Only doctors of this specialty"},
+                    "doctor_name": {"type": "string", "description": "Only this doctor"}
+                },
+                "required": ["requested_time"],
+            },
+        },
+    },
+]
+
+# Holds are only shared across workers by the booking service
+if booking_service is not None:
+    tools.append({
+        "type": "function",
+        "function": {
+            "name": "hold_meeting",
+            "description": "Hold a slot for a few minutes while the patient confirms; then call schedule_meeting with the hold_token",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "doctor_name": {"type": "string", "description": "Name of the doctor"},
+                    "patient_name": {"type": "string", "description": "Name of the patient"},
+                    "requested_time": {"type": "string", "description": "Requested meeting time (YYYY-MM-DD HH:MM)"}
+                },
+                "required": ["doctor_name", "patient_name", "requested_time"],
+            },
+        },
+    })
+
+# Map available functions
+available_functions = {
+    "show_available_doctors": show_available_doctors,
+    "schedule_meeting": schedule_meeting,
+    "hold_meeting": hold_meeting,
+    "find_next_slots": find_next_slots,
+    "find_slots_in_window": find_slots_in_window,
+    "find_nearest_slot": find_nearest_slot,
+}
+
+# Tools whose results are a complete answer for the user
+DIRECT_REPLY_TOOLS = {"schedule_meeting"}
+
+# Separate from the pipeline pool: tool calls are made from inside pipeline workers
+tool_executor = ThreadPoolExecutor(max_workers=Config.TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+# Run the tool calls requested by the model and append their results
+def execute_tool_calls(messages, tool_calls):
+    """
+    Execute tool calls concurrently and append one "tool" message per call to the conversation.
+
+    Args:
+    messages (list): The conversation, extended in place in the order of the calls.
+    tool_calls (list): Tool calls as {"id", "function": {"name", "arguments"}} dicts or SDK objects.
+
+    Returns:
+    list: The tool messages that were appended.
+    """
+    calls = []
+    for tool_call in tool_calls:
+        if isinstance(tool_call, dict):
+            call_id, function = tool_call['id'], tool_call['function']
+            function_name, arguments = function['name'], function['arguments']
+        else:
+            call_id, function_name, arguments = tool_call.id, tool_call.function.name, tool_call.function.arguments
+        calls.append((call_id, function_name, arguments))
+
+    if len(calls) == 1:
+        results = [_call_tool(calls[0][1], calls[0][2])]
+    else:
+        # Each call gets its own copy of the context so its metric span joins the turn's trace
+        futures = [tool_executor.submit(contextvars.copy_context().run, _call_tool, function_name, arguments)
+                   for _, function_name, arguments in calls]
+        results = [future.result() for future in futures]
+
+    tool_messages = [
+        {
+            "tool_call_id": call_id,
+            "role": "tool",
+            "name": function_name,
+            "content": result,
+        }
+        for (call_id, function_name, _), result in zip(calls, results)
     ]
+    messages.extend(tool_messages)
+    return tool_messages
 
-    # Map available functions
-    available_functions = {
-        "show_available_doctors": show_available_doctors,
-        "schedule_meeting": schedule_meeting,
-    }
+def _call_tool(function_name, arguments):
+    # Errors go back to the model as the tool result instead of ending the turn
+    with metrics.span("tool", provider=function_name) as span:
+        try:
+            function_to_call = available_functions[function_name]
+            function_args = json.loads(arguments or "{}")
+            result = function_to_call(**function_args)
+        except Exception as e:
+            logging.error(f"Tool {function_name} failed: {e}")
+            span.set(error=type(e).__name__)
+            result = json.dumps({"status": "error", "message": f"{function_name} failed: {e}"})
+        span.set(bytes=len(result or ""))
+        return result
+
+def direct_reply(tool_messages):
+    """
+    Return the reply for tool results that answer the user on their own, or None.
 
+    Booking results already carry the message to say, so the follow-up
+    completion is skipped for them.
+    """
+    if not tool_messages or any(message['name'] not in DIRECT_REPLY_TOOLS for message in tool_messages):
+        return None
+    try:
+        return " ".join(json.loads(message['content'])['message'] + "." for message in tool_messages)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+# Handle the conversation and doctor scheduling requests
+def run_conversation(messages, client):
+    """
+    Simulate a conversation and handle scheduling-related actions.
+    """
     # Handle tool calls based on the conversation
     response = client.chat.completions.create(
         model=MODEL,
@@ -172,20 +485,12 @@ def run_conversation(messages, client):
     tool_calls = response_message.tool_calls
     
     if tool_calls:
+        # Tools book meetings; a hedged attempt that lost must not run them
+        commit()
         messages.append(response_message)
-        
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_to_call = available_functions[function_name]
-            function_args = json.loads(tool_call.function.arguments)
-            function_response = function_to_call(**function_args)
-            
-            messages.append({
-                "tool_call_id": tool_call.id,
-                "role": "tool",
-                "name": function_name,
-                "content": function_response,
-            })
+        reply = direct_reply(execute_tool_calls(messages, tool_calls))
+        if reply is not None:
+            return reply
 
         second_response = client.chat.completions.create(
             model=MODEL,
@@ -195,5 +500,70 @@ def run_conversation(messages, client):
 
     return response_message.content
 
+# Streaming variant of run_conversation
+def run_conversation_stream(messages, client):
+    """
+    Like run_conversation, but yield the reply text as the model streams it.
+
+    Tool-call fragments are accumulated from the stream; if the model asks for
+    tools they are executed and the follow-up completion is streamed instead.
+    """
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        tools=tools,
+        tool_choice="auto",
+        max_tokens=4096,
+        stream=True
+    )
+
+    content = []
+    tool_calls = {}
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+            yield delta.content
+        for fragment in delta.tool_calls or []:
+            call = tool_calls.setdefault(fragment.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+            if fragment.id:
+                call['id'] = fragment.id
+            if fragment.function and fragment.function.name:
+                call['function']['name'] += fragment.function.name
+            if fragment.function and fragment.function.arguments:
+                call['function']['arguments'] += fragment.function.arguments
+
+    if not tool_calls:
+        return
+
+    calls = [tool_calls[index] for index in sorted(tool_calls)]
+    # Tools book meetings; a hedged attempt that lost must not run them
+    commit()
+    messages.append({"role": "assistant", "content": "".join(content), "tool_calls": calls})
+    reply = direct_reply(execute_tool_calls(messages, calls))
+    if reply is not None:
+        yield reply
+        return
+
+    second_response = client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        stream=True
+    )
+    for chunk in second_response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+# Slots that must stay booked when the roster is reloaded
+def booked_slots():
+    meetings = booking_service.meetings() if booking_service is not None else journal.meetings
+    return {(meeting['doctor'], format_slot(parse_slot(meeting['time']))) for meeting in meetings if parse_slot(meeting['time'])}
+
 # Initialize and load any existing scheduled meetings
-load_meetings_from_csv()
\ No newline at end of file
+load_meetings()
+
+# Watch the roster file for edits
+roster.booked_slots = booked_slots
+roster.start()
\ No newline at end of file
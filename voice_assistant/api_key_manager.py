@@ -1,26 +1,22 @@
 from voice_assistant.config import Config
 
+def get_api_key(model):
+    """
+    Return the API key of a backend, or None for backends that need none.
+    """
+    return {
+        'openai': Config.OPENAI_API_KEY,
+        'groq': Config.GROQ_API_KEY,
+        'deepgram': Config.DEEPGRAM_API_KEY,
+        'elevenlabs': Config.ELEVENLABS_API_KEY,
+        'cartesia': Config.CARTESIA_API_KEY,
+    }.get(model)
+
 def get_transcription_api_key():
-    if Config.TRANSCRIPTION_MODEL == 'openai':
-        return Config.OPENAI_API_KEY
-    elif Config.TRANSCRIPTION_MODEL == 'groq':
-        return Config.GROQ_API_KEY
-    elif Config.TRANSCRIPTION_MODEL == 'deepgram':
-        return Config.DEEPGRAM_API_KEY
-    return None
+    return get_api_key(Config.TRANSCRIPTION_MODEL)
 
 def get_response_api_key():
-    if Config.RESPONSE_MODEL == 'openai':
-        return Config.OPENAI_API_KEY
-    elif Config.RESPONSE_MODEL == 'groq':
-        return Config.GROQ_API_KEY
-    return None
+    return get_api_key(Config.RESPONSE_MODEL)
 
 def get_tts_api_key():
-    if Config.TTS_MODEL == 'openai':
-        return Config.OPENAI_API_KEY
-    elif Config.TTS_MODEL == 'deepgram':
-        return Config.DEEPGRAM_API_KEY
-    elif Config.TTS_MODEL == 'elevenlabs':
-        return Config.ELEVENLABS_API_KEY
-    return None
\ No newline at end of file
+    return get_api_key(Config.TTS_MODEL)
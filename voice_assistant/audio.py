@@ -2,9 +2,7 @@ import speech_recognition as sr
 import pygame
 import time
 import logging
-import pydub
-from io import BytesIO
-from pydub import AudioSegment
+from voice_assistant.audio_ingest import ingest_audio
 
 def record_audio(file_path, timeout=10, phrase_time_limit=None, retries=3, energy_threshold=2000, pause_threshold=1, phrase_threshold=0.1, dynamic_energy_threshold=True, calibration_duration=1):
 
@@ -22,11 +20,16 @@ def record_audio(file_path, timeout=10, phrase_time_limit=None, retries=3, energ
                 # Listen for the first phrase and extract it into audio data
                 audio_data = recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
                 logging.info("Recording complete")
-                # Convert the recorded audio data to an MP3 file
-                wav_data = audio_data.get_wav_data()
-                audio_segment = pydub.AudioSegment.from_wav(BytesIO(wav_data))
-                mp3_data = audio_segment.export(file_path, format="mp3", bitrate="128k", parameters=["-ar", "22050", "-ac", "1"])
-                return
+                # Resample and trim in memory; kept lossless (FLAC) because transcribe_audio
+                # encodes it once more for the backend
+                audio_bytes, _ = ingest_audio(audio_data.get_wav_data(), None)
+                if not audio_bytes:
+                    # Nothing but silence: no file to write and nothing to transcribe
+                    logging.info("Recording was silent")
+                    return audio_bytes
+                with open(file_path, "wb") as audio_file:
+                    audio_file.write(audio_bytes)
+                return audio_bytes
         except sr.WaitTimeoutError:
             logging.warning(f"Listening timed out, retrying... ({attempt + 1}/{retries})")
         except Exception as e:
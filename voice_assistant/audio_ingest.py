@@ -0,0 +1,286 @@
+import io
+import logging
+import math
+import shutil
+import subprocess
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from voice_assistant.config import Config
+from voice_assistant.utils import guess_audio_filename, pcm_to_wav
+
+# Containers libsndfile decodes itself; anything else (webm, mp4) goes through ffmpeg
+SOUNDFILE_CONTAINERS = {"wav", "flac", "ogg", "mp3"}
+
+# Smallest upload each transcription backend accepts. The hosted APIs all take
+# Ogg; Vorbis is used rather than Opus because libsndfile's Opus encoder takes
+# ~50 ms per second of audio against ~4 ms for Vorbis at a similar size. The
+# FastWhisperAPI server is local, so it gets lossless FLAC, and the in-process
+# model takes raw PCM.
+UPLOAD_FORMATS = {
+    "openai": "vorbis",
+    "groq": "vorbis",
+    "deepgram": "vorbis",
+    "fastwhisperapi": "flac",
+    "local": "pcm",
+}
+
+# Totals since startup, served by /audio/metrics
+ingest_stats = {
+    "clips": 0,
+    "fallbacks": 0,
+    "silent": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "seconds_in": 0.0,
+    "seconds_out": 0.0,
+    "ingest_seconds": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def detect_container(audio_bytes):
+    """
+    Return the container of in-memory audio ("wav", "webm", "ogg", ...), or None if unknown.
+    """
+    name = guess_audio_filename(audio_bytes, default="")
+    return name.rsplit(".", 1)[1] if name else None
+
+
+def decode_audio(audio_bytes, target_rate=16000):
+    """
+    Decode audio bytes to mono float32 samples.
+
+    libsndfile handles WAV, FLAC, Ogg and MP3 without leaving the process;
+    other containers (the browser's webm/opus, mp4) are piped through ffmpeg,
+    which resamples to `target_rate` in the same pass.
+
+    Returns:
+    tuple: (samples, sample_rate).
+    """
+    if detect_container(audio_bytes) in SOUNDFILE_CONTAINERS:
+        try:
+            samples, rate = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+            return samples.mean(axis=1, dtype=np.float32), rate
+        except (sf.LibsndfileError, RuntimeError) as e:
+            logging.warning(f"libsndfile could not decode audio, trying ffmpeg: {e}")
+    return _ffmpeg_decode(audio_bytes, target_rate), target_rate
+
+
+def _ffmpeg_decode(audio_bytes, rate):
+    ffmpeg = shutil.which(Config.INGEST_FFMPEG)
+    if ffmpeg is None:
+        raise RuntimeError(f"{Config.INGEST_FFMPEG} is needed to decode {detect_container(audio_bytes) or 'unknown'} audio")
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-vn", "-ac", "1", "-ar", str(rate), "-f", "f32le", "pipe:1"],
+        input=audio_bytes, capture_output=True, timeout=Config.STAGE_TIMEOUTS['transcription'],
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()[:200]}")
+    return np.frombuffer(result.stdout, dtype="<f4")
+
+
+def resample(samples, rate, target_rate=16000):
+    """
+    Resample mono samples by truncating (or zero-padding) their spectrum.
+
+    Everything above the new Nyquist frequency is dropped before the rate
+    changes, so downsampling does not alias. The input is zero-padded to a
+    whole number of rate-ratio blocks whose count has only small prime
+    factors, which keeps the FFT fast for any clip length.
+    """
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    divisor = math.gcd(rate, target_rate)
+    up, down = target_rate // divisor, rate // divisor
+    blocks = _fast_length(-(-len(samples) // down))
+    length_in, length_out = blocks * down, blocks * up
+    spectrum = np.fft.rfft(samples, length_in)
+    bins = length_out // 2 + 1
+    if bins <= len(spectrum):
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - len(spectrum), dtype=spectrum.dtype)])
+    resampled = np.fft.irfft(spectrum, length_out) * (length_out / length_in)
+    return resampled[:int(round(len(samples) * target_rate / rate))].astype(np.float32)
+
+
+def _fast_length(n):
+    # Smallest 2^a * 3^b * 5^c >= n
+    best = 1 << max(0, n - 1).bit_length()
+    power_of_5 = 1
+    while power_of_5 < best:
+        power_of_15 = power_of_5
+        while power_of_15 < best:
+            candidate = power_of_15 << max(0, -(-n // power_of_15) - 1).bit_length()
+            best = min(best, candidate)
+            power_of_15 *= 3
+        power_of_5 *= 5
+    return best
+
+
+def trim_silence(samples, rate, threshold=None, padding=0.2, frame_ms=20):
+    """
+    Cut leading and trailing silence, keeping `padding` seconds around the speech.
+
+    A frame is silent when its RMS, on the 16-bit scale the VAD uses, is below
+    `threshold` (default Config.INGEST_SILENCE_THRESHOLD). A clip that is
+    silent throughout comes back empty.
+    """
+    if threshold is None:
+        threshold = Config.INGEST_SILENCE_THRESHOLD
+    frame = max(1, int(rate * frame_ms / 1000))
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        return samples
+    frames = samples[:frame_count * frame].reshape(frame_count, frame)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1)) * 32768
+    loud = np.flatnonzero(rms >= threshold)
+    if len(loud) == 0:
+        return samples[:0]
+    pad = int(padding * rate)
+    return samples[max(0, loud[0] * frame - pad):min(len(samples), (loud[-1] + 1) * frame + pad)]
+
+
+def encode_audio(samples, rate, audio_format):
+    """
+    Encode mono float samples in memory.
+
+    Args:
+    audio_format (str): "vorbis" or "opus" (in Ogg), "flac", "wav" or "pcm" (raw 16-bit little-endian).
+
+    Returns:
+    tuple: (audio bytes, file name for multipart uploads).
+    """
+    if audio_format in ("pcm", "wav"):
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+        return (pcm, "audio.pcm") if audio_format == "pcm" else (pcm_to_wav(pcm, rate), "audio.wav")
+    buffer = io.BytesIO()
+    if audio_format in ("vorbis", "opus"):
+        sf.write(buffer, samples, rate, format="OGG", subtype=audio_format.upper(), compression_level=Config.INGEST_COMPRESSION)
+        return buffer.getvalue(), "audio.ogg"
+    if audio_format == "flac":
+        sf.write(buffer, samples, rate, format="FLAC", subtype="PCM_16")
+    else:
+        raise ValueError(f"Unsupported upload format {audio_format}")
+    return buffer.getvalue(), f"audio.{audio_format}"
+
+
+def ingest_audio(audio_bytes, backend):
+    """
+    Normalize one uploaded utterance for a transcription backend.
+
+    The audio is decoded whatever its container, mixed to mono, resampled to
+    Config.INGEST_SAMPLE_RATE, trimmed of leading and trailing silence and
+    encoded in the backend's smallest accepted format, all in memory. If the
+    audio cannot be decoded the original bytes are passed on unchanged.
+
+    Returns:
+    tuple: (audio bytes, file name); the bytes are empty when the clip is silent.
+    """
+    started = time.perf_counter()
+    try:
+        samples, rate = decode_audio(audio_bytes, Config.INGEST_SAMPLE_RATE)
+        seconds_in = len(samples) / rate
+        samples = resample(samples, rate, Config.INGEST_SAMPLE_RATE)
+        if Config.INGEST_TRIM_SILENCE:
+            samples = trim_silence(samples, Config.INGEST_SAMPLE_RATE, Config.INGEST_SILENCE_THRESHOLD, Config.INGEST_SILENCE_PADDING)
+        if len(samples) == 0:
+            result = b"", None
+        else:
+            result = encode_audio(samples, Config.INGEST_SAMPLE_RATE, UPLOAD_FORMATS.get(backend, "flac"))
+    except Exception as e:
+        logging.warning(f"Audio ingest failed, sending the upload as is: {e}")
+        with _stats_lock:
+            ingest_stats['fallbacks'] += 1
+        return audio_bytes, guess_audio_filename(audio_bytes)
+
+    with _stats_lock:
+        ingest_stats['clips'] += 1
+        ingest_stats['silent'] += not result[0]
+        ingest_stats['bytes_in'] += len(audio_bytes)
+        ingest_stats['bytes_out'] += len(result[0])
+        ingest_stats['seconds_in'] += seconds_in
+        ingest_stats['seconds_out'] += len(samples) / Config.INGEST_SAMPLE_RATE
+        ingest_stats['ingest_seconds'] += time.perf_counter() - started
+    return result
+
+
+if __name__ == "__main__":
+    # Benchmark over a corpus of synthetic utterances in the containers browsers
+    # and recorders produce: bytes uploaded and time spent before the STT call.
+    import random
+
+    generator = np.random.default_rng(3)
+    uplink_bits_per_second = 2_000_000
+
+    def utterance(rate, speech_seconds, lead, tail):
+        # Voiced harmonics with a syllable-rate envelope, between stretches of room noise
+        t = np.arange(int(rate * speech_seconds)) / rate
+        pitch = 110 + 40 * np.sin(2 * np.pi * 0.7 * t)
+        phase = 2 * np.pi * np.cumsum(pitch) / rate
+        voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+        envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+        speech = 0.25 * voice * envelope / 3
+        noise = lambda seconds: 0.002 * generator.standard_normal(int(rate * seconds))
+        return np.concatenate([noise(lead), speech + 0.002 * generator.standard_normal(len(t)), noise(tail)]).astype(np.float32)
+
+    def encode_source(samples, rate, container):
+        buffer = io.BytesIO()
+        if container == "wav":
+            sf.write(buffer, samples, rate, format="WAV", subtype="PCM_16")
+        elif container == "ogg":
+            sf.write(buffer, samples, rate, format="OGG", subtype="OPUS")
+        elif container == "flac":
+            sf.write(buffer, samples, rate, format="FLAC")
+        elif container == "mp3":
+            sf.write(buffer, samples, rate, format="MP3", subtype="MPEG_LAYER_III")
+        return buffer.getvalue()
+
+    # Resampling keeps a tone in band and removes one above the new Nyquist frequency
+    t = np.arange(48000) / 48000
+    tone = resample((np.sin(2 * np.pi * 1000 * t) + np.sin(2 * np.pi * 11000 * t)).astype(np.float32), 48000, 16000)
+    expected = np.sin(2 * np.pi * 1000 * np.arange(16000) / 16000)
+    print(f"resample 48k -> 16k: in-band error {np.max(np.abs(tone - expected)):.1e}")
+
+    sources = [("wav", 48000), ("wav", 44100), ("ogg", 48000), ("flac", 44100), ("mp3", 44100)]
+    if shutil.which(Config.INGEST_FFMPEG):
+        sources.append(("webm", 48000))
+    random_generator = random.Random(5)
+    corpus = []
+    for index in range(40):
+        container, rate = sources[index % len(sources)]
+        samples = utterance(rate, random_generator.uniform(1.5, 6.0), random_generator.uniform(0.3, 1.5), random_generator.uniform(0.5, 1.5))
+        if container == "webm":
+            wav = encode_source(samples, rate, "wav")
+            clip = subprocess.run([shutil.which(Config.INGEST_FFMPEG), "-loglevel", "error", "-i", "pipe:0", "-c:a", "libopus",
+                                   "-f", "webm", "pipe:1"], input=wav, capture_output=True).stdout
+        else:
+            clip = encode_source(samples, rate, container)
+        corpus.append((container, clip, len(samples) / rate))
+    print(f"{len(corpus)} clips, {sum(seconds for *_, seconds in corpus):.0f} s of audio, containers: "
+          f"{sorted({container for container, *_ in corpus})}")
+
+    for backend in ("groq", "fastwhisperapi"):
+        rows = {}
+        for container, clip, seconds in corpus:
+            started = time.perf_counter()
+            uploaded, _ = ingest_audio(clip, backend)
+            elapsed = time.perf_counter() - started
+            row = rows.setdefault(container, [0, 0, 0.0, 0])
+            row[0] += len(clip)
+            row[1] += len(uploaded)
+            row[2] += elapsed
+            row[3] += 1
+        print(f"\nbackend {backend} ({UPLOAD_FORMATS[backend]}), upload time at {uplink_bits_per_second / 1e6:.0f} Mbit/s:")
+        for container, (before, after, elapsed, count) in sorted(rows.items()):
+            upload_before = before * 8 / uplink_bits_per_second / count * 1000
+            upload_after = after * 8 / uplink_bits_per_second / count * 1000
+            print(f"  {container:5} {before / count / 1024:7.1f} KB -> {after / count / 1024:6.1f} KB per clip, "
+                  f"ingest {elapsed / count * 1000:5.1f} ms, upload {upload_before:6.0f} -> {upload_after:5.0f} ms "
+                  f"(net {upload_before - upload_after - elapsed / count * 1000:+5.0f} ms saved)")
+    print(f"\naudio sent to STT: {ingest_stats['seconds_out']:.0f} s of {ingest_stats['seconds_in']:.0f} s "
+          f"({1 - ingest_stats['seconds_out'] / ingest_stats['seconds_in']:.0%} silence trimmed)")
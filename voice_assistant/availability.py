@@ -0,0 +1,786 @@
+import bisect
+import collections
+import datetime
+import heapq
+import itertools
+import threading
+
+from voice_assistant.config import Config
+from voice_assistant.recurrence import AvailabilityRule, horizon_end
+
+SLOT_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def parse_slot(value):
+    """
+    Parse a slot into a datetime.
+
+    Args:
+    value (str | datetime.datetime): A "YYYY-MM-DD HH:MM" string or a datetime.
+
+    Returns:
+    datetime.datetime | None: The parsed slot, or None if it is malformed.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.replace(second=0, microsecond=0)
+    try:
+        return datetime.datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+
+def format_slot(slot):
+    """
+    Format a datetime slot back into the "YYYY-MM-DD HH:MM" string form.
+    """
+    return slot.strftime(SLOT_FORMAT)
+
+
+class SortedIndex:
+    """
+    Sorted list stored as chunks of about `load` items.
+
+    Inserting or deleting moves the items of one chunk instead of the whole
+    list, and lookups bisect the chunk maxima and then one chunk.
+    """
+
+    def __init__(self, items=(), load=512):
+        self._load = load
+        items = list(items)
+        self._chunks = [items[i:i + load] for i in range(0, len(items), load)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(items)
+
+    def add(self, item):
+        if not self._chunks:
+            self._chunks.append([item])
+            self._maxes.append(item)
+        else:
+            i = min(bisect.bisect_left(self._maxes, item), len(self._chunks) - 1)
+            chunk = self._chunks[i]
+            bisect.insort(chunk, item)
+            self._maxes[i] = chunk[-1]
+            if len(chunk) > 2 * self._load:
+                self._chunks[i:i + 1] = [chunk[:self._load], chunk[self._load:]]
+                self._maxes[i:i + 1] = [chunk[self._load - 1], chunk[-1]]
+        self._len += 1
+
+    def remove(self, item):
+        """
+        Remove an item. Returns False if it was not present.
+        """
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._chunks) or not _remove_sorted(self._chunks[i], item):
+            return False
+        if self._chunks[i]:
+            self._maxes[i] = self._chunks[i][-1]
+        else:
+            del self._chunks[i], self._maxes[i]
+        self._len -= 1
+        return True
+
+    def iter_from(self, item=None):
+        """
+        Iterate over the items >= `item` (all items when None) in order.
+        """
+        if not self._chunks:
+            return
+        if item is None:
+            i, j = 0, 0
+        else:
+            i = bisect.bisect_left(self._maxes, item)
+            if i == len(self._chunks):
+                return
+            j = bisect.bisect_left(self._chunks[i], item)
+        yield from self._chunks[i][j:]
+        for chunk in itertools.islice(self._chunks, i + 1, None):
+            yield from chunk
+
+    def before(self, item):
+        """
+        Return the largest item < `item`, or None.
+        """
+        i = bisect.bisect_left(self._maxes, item)
+        if i < len(self._chunks):
+            j = bisect.bisect_left(self._chunks[i], item)
+            if j:
+                return self._chunks[i][j - 1]
+        return self._maxes[i - 1] if i else None
+
+    def __contains__(self, item):
+        i = bisect.bisect_left(self._maxes, item)
+        return i < len(self._chunks) and _contains_sorted(self._chunks[i], item)
+
+    def __iter__(self):
+        return self.iter_from()
+
+    def __len__(self):
+        return self._len
+
+
+_EMPTY_INDEX = SortedIndex()
+
+
+class _RuleIndex:
+    """
+    The rule doctors of one specialty, indexed by where their slots fall in the week.
+
+    Weekly hours repeat, so one (minute of the week, name) entry per weekly
+    slot locates every rule doctor's slots in time order whatever the date,
+    and exception-date slots are indexed by datetime. Walking the index week
+    by week and checking each slot against its rule's dates and bookings
+    lists free slots without visiting the doctors that have none nearby. The
+    index does not grow with how far ahead the rules run.
+    """
+
+    def __init__(self, doctors=(), today=None):
+        self.today = today
+        self.doctors = {}
+        self.firsts = collections.Counter()
+        self.ends = collections.Counter()
+        self.open = 0
+        phases, exceptions = [], []
+        for doctor in doctors:
+            self._count(doctor, 1)
+            phases.extend((minute, doctor['name']) for minute in doctor['rule'].week_minutes())
+            exceptions.extend((slot, doctor['name']) for slot in doctor['rule'].exception_slots())
+        self.phases = SortedIndex(sorted(phases))
+        self.exceptions = SortedIndex(sorted(exceptions))
+
+    def add(self, doctor):
+        self._count(doctor, 1)
+        for minute in doctor['rule'].week_minutes():
+            self.phases.add((minute, doctor['name']))
+        for slot in doctor['rule'].exception_slots():
+            self.exceptions.add((slot, doctor['name']))
+
+    def remove(self, doctor):
+        self._count(doctor, -1)
+        for minute in doctor['rule'].week_minutes():
+            self.phases.remove((minute, doctor['name']))
+        for slot in doctor['rule'].exception_slots():
+            self.exceptions.remove((slot, doctor['name']))
+
+    def entries(self, after=None):
+        """
+        Yield free (slot, name) pairs at or after `after`, in time order.
+        """
+        if not self.doctors:
+            return
+        after_date = after.date() if after else None
+        earliest = datetime.datetime.combine(min(self.firsts), datetime.time())
+        start = max(after, earliest) if after else earliest
+        # No rule reaches past the latest end, or the horizon of an open-ended one
+        last = max([*self.ends, *([horizon_end(self.today, after_date)] if self.open else [])])
+
+        def free(slot, name):
+            doctor = self.doctors[name]
+            return doctor['rule'].covers(slot.date(), self.today, after_date) and not _contains_sorted(doctor['booked'], slot)
+
+        def weekly():
+            week = datetime.datetime.combine(start.date() - datetime.timedelta(days=start.weekday()), datetime.time())
+            offset = _ceil_minutes(start - week)
+            while week.date() <= last:
+                for minute, name in self.phases.iter_from((offset,)):
+                    slot = week + datetime.timedelta(minutes=minute)
+                    if slot.date() > last:
+                        return
+                    if not self.doctors[name]['rule'].is_exception(slot.date()) and free(slot, name):
+                        yield slot, name
+                week += datetime.timedelta(days=7)
+                offset = 0
+
+        exceptions = itertools.takewhile(lambda entry: entry[0].date() <= last, self.exceptions.iter_from((start,)))
+        yield from heapq.merge(weekly(), (entry for entry in exceptions if free(*entry)))
+
+    def entries_before(self, before):
+        """
+        Yield free (slot, name) pairs strictly before `before`, latest first.
+        """
+        if not self.doctors:
+            return
+        before_date = before.date()
+        earliest = datetime.datetime.combine(min(self.firsts), datetime.time())
+        last = max([*self.ends, *([max(horizon_end(self.today), before_date)] if self.open else [])])
+        upper = min(before, datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time()))
+
+        def free(slot, name):
+            doctor = self.doctors[name]
+            return doctor['rule'].covers(slot.date(), self.today, before=before_date) and not _contains_sorted(doctor['booked'], slot)
+
+        def weekly():
+            week = datetime.datetime.combine(upper.date() - datetime.timedelta(days=upper.weekday()), datetime.time())
+            offset = _ceil_minutes(upper - week)
+            while week + datetime.timedelta(days=7) > earliest:
+                entry = self.phases.before((offset,))
+                while entry is not None:
+                    slot = week + datetime.timedelta(minutes=entry[0])
+                    if slot < earliest:
+                        return
+                    if not self.doctors[entry[1]]['rule'].is_exception(slot.date()) and free(slot, entry[1]):
+                        yield slot, entry[1]
+                    entry = self.phases.before(entry)
+                week -= datetime.timedelta(days=7)
+                offset = 7 * 24 * 60
+
+        def exceptions():
+            entry = self.exceptions.before((upper,))
+            while entry is not None and entry[0] >= earliest:
+                if free(*entry):
+                    yield entry
+                entry = self.exceptions.before(entry)
+
+        yield from heapq.merge(weekly(), exceptions(), reverse=True)
+
+    def _count(self, doctor, step):
+        # Track the rules' first and last dates, which bound the walks
+        rule = doctor['rule']
+        for counter, key in ((self.firsts, rule.start or self.today), (self.ends, rule.end)):
+            if key is None:
+                continue
+            counter[key] += step
+            if not counter[key]:
+                del counter[key]
+        self.open += step if rule.end is None else 0
+        if step > 0:
+            self.doctors[doctor['name']] = doctor
+        else:
+            self.doctors.pop(doctor['name'], None)
+
+    def __len__(self):
+        return len(self.doctors)
+
+
+class AvailabilityStore:
+    """
+    Indexed doctor availability.
+
+    Doctors are looked up by name in a dict and their free slots are kept as
+    sorted datetime lists, both per doctor and per specialty, so checking,
+    booking and releasing a slot are bisect lookups instead of scans over the
+    whole roster. A global (slot, name) index sorted by time, kept in step on
+    every book and release, answers next-slot, time-window and nearest-slot
+    queries with a bisect, across all specialties or one. The specialty and
+    global indexes are `SortedIndex` chunked lists, so keeping them in step
+    costs the same at a million slots as at a thousand.
+
+    A roster entry may instead (or as well) give an "availability" rule (see
+    `AvailabilityRule`). A rule doctor's slots are never stored: they are
+    generated when a query reaches them and merged with the indexes in time
+    order, and only their bookings are kept, as a sorted overlay of taken
+    slots. Memory therefore grows with the number of bookings, not with how
+    far ahead the rule runs. Time-ordered queries find rule doctors' slots
+    through a per-specialty `_RuleIndex` of their weekly hours rather than
+    one generator per rule doctor. Rules without a start or end date are bounded
+    from `today`, the assistant's reference date (Config.TODAY by default),
+    so they list the same slots as the explicit ones in the same roster.
+    """
+
+    def __init__(self, doctors=None, today=None):
+        self._lock = threading.RLock()
+        self.today = today or parse_slot(Config.TODAY).date()
+        self._doctors = {}
+        self._rule_indexes = {}
+        self._all_rules = _RuleIndex(today=self.today)
+        self.version = 0
+        self.roster_version = 0
+        # Bulk load: rosters repeat the same few thousand times across doctors, so
+        # slot strings are parsed once and the indexes sort distinct times only
+        parsed_slots = {}
+        by_specialty = collections.defaultdict(lambda: collections.defaultdict(list))
+        rules_by_specialty = collections.defaultdict(list)
+        for doctor in doctors or []:
+            name, specialty = doctor['name'], doctor['specialty']
+            parsed = _parse_slots(doctor.get('available_slots', []), parsed_slots)
+            rule = AvailabilityRule.from_dict(doctor['availability']) if doctor.get('availability') else None
+            if rule is not None:
+                parsed = [slot for slot in parsed if not rule.contains(slot)]
+            self._doctors[name] = {"name": name, "specialty": specialty, "slots": parsed, "rule": rule, "booked": []}
+            if rule is not None:
+                rules_by_specialty[specialty.lower()].append(self._doctors[name])
+            names_by_slot = by_specialty[specialty.lower()]
+            for slot in parsed:
+                names_by_slot[slot].append(name)
+        by_time = collections.defaultdict(list)
+        for names_by_slot in by_specialty.values():
+            for slot, names in names_by_slot.items():
+                by_time[slot].extend(names)
+        self._by_specialty = {specialty: SortedIndex(_grouped_entries(names)) for specialty, names in by_specialty.items()}
+        self._by_time = SortedIndex(_grouped_entries(by_time))
+        self._rule_indexes = {specialty: _RuleIndex(doctors, self.today) for specialty, doctors in rules_by_specialty.items()}
+        self._all_rules = _RuleIndex([doctor for doctors in rules_by_specialty.values() for doctor in doctors], self.today)
+
+    def add_doctor(self, name, specialty, slots=(), rule=None, booked=()):
+        """
+        Add a doctor to the store, replacing any existing entry with that name.
+
+        Args:
+        slots (list): Free slots outside any rule.
+        rule (AvailabilityRule): Recurring availability, or None.
+        booked (list): Rule slots that are already taken.
+        """
+        parsed = _parse_slots(slots)
+        taken = []
+        if rule is not None:
+            parsed = [slot for slot in parsed if not rule.contains(slot)]
+            taken = [slot for slot in _parse_slots(booked) if rule.contains(slot)]
+        with self._lock:
+            if name in self._doctors:
+                self.remove_doctor(name)
+            index = self._by_specialty.setdefault(specialty.lower(), SortedIndex())
+            for slot in parsed:
+                index.add((slot, name))
+                self._by_time.add((slot, name))
+            self._doctors[name] = {"name": name, "specialty": specialty, "slots": parsed, "rule": rule, "booked": taken}
+            if rule is not None:
+                self._rule_indexes.setdefault(specialty.lower(), _RuleIndex(today=self.today)).add(self._doctors[name])
+                self._all_rules.add(self._doctors[name])
+            self.version += 1
+            self.roster_version += 1
+
+    def remove_doctor(self, name):
+        """
+        Remove a doctor and all of their free slots from the store.
+        """
+        with self._lock:
+            doctor = self._doctors.pop(name, None)
+            if doctor is None:
+                return False
+            if doctor['rule'] is not None:
+                self._rule_indexes[doctor['specialty'].lower()].remove(doctor)
+                self._all_rules.remove(doctor)
+            index = self._by_specialty[doctor['specialty'].lower()]
+            for slot in doctor['slots']:
+                index.remove((slot, name))
+                self._by_time.remove((slot, name))
+            self.version += 1
+            self.roster_version += 1
+            return True
+
+    def add_slots(self, name, slots):
+        """
+        Add free slots to an existing doctor. Returns the number added.
+        """
+        return self._update_slots(name, slots, add=True)
+
+    def remove_slots(self, name, slots):
+        """
+        Withdraw free slots from a doctor. Returns the number removed.
+        """
+        return self._update_slots(name, slots, add=False)
+
+    def _update_slots(self, name, slots, add):
+        # Slots covered by the doctor's rule are left to the rule
+        parsed = [slot for slot in map(parse_slot, slots) if slot is not None]
+        changed = 0
+        with self._lock:
+            doctor = self._doctors.get(name)
+            if doctor is None:
+                return 0
+            index = self._by_specialty[doctor['specialty'].lower()]
+            for slot in parsed:
+                if add == _contains_sorted(doctor['slots'], slot) or (doctor['rule'] and doctor['rule'].contains(slot)):
+                    continue
+                if add:
+                    bisect.insort(doctor['slots'], slot)
+                    index.add((slot, name))
+                    self._by_time.add((slot, name))
+                else:
+                    _remove_sorted(doctor['slots'], slot)
+                    index.remove((slot, name))
+                    self._by_time.remove((slot, name))
+                changed += 1
+            if changed:
+                self.version += 1
+        return changed
+
+    def get_doctor(self, name):
+        """
+        Return the doctor entry for a name, or None if the doctor is unknown.
+        """
+        return self._doctors.get(name)
+
+    def roster(self):
+        """
+        Return (name, specialty) pairs for every doctor; `roster_version` changes when this does.
+        """
+        with self._lock:
+            return [(doctor['name'], doctor['specialty']) for doctor in self._doctors.values()]
+
+    def is_available(self, name, requested_time):
+        """
+        Check if the doctor has a free slot at the requested time.
+        """
+        slot = parse_slot(requested_time)
+        doctor = self._doctors.get(name)
+        if doctor is None or slot is None:
+            return False
+        with self._lock:
+            if _contains_sorted(doctor['slots'], slot):
+                return True
+            rule = doctor['rule']
+            return rule is not None and rule.contains(slot) and not _contains_sorted(doctor['booked'], slot)
+
+    def book(self, name, requested_time):
+        """
+        Take a free slot out of the doctor's availability.
+
+        Returns:
+        bool: True if the slot was free and is now booked.
+        """
+        slot = parse_slot(requested_time)
+        doctor = self._doctors.get(name)
+        if doctor is None or slot is None:
+            return False
+        with self._lock:
+            if _remove_sorted(doctor['slots'], slot):
+                self._by_specialty[doctor['specialty'].lower()].remove((slot, name))
+                self._by_time.remove((slot, name))
+            elif doctor['rule'] is not None and doctor['rule'].contains(slot) and not _contains_sorted(doctor['booked'], slot):
+                bisect.insort(doctor['booked'], slot)
+            else:
+                return False
+            self.version += 1
+            return True
+
+    def release(self, name, requested_time):
+        """
+        Put a previously booked slot back into the doctor's availability.
+
+        Returns:
+        bool: True if the slot was added back, False if it was already free.
+        """
+        slot = parse_slot(requested_time)
+        doctor = self._doctors.get(name)
+        if doctor is None or slot is None:
+            return False
+        with self._lock:
+            if doctor['rule'] is not None and doctor['rule'].contains(slot):
+                if not _remove_sorted(doctor['booked'], slot):
+                    return False
+            elif _contains_sorted(doctor['slots'], slot):
+                return False
+            else:
+                bisect.insort(doctor['slots'], slot)
+                self._by_specialty[doctor['specialty'].lower()].add((slot, name))
+                self._by_time.add((slot, name))
+            self.version += 1
+            return True
+
+    def slots_for_specialty(self, specialty):
+        """
+        Return the free (slot, doctor name) pairs for a specialty in time order.
+        """
+        with self._lock:
+            return list(self._entries(specialty))
+
+    def next_slots(self, count, specialty=None, after=None):
+        """
+        Return the first `count` free (slot, doctor name) pairs at or after `after`.
+        """
+        with self._lock:
+            return list(itertools.islice(self._entries(specialty, after), count))
+
+    def slots_in_window(self, start, end, specialty=None, limit=None):
+        """
+        Return free (slot, doctor name) pairs with start <= slot < end, in time order.
+        """
+        with self._lock:
+            entries = itertools.takewhile(lambda entry: entry[0] < end, self._entries(specialty, start))
+            return list(itertools.islice(entries, limit))
+
+    def nearest_slot(self, target, specialty=None, doctor_name=None):
+        """
+        Return the free (slot, doctor name) pair closest to `target`, or None.
+
+        Ties go to the earlier slot.
+        """
+        with self._lock:
+            if doctor_name is not None:
+                doctor = self._doctors.get(doctor_name)
+                slots = doctor['slots'] if doctor else []
+                i = bisect.bisect_left(slots, target)
+                before = [(slots[i - 1], doctor_name)] if i else []
+                after = [(slots[i], doctor_name)] if i < len(slots) else []
+                if doctor and doctor['rule']:
+                    before.extend(entry for entry in (next(_rule_entries_before(doctor, target, self.today), None),) if entry)
+                    after.extend(entry for entry in (next(_rule_entries(doctor, target, self.today), None),) if entry)
+            else:
+                index = self._index(specialty)
+                before = [entry for entry in (index.before((target,)),) if entry]
+                after = [entry for entry in (next(index.iter_from((target,)), None),) if entry]
+                rules = self._rule_index(specialty)
+                if rules is not None:
+                    before.extend(entry for entry in (next(rules.entries_before(target), None),) if entry)
+                    after.extend(entry for entry in (next(rules.entries(target), None),) if entry)
+            # Same picks as the index alone: the last entry before, the first entry after
+            candidates = ([max(before)] if before else []) + ([min(after)] if after else [])
+            if not candidates:
+                return None
+            return min(candidates, key=lambda entry: (abs(entry[0] - target), entry[0]))
+
+    def doctor_slots(self, name, start=None, end=None, limit=None):
+        """
+        Return a doctor's free slots with start <= slot < end, in time order.
+        """
+        with self._lock:
+            doctor = self._doctors.get(name)
+            if doctor is None:
+                return []
+            slots = itertools.takewhile(lambda slot: end is None or slot < end, _doctor_slots(doctor, start, self.today))
+            return list(itertools.islice(slots, limit))
+
+    def count_slots(self, name, start=None, end=None):
+        """
+        Count a doctor's free slots with start <= slot < end without listing them.
+        """
+        with self._lock:
+            doctor = self._doctors.get(name)
+            return _count_slots(doctor, start, end, self.today) if doctor else 0
+
+    def _index(self, specialty):
+        if specialty is None:
+            return self._by_time
+        return self._by_specialty.get(specialty.lower(), _EMPTY_INDEX)
+
+    def _rule_index(self, specialty):
+        # Like `_index`, for rule doctors; None when there are none
+        rules = self._all_rules if specialty is None else self._rule_indexes.get(specialty.lower())
+        return rules if rules else None
+
+    def _entries(self, specialty=None, after=None):
+        # Free (slot, name) pairs from the index merged with the slots of rule doctors
+        entries = self._index(specialty).iter_from((after,) if after else None)
+        rules = self._rule_index(specialty)
+        if rules is None:
+            return entries
+        return heapq.merge(entries, rules.entries(after))
+
+    def query(self, specialty=None, start=None, end=None, limit=10, offset=0, max_slots=5):
+        """
+        Return one page of doctors with free slots in [start, end), soonest first.
+
+        Args:
+        specialty (str): Only doctors of this specialty (case-insensitive), or None for all.
+        start (datetime.datetime): Earliest slot, or None.
+        end (datetime.datetime): Slots before this, or None.
+        limit (int): Doctors per page.
+        offset (int): Doctors to skip.
+        max_slots (int): Slots listed per doctor; the rest are only counted.
+
+        Returns:
+        tuple: (total matching doctors, [{"name", "specialty", "slots", "more"}]).
+        """
+        with self._lock:
+            matches = []
+            for doctor in self._doctors.values():
+                if specialty and doctor['specialty'].lower() != specialty.lower():
+                    continue
+                if doctor['rule'] is None:
+                    slots = doctor['slots']
+                    low = bisect.bisect_left(slots, start) if start else 0
+                    high = bisect.bisect_left(slots, end) if end else len(slots)
+                    if low < high:
+                        matches.append((slots[low], doctor['name']))
+                else:
+                    # Rule doctors are only counted once they make the page
+                    first = next(_doctor_slots(doctor, start, self.today), None)
+                    if first is not None and (end is None or first < end):
+                        matches.append((first, doctor['name']))
+            matches.sort()
+            page = []
+            for _, name in matches[offset:offset + limit]:
+                doctor = self._doctors[name]
+                count = _count_slots(doctor, start, end, self.today)
+                slots = itertools.takewhile(lambda slot: end is None or slot < end, _doctor_slots(doctor, start, self.today))
+                page.append({
+                    "name": name,
+                    "specialty": doctor['specialty'],
+                    "slots": [format_slot(slot) for slot in itertools.islice(slots, min(count, max_slots))],
+                    "more": max(0, count - max_slots),
+                })
+            return len(matches), page
+
+    def to_list(self):
+        """
+        Return the roster in the same shape as the roster file entries.
+
+        Rule doctors are listed with their "availability" rule rather than
+        the expanded slots; their bookings are not part of the roster.
+        """
+        with self._lock:
+            entries = []
+            for doctor in self._doctors.values():
+                entry = {
+                    "name": doctor['name'],
+                    "specialty": doctor['specialty'],
+                    "available_slots": [format_slot(slot) for slot in doctor['slots']],
+                }
+                if doctor['rule'] is not None:
+                    entry['availability'] = doctor['rule'].to_dict()
+                entries.append(entry)
+            return entries
+
+    def __len__(self):
+        return len(self._doctors)
+
+    def __contains__(self, name):
+        return name in self._doctors
+
+
+def _parse_slots(slots, cache=None):
+    if cache is None:
+        return sorted({slot for slot in map(parse_slot, slots) if slot is not None})
+    parsed = set()
+    for value in slots:
+        try:
+            parsed.add(cache[value])
+        except KeyError:
+            cache[value] = parse_slot(value)
+            parsed.add(cache[value])
+    parsed.discard(None)
+    return sorted(parsed)
+
+
+def _rule_entries(doctor, after=None, today=None):
+    # (slot, name) pairs of a rule doctor at or after `after`, skipping booked slots
+    name, booked = doctor['name'], doctor['booked']
+    for slot in doctor['rule'].iter_from(after, today):
+        if not _contains_sorted(booked, slot):
+            yield slot, name
+
+
+def _rule_entries_before(doctor, before, today=None):
+    # Same, strictly before `before`, latest first
+    name, booked = doctor['name'], doctor['booked']
+    for slot in doctor['rule'].iter_before(before, today):
+        if not _contains_sorted(booked, slot):
+            yield slot, name
+
+
+def _doctor_slots(doctor, start=None, today=None):
+    # One doctor's free slots at or after `start`: explicit slots merged with the rule
+    slots = doctor['slots']
+    low = bisect.bisect_left(slots, start) if start else 0
+    explicit = itertools.islice(slots, low, None)
+    if doctor['rule'] is None:
+        return explicit
+    rule_slots = (slot for slot, _ in _rule_entries(doctor, start, today))
+    return heapq.merge(explicit, rule_slots) if low < len(slots) else rule_slots
+
+
+def _count_slots(doctor, start=None, end=None, today=None):
+    slots, booked = doctor['slots'], doctor['booked']
+    count = (bisect.bisect_left(slots, end) if end else len(slots)) - (bisect.bisect_left(slots, start) if start else 0)
+    if doctor['rule'] is not None:
+        # Booked slots are subtracted over the same window the rule counts, which
+        # an open-ended rule bounds at query time
+        low, high = doctor['rule'].window(start, end, today)
+        count += doctor['rule'].count(start, end, today)
+        count -= bisect.bisect_left(booked, high) - bisect.bisect_left(booked, low)
+    return max(0, count)
+
+
+def _ceil_minutes(delta):
+    # Whole minutes in a timedelta, rounded up
+    return -(-delta // datetime.timedelta(minutes=1))
+
+
+def _grouped_entries(names_by_slot):
+    # Sorted (slot, name) entries from {slot: [names]}
+    return [(slot, name) for slot in sorted(names_by_slot) for name in sorted(names_by_slot[slot])]
+
+
+def _contains_sorted(items, item):
+    i = bisect.bisect_left(items, item)
+    return i < len(items) and items[i] == item
+
+
+def _remove_sorted(items, item):
+    i = bisect.bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
+        return True
+    return False
+
+
+if __name__ == "__main__":
+    # Benchmark the store against the original linear scan at 10k doctors.
+    import random
+    import time
+
+    doctor_count = 10000
+    slots_per_doctor = 100
+    operations = 2000
+    start_day = datetime.datetime(2024, 9, 25, 8, 0)
+
+    roster = []
+    for i in range(doctor_count):
+        slots = [format_slot(start_day + datetime.timedelta(minutes=15 * j)) for j in range(slots_per_doctor)]
+        roster.append({"name": f"Dr. {i}", "specialty": f"Specialty {i % 40}", "available_slots": slots})
+    requests = [(f"Dr. {random.randrange(doctor_count)}", random.choice(roster[0]['available_slots'])) for _ in range(operations)]
+
+    def linear_book(doctors, doctor_name, requested_time):
+        for doctor in doctors:
+            if doctor['name'] == doctor_name:
+                if requested_time in doctor['available_slots']:
+                    doctor['available_slots'].remove(requested_time)
+                    return True
+                return False
+        return False
+
+    linear_roster = [dict(doctor, available_slots=list(doctor['available_slots'])) for doctor in roster]
+    started = time.perf_counter()
+    for name, slot in requests:
+        linear_book(linear_roster, name, slot)
+    linear_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    store = AvailabilityStore(roster)
+    build_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for name, slot in requests:
+        store.book(name, slot)
+    store_elapsed = time.perf_counter() - started
+
+    print(f"{doctor_count} doctors x {slots_per_doctor} slots, {operations} bookings")
+    print(f"linear scan:        {linear_elapsed * 1e6 / operations:10.1f} us/booking")
+    print(f"availability store: {store_elapsed * 1e6 / operations:10.1f} us/booking (index build {build_elapsed:.2f}s)")
+
+    # Slot search over the global and per-specialty time indexes
+    queries = 10000
+    targets = [start_day + datetime.timedelta(minutes=random.randrange(slots_per_doctor * 15)) for _ in range(queries)]
+    searches = {
+        "next 5 slots (any specialty)": lambda target: store.next_slots(5, after=target),
+        "next 5 slots (one specialty)": lambda target: store.next_slots(5, "Specialty 7", after=target),
+        "1-hour window, first 20": lambda target: store.slots_in_window(target, target + datetime.timedelta(hours=1), limit=20),
+        "nearest slot (any specialty)": lambda target: store.nearest_slot(target),
+        "nearest slot (one doctor)": lambda target: store.nearest_slot(target, doctor_name="Dr. 42"),
+    }
+    print(f"slot search over {len(store._by_time)} free slots, {queries} queries each")
+    for label, search in searches.items():
+        started = time.perf_counter()
+        for target in targets:
+            search(target)
+        print(f"{label:30}{(time.perf_counter() - started) * 1e6 / queries:10.1f} us/query")
+
+    started = time.perf_counter()
+    for name, slot in requests:
+        store.release(name, slot)
+    print(f"{'release (index upkeep)':30}{(time.perf_counter() - started) * 1e6 / operations:10.1f} us/release")
+
+    # The same searches with part of the roster on weekly rules instead of slot lists
+    weekly = {"monday": ["09:00-12:00"], "wednesday": ["08:00-09:15", "13:00-17:00"], "friday": ["08:00-10:00"]}
+    for rule_count in (0, 1000, doctor_count):
+        mixed = [{"name": entry['name'], "specialty": entry['specialty'], "availability": {"from": "2024-09-25", "weekly": weekly}}
+                 if i < rule_count else entry for i, entry in enumerate(roster)]
+        store = AvailabilityStore(mixed)
+        for name, slot in requests:
+            store.book(name, slot)
+        print(f"{rule_count} of {doctor_count} doctors on weekly rules, {queries // 10} queries each")
+        for label, search in searches.items():
+            started = time.perf_counter()
+            for target in targets[:queries // 10]:
+                search(target)
+            print(f"{label:30}{(time.perf_counter() - started) * 1e6 / (queries // 10):10.1f} us/query")
@@ -0,0 +1,237 @@
+import csv
+import json
+import logging
+import os
+import threading
+import time
+
+
+class BookingJournal:
+    """
+    Append-only, write-ahead journal of bookings.
+
+    Every booking or cancellation is appended as one JSON line. A background
+    thread batches pending lines into a single write + fsync (group commit), so
+    concurrent bookings share one disk flush. After `compact_every` records the
+    current meetings are written to a snapshot and the journal is truncated;
+    on startup the snapshot is loaded and the journal tail replayed on top.
+    """
+
+    def __init__(self, journal_path, snapshot_path, commit_interval=0.005, compact_every=10000):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.commit_interval = commit_interval
+        self.compact_every = compact_every
+        self.meetings = []
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._seq = 0
+        self._committed_seq = 0
+        self._snapshot_seq = 0
+        self._since_snapshot = 0
+        self._closed = False
+
+        self._replay()
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        self._committed_seq = self._seq
+        self._thread = threading.Thread(target=self._run, name="booking-journal", daemon=True)
+        self._thread.start()
+
+    def append(self, op, meeting, wait=True):
+        """
+        Record a booking ("book") or cancellation ("cancel").
+
+        Args:
+        op (str): "book" or "cancel".
+        meeting (dict): The meeting with "doctor", "patient" and "time" keys.
+        wait (bool): Block until the record has been fsynced.
+
+        Returns:
+        int: The sequence number assigned to the record.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Booking journal is closed")
+            self._seq += 1
+            seq = self._seq
+            record = {"seq": seq, "op": op, "doctor": meeting['doctor'], "patient": meeting['patient'], "time": meeting['time']}
+            self._apply(record)
+            self._pending.append(json.dumps(record) + "\n")
+            self._cond.notify_all()
+        if wait:
+            self.wait_for(seq)
+        return seq
+
+    def wait_for(self, seq):
+        """
+        Block until the record with the given sequence number is durable.
+        """
+        with self._cond:
+            while self._committed_seq < seq:
+                self._cond.wait()
+
+    def compact(self):
+        """
+        Write the current meetings to the snapshot and truncate the journal.
+        """
+        with self._io_lock:
+            self._compact()
+
+    def _compact(self):
+        with self._cond:
+            snapshot = {"seq": self._seq, "meetings": list(self.meetings)}
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(snapshot, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        _fsync_dir(self.snapshot_path)
+
+        # Records up to snapshot["seq"] that are still pending will be written
+        # to the new journal and skipped on replay.
+        self._file.close()
+        self._file = open(self.journal_path, "w", encoding="utf-8")
+        self._snapshot_seq = snapshot['seq']
+        self._since_snapshot = 0
+        logging.info(f"Compacted booking journal at seq {snapshot['seq']} ({len(snapshot['meetings'])} meetings)")
+
+    def close(self):
+        """
+        Flush pending records and stop the commit thread.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def _apply(self, record):
+        meeting = {"doctor": record['doctor'], "patient": record['patient'], "time": record['time']}
+        if record['op'] == "book":
+            self.meetings.append(meeting)
+        elif record['op'] == "cancel":
+            for i, existing in enumerate(self.meetings):
+                if existing['doctor'] == meeting['doctor'] and existing['time'] == meeting['time']:
+                    del self.meetings[i]
+                    break
+
+    def _replay(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+            self.meetings.extend(snapshot['meetings'])
+            self._snapshot_seq = self._seq = snapshot['seq']
+
+        if not os.path.exists(self.journal_path):
+            return
+        good_offset = 0
+        with open(self.journal_path, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash: drop it and everything after it
+                    logging.warning(f"Discarding torn record at offset {good_offset} in {self.journal_path}")
+                    break
+                good_offset += len(line)
+                if record['seq'] <= self._snapshot_seq:
+                    continue
+                self._apply(record)
+                self._seq = record['seq']
+                self._since_snapshot += 1
+        if good_offset != os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as file:
+                file.truncate(good_offset)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+            if not self._closed:
+                # Give concurrent writers a moment to join this commit
+                time.sleep(self.commit_interval)
+            with self._cond:
+                batch, self._pending = self._pending, []
+                last_seq = self._seq
+            try:
+                with self._io_lock:
+                    self._file.write("".join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                logging.error(f"Failed to commit booking journal: {e}")
+                with self._cond:
+                    self._pending = batch + self._pending
+                time.sleep(1)
+                continue
+            with self._cond:
+                self._committed_seq = last_seq
+                self._since_snapshot += len(batch)
+                self._cond.notify_all()
+            if self.compact_every and self._since_snapshot >= self.compact_every:
+                try:
+                    self.compact()
+                except OSError as e:
+                    logging.error(f"Failed to compact booking journal: {e}")
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def export_csv(meetings, csv_path):
+    """
+    Write meetings to a CSV file with the legacy Doctor/Patient/Time columns.
+    """
+    with open(csv_path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Doctor", "Patient", "Time"])
+        for meeting in meetings:
+            writer.writerow([meeting['doctor'], meeting['patient'], meeting['time']])
+
+
+def read_csv(csv_path):
+    """
+    Read meetings from a CSV file with the legacy Doctor/Patient/Time columns.
+    """
+    with open(csv_path, mode='r', newline='') as file:
+        return [{"doctor": row['Doctor'], "patient": row['Patient'], "time": row['Time']} for row in csv.DictReader(file)]
+
+
+if __name__ == "__main__":
+    # Offline tool: python -m voice_assistant.booking_journal export|import [csv_path]
+    import sys
+    from voice_assistant.config import Config
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else "doctor_meetings.csv"
+    journal = BookingJournal(Config.MEETINGS_JOURNAL, Config.MEETINGS_SNAPSHOT, compact_every=0)
+    try:
+        if command == "export":
+            export_csv(journal.meetings, csv_path)
+            print(f"Exported {len(journal.meetings)} meetings to {csv_path}")
+        elif command == "import":
+            meetings = read_csv(csv_path)
+            for meeting in meetings:
+                journal.append("book", meeting, wait=False)
+            print(f"Imported {len(meetings)} meetings from {csv_path}")
+        else:
+            print("Usage: python -m voice_assistant.booking_journal export|import [csv_path]")
+    finally:
+        journal.close()
@@ -0,0 +1,262 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class BookingService:
+    """
+    Slot reservations shared by every worker process through SQLite in WAL mode.
+
+    The database is a sparse overlay on the roster: it has a row only for a
+    slot that is "held" or "booked", and a slot without a row is free. The
+    roster, and whether a time is one of a doctor's slots at all, stays with
+    the caller's `AvailabilityStore`, so rule-based availability is never
+    written out slot by slot. Every transition is a single conditional
+    statement (an upsert that only succeeds over a missing row, a free row or
+    an expired hold), so two callers can never take the same slot no matter
+    which process they run in; the loser simply sees no row changed. A hold
+    reserves a slot for `hold_ttl` seconds while the caller confirms, and an
+    expired hold counts as free. Releasing a hold or cancelling a booking
+    deletes its row. Bookings and cancellations are also appended to an
+    events table so each process can bring its in-memory availability up to
+    date with `events_after`.
+
+    Writers first check the slot with a plain read, which never waits in WAL
+    mode, so callers racing for a slot that is already gone fail without
+    queueing for the write lock.
+    """
+
+    def __init__(self, path, hold_ttl=60, busy_timeout=10.0, synchronous="FULL"):
+        self.path = path
+        self.hold_ttl = hold_ttl
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS slots (
+                doctor TEXT NOT NULL,
+                time TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'free',
+                patient TEXT,
+                hold_token TEXT,
+                hold_expires REAL,
+                PRIMARY KEY (doctor, time)
+            ) WITHOUT ROWID""")
+            db.execute("CREATE INDEX IF NOT EXISTS slots_hold_token ON slots (hold_token) WHERE hold_token IS NOT NULL")
+            db.execute("""CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                doctor TEXT NOT NULL,
+                time TEXT NOT NULL,
+                patient TEXT
+            )""")
+
+    def reserve(self, doctor, slot, patient, ttl=None):
+        """
+        Hold a free slot for a patient.
+
+        Returns:
+        str | None: A hold token to confirm or release, or None if the slot is taken.
+        """
+        if not self.is_free(doctor, slot):
+            return None
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO slots (doctor, time, status, patient, hold_token, hold_expires) VALUES (?, ?, 'held', ?, ?, ?) "
+                "ON CONFLICT (doctor, time) DO UPDATE SET status = 'held', patient = excluded.patient, "
+                "hold_token = excluded.hold_token, hold_expires = excluded.hold_expires "
+                "WHERE status = 'free' OR (status = 'held' AND hold_expires < ?)",
+                (doctor, slot, patient, token, now + (ttl or self.hold_ttl), now))
+        return token if cursor.rowcount == 1 else None
+
+    def confirm(self, token, doctor=None, slot=None):
+        """
+        Turn an unexpired hold into a booking.
+
+        With `doctor` and `slot` the hold is only confirmed if it is for that
+        slot, so a token presented for the wrong slot leaves its hold alone.
+
+        Returns:
+        dict | None: The booked meeting, or None if the hold expired, is unknown or is for another slot.
+        """
+        with self._transaction() as db:
+            row = db.execute(
+                "UPDATE slots SET status = 'booked', hold_token = NULL, hold_expires = NULL "
+                "WHERE hold_token = ? AND status = 'held' AND hold_expires >= ? "
+                "AND (? IS NULL OR doctor = ?) AND (? IS NULL OR time = ?) RETURNING doctor, time, patient",
+                (token, time.time(), doctor, doctor, slot, slot)).fetchone()
+            if row is None:
+                return None
+            db.execute("INSERT INTO events (op, doctor, time, patient) VALUES ('book', ?, ?, ?)", row)
+        return {"doctor": row[0], "patient": row[2], "time": row[1]}
+
+    def release(self, token):
+        """
+        Give up a hold. Returns True if the hold was still active.
+        """
+        with self._transaction() as db:
+            cursor = db.execute("DELETE FROM slots WHERE hold_token = ? AND status = 'held'", (token,))
+        return cursor.rowcount == 1
+
+    def book(self, doctor, slot, patient):
+        """
+        Atomically book a free (or expired-hold) slot without a separate hold.
+
+        Returns:
+        bool: True if this call booked the slot.
+        """
+        if not self.is_free(doctor, slot):
+            return False
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO slots (doctor, time, status, patient) VALUES (?, ?, 'booked', ?) "
+                "ON CONFLICT (doctor, time) DO UPDATE SET status = 'booked', patient = excluded.patient, "
+                "hold_token = NULL, hold_expires = NULL "
+                "WHERE status = 'free' OR (status = 'held' AND hold_expires < ?)",
+                (doctor, slot, patient, now))
+            if cursor.rowcount != 1:
+                return False
+            db.execute("INSERT INTO events (op, doctor, time, patient) VALUES ('book', ?, ?, ?)", (doctor, slot, patient))
+        return True
+
+    def cancel(self, doctor, slot):
+        """
+        Free a booked slot. Returns True if it was booked.
+        """
+        with self._transaction() as db:
+            row = db.execute(
+                "DELETE FROM slots WHERE doctor = ? AND time = ? AND status = 'booked' RETURNING patient",
+                (doctor, slot)).fetchone()
+            if row is None:
+                return False
+            db.execute("INSERT INTO events (op, doctor, time, patient) VALUES ('cancel', ?, ?, ?)", (doctor, slot, row[0]))
+        return True
+
+    def is_free(self, doctor, slot):
+        """
+        Check that a slot is not booked or held; whether the doctor works then is up to the roster.
+        """
+        row = self._connection().execute(
+            "SELECT status, hold_expires FROM slots WHERE doctor = ? AND time = ?", (doctor, slot)).fetchone()
+        return row is None or row[0] == "free" or (row[0] == "held" and row[1] < time.time())
+
+    def meetings(self):
+        """
+        Return every booked meeting as {"doctor", "patient", "time"} dicts.
+        """
+        rows = self._connection().execute("SELECT doctor, patient, time FROM slots WHERE status = 'booked' ORDER BY time, doctor")
+        return [{"doctor": doctor, "patient": patient, "time": slot} for doctor, patient, slot in rows]
+
+    def events_after(self, event_id):
+        """
+        Return (id, op, doctor, time, patient) rows of bookings and cancellations after an event id.
+        """
+        return self._connection().execute(
+            "SELECT id, op, doctor, time, patient FROM events WHERE id > ? ORDER BY id", (event_id,)).fetchall()
+
+    def _connection(self):
+        # sqlite3 connections are per thread; each worker thread opens its own
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so a transaction never has to
+    # be retried halfway through; waiting for the lock is bounded by busy_timeout
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.db.execute("COMMIT")
+        else:
+            self.db.execute("ROLLBACK")
+            logging.error(f"Booking transaction failed: {exc}")
+        return False
+
+
+def _stress_worker(path, slots, attempts, patient_prefix, start_at, results):
+    service = BookingService(path)
+    while time.time() < start_at:
+        time.sleep(0.001)
+    won = 0
+    for attempt in range(attempts):
+        doctor, slot = slots[attempt % len(slots)]
+        if attempt % 2:
+            token = service.reserve(doctor, slot, f"{patient_prefix}-{attempt}")
+            won += token is not None and service.confirm(token) is not None
+        else:
+            won += service.book(doctor, slot, f"{patient_prefix}-{attempt}")
+    results.put(won)
+
+
+if __name__ == "__main__":
+    # Stress test: many processes race for the same few slots at once.
+    import datetime
+    import multiprocessing
+    import os
+    import tempfile
+    from voice_assistant.availability import format_slot
+
+    process_count = 16
+    attempts_per_process = 250
+    slot_count = 5
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bookings.db")
+        service = BookingService(path)
+        slots = [("Dr. Ali", f"2024-09-25 {9 + index:02d}:00") for index in range(slot_count)]
+
+        results = multiprocessing.Queue()
+        start_at = time.time() + 1.0
+        processes = [
+            multiprocessing.Process(target=_stress_worker, args=(path, slots, attempts_per_process, f"p{index}", start_at, results))
+            for index in range(process_count)
+        ]
+        for process in processes:
+            process.start()
+        wins = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        elapsed = time.time() - start_at
+
+        attempts = process_count * attempts_per_process
+        booked = service.meetings()
+        events = service.events_after(0)
+        print(f"{attempts} booking attempts from {process_count} processes on {slot_count} slots in {elapsed:.2f}s "
+              f"({attempts / elapsed:.0f} attempts/s)")
+        print(f"Successful bookings: {wins}, booked rows: {len(booked)}, book events: {len(events)}")
+        assert wins == slot_count == len(booked) == len(events), "double booking detected"
+
+        # Uncontended throughput: every attempt targets its own slot
+        first = datetime.datetime(2025, 1, 1, 9)
+        free_slots = [("Dr. Bilal", format_slot(first + datetime.timedelta(minutes=15 * index))) for index in range(process_count * attempts_per_process)]
+        start_at = time.time() + 1.0
+        processes = [
+            multiprocessing.Process(target=_stress_worker, args=(path, free_slots[index::process_count], attempts_per_process, f"q{index}", start_at, results))
+            for index in range(process_count)
+        ]
+        for process in processes:
+            process.start()
+        wins = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        elapsed = time.time() - start_at
+        print(f"{wins} uncontended bookings from {process_count} processes in {elapsed:.2f}s ({wins / elapsed:.0f} bookings/s)")
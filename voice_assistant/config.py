@@ -8,6 +8,11 @@ class Config:
     RESPONSE_MODEL = 'groq' 
     TTS_MODEL = 'openai' 
 
+    # Backends tried after the model above when it is slow or failing, in order
+    TRANSCRIPTION_FALLBACKS = []  # e.g. ['openai', 'deepgram']
+    RESPONSE_FALLBACKS = []  # e.g. ['openai']
+    TTS_FALLBACKS = []  # e.g. ['deepgram', 'openai']
+
     # LLM Selection
     OLLAMA_LLM="llama3:8b"
     GROQ_LLM="llama3-groq-70b-8192-tool-use-preview"#"llama3-8b-8192"
@@ -23,12 +28,134 @@ class Config:
     TTS_PORT_LOCAL = 5150
     INPUT_AUDIO = "test.mp3"
 
+    # Pipeline concurrency: provider calls run in a shared thread pool
+    PIPELINE_MAX_WORKERS = 128
+    STAGE_CONCURRENCY = {'transcription': 64, 'response': 64, 'tts': 64}
+    STAGE_TIMEOUTS = {'transcription': 30, 'response': 60, 'tts': 30, 'session': 10}  # seconds
+
+    # Provider routing: hedge to the next backend when the first is slow, skip backends that keep failing
+    HEDGE_DELAY = {'transcription': 2.0, 'response': 2.0, 'tts': 1.0}  # longest wait for a first result before hedging; None disables
+    CIRCUIT_WINDOW = 20  # recent calls per backend the error rate is taken over
+    CIRCUIT_MIN_CALLS = 5
+    CIRCUIT_ERROR_RATE = 0.5  # share of failed calls that opens the circuit
+    CIRCUIT_COOLDOWN = 30  # seconds before an open circuit lets one trial call through
+
+    # Deployment: worker processes share one port; sessions and bookings live in SQLite
+    HOST = os.getenv("HOST", "0.0.0.0")
+    PORT = int(os.getenv("PORT", "8000"))
+    WORKERS = int(os.getenv("WORKERS", "1"))
+    SESSION_DB = "sessions.db"
+    SESSION_TTL = 24 * 3600  # seconds an idle conversation can still be resumed
+    BROADCAST_SEND_TIMEOUT = 2.0  # seconds before a slow client is dropped from a broadcast
+
+    # WebSocket protocol: each socket has a bounded, prioritized send queue (see protocol.SendQueue)
+    WS_SEND_QUEUE_BYTES = 256 * 1024  # audio waits while this much is queued for a socket, about 8 s of 16 kHz PCM
+    WS_SEND_TIMEOUT = 10.0  # seconds one frame may take to send before the client is dropped
+
+    # Metrics: per-stage latency histograms are served on /metrics; spans of each turn can also go to a file
+    TRACE_FILE = os.getenv("TRACE_FILE")  # JSON lines, one per span; unset disables trace export
+
+    # Streaming audio and server-side voice activity detection
+    STREAM_SAMPLE_RATE = 16000
+    VAD_ENERGY_THRESHOLD = 300  # RMS of 16-bit samples
+    VAD_DYNAMIC_ENERGY_THRESHOLD = True
+    VAD_PAUSE_THRESHOLD = 0.8  # seconds of silence that end an utterance
+    VAD_PHRASE_THRESHOLD = 0.1  # seconds of speech that start an utterance
+    VAD_SEGMENT_PAUSE = 0.3  # seconds of silence that close a segment for early transcription
+    VAD_MIN_SEGMENT = 1.0  # seconds of speech a segment needs before it is closed early
+    BARGE_IN_ENABLED = True  # speech or a new upload from the caller cancels the reply in progress
+
+    # Audio ingest: uploads are decoded, resampled, trimmed and re-encoded in memory before STT
+    INGEST_SAMPLE_RATE = 16000
+    INGEST_TRIM_SILENCE = True
+    INGEST_SILENCE_THRESHOLD = 300  # RMS of 16-bit samples, as for the VAD
+    INGEST_SILENCE_PADDING = 0.2  # seconds kept around the speech
+    INGEST_COMPRESSION = 0.5  # libsndfile Vorbis/Opus compression level, 0 (largest) to 1 (smallest)
+    INGEST_FFMPEG = "ffmpeg"  # decodes containers libsndfile cannot (webm, mp4)
+
+    # In-process Whisper for the 'local' transcription backend (faster-whisper, CTranslate2 on the CPU)
+    LOCAL_STT_MODEL = "base.en"  # model size or CTranslate2 model directory, used when LOCAL_MODEL_PATH is unset
+    LOCAL_STT_COMPUTE_TYPE = "int8"
+    LOCAL_STT_CPU_THREADS = int(os.getenv("LOCAL_STT_CPU_THREADS", "0"))  # threads per forward pass; 0 keeps CTranslate2's default
+    LOCAL_STT_WORKERS = 1  # forward passes run in parallel; each worker process loads its own model
+    LOCAL_STT_BEAM_SIZE = 1  # greedy decoding; short utterances gain little from a beam
+    LOCAL_STT_TOKENS_PER_SECOND = 8  # decoding stops after this many tokens per second of audio, so noise cannot loop to 448 tokens
+    LOCAL_STT_FULL_WINDOW = True  # pad utterances to Whisper's 30 s window; False encodes only the speech, much faster but less accurate
+    LOCAL_STT_BATCH_WINDOW = 0.01  # seconds to wait for utterances whose features are still being computed
+    LOCAL_STT_BATCH_MAX = 8  # utterances per forward pass
+
+    # MeloTTS server (local_tts_api.py): concurrent requests share batched forward passes
+    TTS_BATCH_WINDOW = 0.01  # seconds to wait for requests still being preprocessed
+    TTS_BATCH_MAX = 16  # sentence pieces per forward pass
+    TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))  # intra-op threads per forward pass; 0 keeps torch's default
+    TORCH_NUM_INTEROP_THREADS = int(os.getenv("TORCH_NUM_INTEROP_THREADS", "0"))
+
+    # Provider HTTP connection pools
+    HTTP_MAX_CONNECTIONS = 100
+    HTTP_MAX_KEEPALIVE = 20
+    HTTP_KEEPALIVE_EXPIRY = 30  # seconds an idle connection is kept open
+    HTTP_TIMEOUT = 60  # seconds
+
+    # TTS cache
+    TTS_CACHE_MEMORY_BYTES = 32 * 1024 * 1024
+    TTS_CACHE_DIR = "tts_cache"
+    TTS_CACHE_DISK_BYTES = 512 * 1024 * 1024
+    TTS_PREWARM_PHRASES = [
+        "Hello! May I have your name, please?",
+        "Which doctor would you like to see?",
+        "Which time works best for you?",
+        "Your meeting has been scheduled.",
+        "Sorry, that slot is no longer available.",
+        "Goodbye!",
+    ]
+
+    # Booking storage: "sqlite" is shared by every worker process, "journal" is single-process
+    BOOKING_BACKEND = "sqlite"
+    BOOKING_DB = "doctor_meetings.db"
+    BOOKING_HOLD_TTL = 120  # seconds a held slot waits for confirmation
+
+    # Booking journal
+    MEETINGS_JOURNAL = "doctor_meetings.journal"
+    MEETINGS_SNAPSHOT = "doctor_meetings.snapshot.json"
+    JOURNAL_COMMIT_INTERVAL = 0.005  # seconds to wait for more bookings before an fsync
+    JOURNAL_COMPACT_EVERY = 10000  # records between snapshots
+
+    # Scheduling
+    ROSTER_FILE = "utils/doctors_data.json"
+    ROSTER_POLL_INTERVAL = 2.0  # seconds between checks of the roster file for edits
+    TODAY = "2024-09-24"  # the date the assistant treats as today
+    INTENT_ROUTER_ENABLED = True  # answer deterministic scheduling turns without the LLM
+
+    # Speculative TTS: likely replies are synthesized into the TTS cache while the user is still speaking
+    SPECULATION_ENABLED = True
+    SPECULATION_MAX_SENTENCES = 6  # per reply
+    SPECULATION_MAX_CHARS = 600  # per reply; hosted TTS bills by the character
+    SPECULATION_CONCURRENCY = 2  # speculative syntheses running at once across all sessions
+
+    # LLM tools
+    TOOL_MAX_WORKERS = 8  # tool calls from one completion run concurrently
+    TOOL_MAX_PAGE_SIZE = 20  # doctors per show_available_doctors page
+    TOOL_MAX_SLOTS = 5  # slots listed per doctor
+
+    # Conversation history
+    HISTORY_MAX_PROMPT_TOKENS = 3000  # system prompt + summary + recent turns
+    HISTORY_SUMMARY_MAX_TOKENS = 300
+
     @staticmethod
     def validate_config():
         if Config.TRANSCRIPTION_MODEL not in ['openai', 'groq', 'deepgram', 'fastwhisperapi', 'local']:
             raise ValueError("Invalid TRANSCRIPTION_MODEL. Must be one of ['openai', 'groq', 'deepgram', 'fastwhisperapi', 'local']")
         if Config.RESPONSE_MODEL not in ['openai', 'groq', 'ollama', 'local']:
             raise ValueError("Invalid RESPONSE_MODEL. Must be one of ['openai', 'groq', 'local']")
+        for name, fallbacks, models in [('TRANSCRIPTION_FALLBACKS', Config.TRANSCRIPTION_FALLBACKS, ['openai', 'groq', 'deepgram', 'fastwhisperapi', 'local']),
+                                        ('RESPONSE_FALLBACKS', Config.RESPONSE_FALLBACKS, ['openai', 'groq', 'ollama', 'local']),
+                                        ('TTS_FALLBACKS', Config.TTS_FALLBACKS, ['openai', 'deepgram', 'elevenlabs', 'melotts', 'cartesia', 'local'])]:
+            if any(model not in models for model in fallbacks):
+                raise ValueError(f"Invalid {name}. Must be a list of {models}")
+        if Config.BOOKING_BACKEND not in ['sqlite', 'journal']:
+            raise ValueError("Invalid BOOKING_BACKEND. Must be one of ['sqlite', 'journal']")
+        if Config.WORKERS > 1 and Config.BOOKING_BACKEND != 'sqlite':
+            raise ValueError("WORKERS > 1 needs BOOKING_BACKEND = 'sqlite'; the journal belongs to one process")
         if Config.TTS_MODEL not in ['openai', 'deepgram', 'elevenlabs', 'melotts', 'cartesia', 'local']:
             raise ValueError("Invalid TTS_MODEL. Must be one of ['openai', 'deepgram', 'elevenlabs', 'melotts', 'cartesia', 'local']")
 
@@ -51,4 +178,10 @@ class Config:
         if Config.TTS_MODEL == 'elevenlabs' and not Config.ELEVENLABS_API_KEY:
             raise ValueError("ELEVENLABS_API_KEY is required for ElevenLabs models")
         if Config.TTS_MODEL == 'cartesia' and not Config.CARTESIA_API_KEY:
-            raise ValueError("CARTESIA_API_KEY is required for Cartesia models")
\ No newline at end of file
+            raise ValueError("CARTESIA_API_KEY is required for Cartesia models")
+
+        keys = {'openai': Config.OPENAI_API_KEY, 'groq': Config.GROQ_API_KEY, 'deepgram': Config.DEEPGRAM_API_KEY,
+                'elevenlabs': Config.ELEVENLABS_API_KEY, 'cartesia': Config.CARTESIA_API_KEY}
+        for model in Config.TRANSCRIPTION_FALLBACKS + Config.RESPONSE_FALLBACKS + Config.TTS_FALLBACKS:
+            if model in keys and not keys[model]:
+                raise ValueError(f"{model.upper()}_API_KEY is required for the {model} fallback")
\ No newline at end of file
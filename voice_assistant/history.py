@@ -0,0 +1,201 @@
+import logging
+import threading
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+# Prompt-size counters across all conversations
+history_stats = {"turns": 0, "prompt_tokens_total": 0, "prompt_tokens_max": 0, "summaries": 0, "summarized_messages": 0}
+
+
+def count_tokens(text):
+    """
+    Count the tokens in a string, approximating 4 characters per token without tiktoken.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def message_tokens(message):
+    """
+    Estimate the prompt tokens a chat message costs, including tool calls.
+    """
+    tokens = 4 + count_tokens(message.get('content') or "")
+    for tool_call in message.get('tool_calls') or []:
+        function = tool_call.get('function', {})
+        tokens += count_tokens(function.get('name', "")) + count_tokens(function.get('arguments', ""))
+    return tokens
+
+
+def _as_dict(message):
+    # SDK message objects (e.g. a Groq tool-call reply) are stored as plain dicts
+    if isinstance(message, dict):
+        return message
+    return message.model_dump(exclude_none=True)
+
+
+def extractive_summary(previous_summary, messages, max_tokens=300):
+    """
+    Summarize messages without a model: keep the most recent user and assistant lines.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        if message.get('role') in ('user', 'assistant') and message.get('content'):
+            lines.append(f"{message['role'].capitalize()}: {message['content'].strip()}")
+    summary = "\n".join(lines)
+    while count_tokens(summary) > max_tokens and "\n" in summary:
+        summary = summary.split("\n", 1)[1]
+    return summary
+
+
+class ConversationHistory:
+    """
+    Token-budgeted chat history.
+
+    Messages are grouped into turns: a user message plus every assistant,
+    tool-call and tool-result message that follows it. `build_prompt` returns
+    the system prompt, a running summary of older turns, and as many of the
+    most recent turns as fit in `max_prompt_tokens`; turns are never split, so
+    pending tool state always stays together, and the latest turn is always
+    included. `compact` folds the turns that no longer fit into the summary
+    with `summarizer(previous_summary, messages)` and drops them from memory.
+    """
+
+    def __init__(self, system_prompt, max_prompt_tokens=3000, summary_max_tokens=300, summarizer=None):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.max_prompt_tokens = max_prompt_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer
+        self.summary = ""
+        self.messages = []
+        self.last_prompt_tokens = 0
+        self.compaction = None  # background compaction task, owned by the caller
+        self._lock = threading.Lock()
+
+    def append(self, message):
+        with self._lock:
+            self.messages.append(_as_dict(message))
+
+    def extend(self, messages):
+        with self._lock:
+            self.messages.extend(_as_dict(message) for message in messages)
+
+    def state(self):
+        """
+        Return the summary and messages as a JSON-serializable dict.
+        """
+        with self._lock:
+            return {"summary": self.summary, "messages": list(self.messages)}
+
+    def restore(self, state):
+        """
+        Replace the summary and messages with a saved `state()`.
+        """
+        with self._lock:
+            self.summary = state.get('summary', "")
+            self.messages = list(state.get('messages', []))
+
+    def build_prompt(self):
+        """
+        Return the messages to send to the model for the next completion.
+        """
+        with self._lock:
+            head = self._head()
+            budget = self.max_prompt_tokens - sum(message_tokens(message) for message in head)
+            kept = []
+            for turn in reversed(self._turns()):
+                cost = sum(message_tokens(message) for message in turn)
+                if kept and cost > budget:
+                    break
+                kept.insert(0, turn)
+                budget -= cost
+            prompt = head + [message for turn in kept for message in turn]
+
+        self.last_prompt_tokens = sum(message_tokens(message) for message in prompt)
+        history_stats['turns'] += 1
+        history_stats['prompt_tokens_total'] += self.last_prompt_tokens
+        history_stats['prompt_tokens_max'] = max(history_stats['prompt_tokens_max'], self.last_prompt_tokens)
+        logging.info(f"Prompt tokens this turn: {self.last_prompt_tokens}")
+        return prompt
+
+    def compact(self):
+        """
+        Fold turns that fall outside the prompt window into the summary.
+
+        Safe to run in the background: the model call happens outside the lock
+        and messages appended meanwhile are kept.
+
+        Returns:
+        int: The number of messages folded into the summary.
+        """
+        with self._lock:
+            head_cost = sum(message_tokens(message) for message in self._head())
+            turns = self._turns()
+            budget = self.max_prompt_tokens - head_cost - self.summary_max_tokens
+            keep = 0
+            for turn in reversed(turns):
+                cost = sum(message_tokens(message) for message in turn)
+                if keep and cost > budget:
+                    break
+                keep += 1
+                budget -= cost
+            dropped = [message for turn in turns[:len(turns) - keep] for message in turn]
+            previous_summary = self.summary
+        if not dropped:
+            return 0
+
+        try:
+            if self.summarizer is not None:
+                summary = self.summarizer(previous_summary, dropped)
+            else:
+                summary = extractive_summary(previous_summary, dropped, self.summary_max_tokens)
+        except Exception as e:
+            logging.error(f"Failed to summarize conversation: {e}")
+            summary = extractive_summary(previous_summary, dropped, self.summary_max_tokens)
+
+        with self._lock:
+            if self.summary != previous_summary or self.messages[:len(dropped)] != dropped:
+                # Another compaction got there first
+                return 0
+            self.summary = summary
+            del self.messages[:len(dropped)]
+        history_stats['summaries'] += 1
+        history_stats['summarized_messages'] += len(dropped)
+        logging.info(f"Summarized {len(dropped)} older messages")
+        return len(dropped)
+
+    def _head(self):
+        head = [self.system_message]
+        if self.summary:
+            head.append({"role": "system", "content": "Summary of the earlier conversation:\n" + self.summary})
+        return head
+
+    def _turns(self):
+        turns = []
+        for message in self.messages:
+            if message.get('role') == 'user' or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+
+def conversation_transcript(messages):
+    """
+    Render messages as plain text for a summarization prompt.
+    """
+    lines = []
+    for message in messages:
+        if message.get('role') == 'tool':
+            lines.append(f"Tool {message.get('name')}: {message.get('content')}")
+        elif message.get('tool_calls'):
+            calls = ", ".join(f"{call['function']['name']}({call['function'].get('arguments', '')})" for call in message['tool_calls'])
+            lines.append(f"Assistant called: {calls}")
+        elif message.get('content'):
+            lines.append(f"{message['role'].capitalize()}: {message['content']}")
+    return "\n".join(lines)
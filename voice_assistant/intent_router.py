@@ -0,0 +1,428 @@
+import copy
+import datetime
+import difflib
+import json
+import re
+
+# Turn counters across all conversations
+router_stats = {"routed": 0, "fallback": 0, "list_doctors": 0, "schedule_meeting": 0, "introduce": 0}
+
+MONTHS = {name: index for index, names in enumerate([
+    ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+    ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"), ("november", "nov"),
+    ("december", "dec")], start=1) for name in names}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+                "nine": 9, "ten": 10, "eleven": 11, "twelve": 12}
+
+# Everyday words for specialties
+SPECIALTY_SYNONYMS = {
+    "heart": "cardiologist", "cardiology": "cardiologist",
+    "teeth": "dentist", "tooth": "dentist", "dental": "dentist",
+    "skin": "dermatologist", "dermatology": "dermatologist",
+    "brain": "neurologist", "nerve": "neurologist", "neurology": "neurologist",
+}
+
+# Turns the router leaves to the model
+_UNSURE = re.compile(r"\b(cancel|reschedule|change|move|instead|not|don't|dont|can't|cannot|why|how much|price|cost|wrong)\b")
+_BOOK = re.compile(r"\b(book|schedule|appointment|reserve|set up|see|meet|meeting)\b")
+_LIST = re.compile(r"\b(list|show|which|what|who|any|available|free|slots?|options)\b")
+_DOCTORS = re.compile(r"\b(doctors?|specialists?|slots?|available|free)\b")
+
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_MONTH_DAY = re.compile(rf"\b({_MONTH_NAMES})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b")
+_DAY_MONTH = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_MONTH_NAMES})\b")
+_DAY_ONLY = re.compile(r"\bthe\s+(\d{1,2})(?:st|nd|rd|th)\b")
+_RELATIVE = re.compile(r"\b(day after tomorrow|today|tomorrow)\b")
+_WEEKDAY = re.compile(rf"\b(?:next\s+|this\s+|on\s+)?({'|'.join(WEEKDAYS)})\b")
+_TIME = re.compile(r"\b(?:(at|by|around)\s+)?(\d{1,2})(?::(\d{2}))?\s*(a\.?\s?m\b\.?|p\.?\s?m\b\.?|o'?clock)?")
+_NUMBER_WORD = re.compile(rf"\b({'|'.join(NUMBER_WORDS)})\b(?=\s*(?:a\.?\s?m|p\.?\s?m|o'?clock|thirty))|(?<=\bat )({'|'.join(NUMBER_WORDS)})\b")
+_NAME = re.compile(r"\b(?:my name is|name's|call me)\s+([a-z][a-z'-]*(?:\s+[a-z][a-z'-]*)?)", re.IGNORECASE)
+_SHORT_NAME = re.compile(r"^\s*(?i:hi|hello|hey)?[,\s]*(?i:i am|i'm|this is|it's)\s+([A-Z][a-zA-Z'-]*(?:\s+[A-Z][a-zA-Z'-]*)?)[.!\s]*$")
+# Words that end a name, or show the words after "call me" or "it's" are no name at all
+_NOT_NAMES = frozenset([
+    "and", "but", "or", "so", "then", "also", "too", "please", "thanks", "thank", "i", "i'm", "im", "me", "you",
+    "it", "this", "that", "is", "am", "was", "will", "would", "want", "wanted", "need", "like", "to", "for", "with",
+    "at", "on", "in", "the", "a", "an", "here", "there", "calling", "speaking", "again", "just", "now", "later",
+    "back", "soon", "yes", "no", "not", "ok", "okay", "sure", "fine", "good", "great", "booking", "book",
+    "schedule", "appointment", "doctor", "dr", "today", "tomorrow", "tonight", "morning", "afternoon", "evening",
+    "night", "noon", "week", "weekend", "next", "day", "time",
+] + WEEKDAYS + list(MONTHS))
+
+
+def find_name(text):
+    """
+    Find the name a user introduces themselves with, as in "my name is Sara
+    Khan" or "I'm Sara", or None.
+
+    The name is one or two words and stops at the first word in `_NOT_NAMES`,
+    so "My name is John and I want..." gives "John". When the first word is
+    one of them ("call me tomorrow", "it's Tuesday") there is no name.
+    """
+    match = _NAME.search(text) or _SHORT_NAME.match(text)
+    if not match:
+        return None
+    words = []
+    for word in match.group(1).split():
+        if word.lower() in _NOT_NAMES or word.lower() in SPECIALTY_SYNONYMS:
+            break
+        words.append(word.capitalize())
+    return " ".join(words) or None
+
+
+def parse_date(text, today):
+    """
+    Find one date in lowercased text, relative to `today`.
+
+    Returns:
+    tuple: (datetime.date or None, list of matched spans). More than one
+    distinct date is reported as (None, spans) so the caller can back off.
+    """
+    found = []
+    for match in _ISO_DATE.finditer(text):
+        found.append((match.span(), _safe_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))))
+    for match in _MONTH_DAY.finditer(text):
+        found.append((match.span(), _upcoming(today, MONTHS[match.group(1)], int(match.group(2)))))
+    for match in _DAY_MONTH.finditer(text):
+        found.append((match.span(), _upcoming(today, MONTHS[match.group(2)], int(match.group(1)))))
+    for match in _DAY_ONLY.finditer(text):
+        month = today.month if int(match.group(1)) >= today.day else today.month % 12 + 1
+        found.append((match.span(), _upcoming(today, month, int(match.group(1)))))
+    for match in _RELATIVE.finditer(text):
+        offset = {"today": 0, "tomorrow": 1, "day after tomorrow": 2}[match.group(1)]
+        found.append((match.span(), today + datetime.timedelta(days=offset)))
+    for match in _WEEKDAY.finditer(text):
+        days = (WEEKDAYS.index(match.group(1)) - today.weekday()) % 7 or 7
+        found.append((match.span(), today + datetime.timedelta(days=days)))
+
+    # Overlapping matches ("september 25" and "25 ... september") describe the same date
+    dates = {date for _, date in found}
+    spans = [span for span, _ in found]
+    if len(dates) != 1 or None in dates:
+        return None, spans
+    return dates.pop(), spans
+
+
+def parse_time(text, date_spans=()):
+    """
+    Find one clock time in lowercased text, skipping the spans of dates.
+
+    A bare number only counts as a time after "at", "by" or "around", with
+    minutes, or with am/pm/o'clock. Without am/pm, 1 to 6 are read as
+    afternoon hours, which is how people talk about clinic appointments.
+
+    Returns:
+    datetime.time or None: None when there is no time or more than one.
+    """
+    text = re.sub(r"\bnoon\b", "12:00 pm", text)
+    text = _NUMBER_WORD.sub(lambda match: str(NUMBER_WORDS[match.group(1) or match.group(2)]), text)
+    times = set()
+    for match in _TIME.finditer(text):
+        if any(start <= match.start(2) < end for start, end in date_spans):
+            continue
+        prefix, hour, minute, suffix = match.group(1), int(match.group(2)), match.group(3), match.group(4)
+        if not (prefix or minute or suffix):
+            continue
+        minute = int(minute or 0)
+        suffix = (suffix or "").replace(".", "").replace(" ", "")
+        if suffix.startswith("p") and hour < 12:
+            hour += 12
+        elif suffix.startswith("a") and hour == 12:
+            hour = 0
+        elif not suffix.startswith(("a", "p")) and 1 <= hour <= 6:
+            hour += 12
+        if hour > 23 or minute > 59:
+            continue
+        times.add(datetime.time(hour, minute))
+    return times.pop() if len(times) == 1 else None
+
+
+def speak_slot(slot):
+    """
+    Format a slot for speech, e.g. "Wednesday, September 25 at 9:00 AM".
+    """
+    return f"{slot:%A, %B} {slot.day} at {slot.strftime('%I:%M %p').lstrip('0')}"
+
+
+def _safe_date(year, month, day):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _upcoming(today, month, day):
+    # The next occurrence of a month/day on or after today
+    date = _safe_date(today.year, month, day)
+    if date is not None and date < today:
+        date = _safe_date(today.year + 1, month, day)
+    return date
+
+
+def _day_bounds(date):
+    # [start, end) of a whole day, or no bounds without a date
+    if date is None:
+        return None, None
+    start = datetime.datetime.combine(date, datetime.time())
+    return start, start + datetime.timedelta(days=1)
+
+
+class IntentRouter:
+    """
+    Answer deterministic scheduling turns without calling the LLM.
+
+    Three kinds of turn are handled locally: the user giving their name,
+    asking which doctors or slots are free (optionally for one doctor, one
+    specialty or one date), and booking a named doctor at a full date and
+    time once the patient's name is known. Doctor names and specialties are
+    fuzzy-matched against the live `AvailabilityStore`, dates are resolved
+    relative to `today`. Anything ambiguous, or anything that looks like a
+    cancellation, a question or a change of plan, returns None so the caller
+    falls back to the model.
+
+    Args:
+    store (AvailabilityStore): Live availability, used for name matching and slot listings.
+    schedule_meeting (callable): Booking tool taking (doctor_name, patient_name, requested_time) and returning JSON.
+    today (str): The assistant's notion of today, "YYYY-MM-DD".
+    refresh (callable): Called before each turn to bring `store` up to date, e.g. with other workers' bookings.
+    """
+
+    def __init__(self, store, schedule_meeting, today, refresh=None, max_doctors=4, max_slots=3):
+        self.store = store
+        self.schedule_meeting = schedule_meeting
+        self.refresh = refresh
+        self.today = datetime.date.fromisoformat(today)
+        self.max_doctors = max_doctors
+        self.max_slots = max_slots
+        self.patient_name = None
+        self._roster_version = None
+        self._name_index = {}
+        self._specialties = {}
+
+    def route(self, user_input):
+        """
+        Handle a user utterance locally if the router is confident.
+
+        Returns:
+        dict or None: {"intent", "response"} for a handled turn, or None to use the LLM.
+        """
+        if self.refresh is not None:
+            self.refresh()
+        result = self._route(user_input)
+        if result is None:
+            router_stats['fallback'] += 1
+            return None
+        router_stats['routed'] += 1
+        router_stats[result['intent']] += 1
+        return result
+
+    def preview(self, user_input):
+        """
+        Predict what `route` would answer, without learning a name or booking anything.
+
+        Meant for partial transcripts. A booking previews as confirmed when
+        the slot is free in `store` right now.
+
+        Returns:
+        dict or None: As for `route`.
+        """
+        shadow = copy.copy(self)
+        shadow.schedule_meeting = lambda doctor_name, patient_name, requested_time: json.dumps(
+            {"status": "success" if self.store.is_available(doctor_name, requested_time) else "error"})
+        return shadow._route(user_input)
+
+    def likely_responses(self, last_response=""):
+        """
+        Guess the router's next answers from the conversation state alone, most likely first.
+
+        Nothing is predictable before the patient's name is known. After that
+        the likely answers are confirmations of the first free slots of the
+        doctors named in `last_response` (the ones just offered), then the
+        listing of every doctor.
+
+        Returns:
+        list: Response texts.
+        """
+        if not self.patient_name:
+            return []
+        responses = []
+        for name, _ in self.store.roster():
+            if name in last_response:
+                responses += [self._confirmation(name, slot) for slot in self._free_slots(name, None)]
+        responses.append(self._list(None, None, None)['response'])
+        return responses
+
+    def _route(self, user_input):
+        # A name introduced on this turn is only kept if the router answers the turn
+        name = find_name(user_input)
+        previous_name = self.patient_name
+        if name is not None:
+            self.patient_name = name
+        result = self._answer(user_input, name is not None)
+        if result is None:
+            self.patient_name = previous_name
+        return result
+
+    def _answer(self, user_input, introduced):
+        text = user_input.lower().replace("dr.", "dr")
+        if _UNSURE.search(text) or "?" in text and _BOOK.search(text) and "can" not in text:
+            return None
+
+        doctors = self._match_doctors(text)
+        if len(doctors) > 1:
+            return None
+        specialty = self._match_specialty(text)
+        date, date_spans = parse_date(text, self.today)
+        if date is None and date_spans:
+            return None
+        time = parse_time(text, date_spans)
+
+        if _BOOK.search(text):
+            if doctors and date and time and self.patient_name:
+                return self._book(doctors[0], datetime.datetime.combine(date, time))
+            if time or not _LIST.search(text):
+                # A booking with details missing needs the model's follow-up questions
+                return None
+        if _LIST.search(text) and (_DOCTORS.search(text) or specialty or doctors) and not time:
+            return self._list(doctors[0] if doctors else None, specialty, date)
+        if introduced and not (doctors or specialty or date or time):
+            return {"intent": "introduce", "response": f"Nice to meet you, {self.patient_name}. Which doctor would you like to see, or shall I list the available doctors?"}
+        return None
+
+    def _refresh_roster(self):
+        if self._roster_version == self.store.roster_version:
+            return
+        self._name_index = {}
+        self._specialties = {}
+        for name, specialty in self.store.roster():
+            for token in re.findall(r"[a-z']+", name.lower()):
+                if token not in ("dr", "doctor"):
+                    self._name_index.setdefault(token, set()).add(name)
+            self._specialties[specialty.lower()] = specialty
+        self._roster_version = self.store.roster_version
+
+    def _match_doctors(self, text):
+        self._refresh_roster()
+        tokens = re.findall(r"[a-z']+", text)
+        matches = set()
+        for position, token in enumerate(tokens):
+            if token in self._name_index:
+                matches |= self._name_index[token]
+            elif len(token) >= 3 and position and tokens[position - 1] in ("dr", "doctor"):
+                # Transcription misspellings are only trusted right after "Dr."
+                close = difflib.get_close_matches(token, self._name_index, n=2, cutoff=0.6)
+                if len(close) == 1:
+                    matches |= self._name_index[close[0]]
+        return sorted(matches)
+
+    def _match_specialty(self, text):
+        self._refresh_roster()
+        for token in re.findall(r"[a-z']+", text):
+            token = SPECIALTY_SYNONYMS.get(token, token)
+            close = difflib.get_close_matches(token.rstrip("s"), self._specialties, n=1, cutoff=0.85)
+            if close:
+                return self._specialties[close[0]]
+        return None
+
+    def _book(self, doctor_name, slot):
+        result = json.loads(self.schedule_meeting(doctor_name, self.patient_name, slot.strftime("%Y-%m-%d %H:%M")))
+        if result.get('status') == "success":
+            response = self._confirmation(doctor_name, slot)
+        else:
+            free = self._free_slots(doctor_name, None)
+            response = f"Sorry, {doctor_name} is not free on {speak_slot(slot)}."
+            if free:
+                response += " The next free times are on " + self._speak_slots(free) + "."
+        return {"intent": "schedule_meeting", "response": response}
+
+    def _confirmation(self, doctor_name, slot):
+        return f"Done, {self.patient_name}. Your meeting with {doctor_name} is booked for {speak_slot(slot)}."
+
+    def _list(self, doctor_name, specialty, date):
+        if doctor_name:
+            names = [doctor_name]
+        else:
+            names = [name for name, doctor_specialty in self.store.roster() if specialty is None or doctor_specialty == specialty]
+
+        lines = []
+        for name in names:
+            free = self._free_slots(name, date)
+            if free:
+                doctor = self.store.get_doctor(name)
+                times = self._speak_slots(free)
+                total = self.store.count_slots(name, *_day_bounds(date))
+                more = f" and {total - self.max_slots} more" if total > self.max_slots else ""
+                lines.append(f"{name}, {doctor['specialty'].lower()}, is free on {times}{more}.")
+
+        when = f" on {date:%A, %B} {date.day}" if date else ""
+        if not lines:
+            who = doctor_name or (f"{specialty.lower()}s" if specialty else "doctors")
+            response = f"Sorry, there are no free slots for {who}{when}."
+        else:
+            response = " ".join(lines[:self.max_doctors])
+            if len(lines) > self.max_doctors:
+                response += f" There are {len(lines) - self.max_doctors} more doctors with free slots{when}."
+            response += " Which one would you like to book?"
+        return {"intent": "list_doctors", "response": response}
+
+    def _free_slots(self, doctor_name, date):
+        # The first few free slots only; rule-based availability is never listed in full
+        return self.store.doctor_slots(doctor_name, *_day_bounds(date), limit=self.max_slots)
+
+    def _speak_slots(self, slots):
+        # "Wednesday, September 25 at 9:00 AM and 10:00 AM": each day is named once
+        days = []
+        for slot in slots:
+            time = slot.strftime('%I:%M %p').lstrip('0')
+            if days and days[-1][0] == slot.date():
+                days[-1][1].append(time)
+            else:
+                days.append((slot.date(), [time]))
+        return self._join([f"{day:%A, %B} {day.day} at {self._join(times)}" for day, times in days])
+
+    @staticmethod
+    def _join(items):
+        return items[0] if len(items) == 1 else ", ".join(items[:-1]) + " and " + items[-1]
+
+
+if __name__ == "__main__":
+    # Replay a labelled transcript corpus and count the LLM calls the router saves.
+    # Without the router every turn costs one completion, and a turn where the model
+    # calls a tool costs two (tool choice, then the answer). Turns are labelled with
+    # the intent the router should take, or null when the model should answer.
+    import os
+    from voice_assistant.availability import AvailabilityStore
+
+    root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils")
+    with open(os.path.join(root, "doctors_data.json")) as file:
+        doctors = json.load(file)
+    with open(os.path.join(root, "sample_transcripts.json")) as file:
+        conversations = json.load(file)
+
+    baseline_calls = routed_calls = turns = handled = wrong = 0
+    for conversation in conversations:
+        store = AvailabilityStore(doctors)
+
+        def book(doctor_name, patient_name, requested_time):
+            if store.book(doctor_name, requested_time):
+                return json.dumps({"status": "success"})
+            return json.dumps({"status": "error"})
+
+        router = IntentRouter(store, book, conversation.get('today', "2024-09-24"))
+        for turn in conversation['turns']:
+            turns += 1
+            calls = 2 if turn['intent'] in ("list_doctors", "schedule_meeting") else 1
+            baseline_calls += calls
+            result = router.route(turn['user'])
+            if result is None:
+                routed_calls += calls
+                continue
+            handled += 1
+            if result['intent'] != turn['intent']:
+                wrong += 1
+                print(f"Mismatch: {turn['user']!r} -> {result['intent']}")
+
+    print(f"{len(conversations)} conversations, {turns} turns")
+    print(f"Handled locally: {handled} turns ({handled / turns:.0%}), {wrong} routed to the wrong intent")
+    print(f"LLM calls: {baseline_calls} -> {routed_calls} ({1 - routed_calls / baseline_calls:.0%} fewer)")
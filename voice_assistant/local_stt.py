@@ -0,0 +1,303 @@
+import contextlib
+import io
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from voice_assistant.config import Config
+
+# Utterances, batch sizes and time spent per forward pass, served by /stt/metrics
+stt_stats = {
+    "utterances": 0,
+    "long_utterances": 0,
+    "audio_seconds": 0.0,
+    "batches": 0,
+    "max_batch": 0,
+    "feature_seconds": 0.0,
+    "inference_seconds": 0.0,
+    "load_seconds": 0.0,
+}
+_stats_lock = threading.Lock()
+
+# Warm models keyed by model size or path
+_transcribers = {}
+_lock = threading.Lock()
+
+
+class BatchWorkerPool:
+    """
+    Group concurrent calls from many threads into batches for a pool of worker threads.
+
+    This is the thread counterpart of `local_tts_api.MicroBatcher`: `submit`
+    blocks its caller until the item's result is ready. A worker takes the
+    first waiting item and, while `preparing` says more items are on their
+    way, collects them for up to `window` seconds or until the batch holds
+    `max_batch` items. It then calls `process_batch(items)` once; it must
+    return one result per item. A lone item is never held back, and while
+    every worker is busy new items pile up, so under load batches fill
+    without waiting at all.
+    """
+
+    def __init__(self, process_batch, workers=1, window=0.01, max_batch=8, name="batch"):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.incoming = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for index in range(workers):
+            threading.Thread(target=self._run, name=f"{name}-{index}", daemon=True).start()
+
+    @contextlib.contextmanager
+    def preparing(self):
+        """
+        Count an item as on its way while its caller prepares it.
+        """
+        with self._lock:
+            self.incoming += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.incoming -= 1
+
+    def submit(self, item):
+        """
+        Queue one item and wait for its result.
+        """
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout <= 0 or not self.incoming:
+                        entry = self._queue.get_nowait()
+                    else:
+                        entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(entry)
+            try:
+                results = self.process_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class LocalTranscriber:
+    """
+    A Whisper model kept warm in this process, decoding concurrent utterances together.
+
+    The model is faster-whisper's CTranslate2 port, quantized (int8 by default)
+    and run on the CPU. Each utterance's log-Mel features are computed in its
+    caller's thread; utterances of up to 30 seconds, the model's window, are
+    then padded to that window and encoded and decoded in batches on a
+    dedicated pool of `workers` threads (see `BatchWorkerPool`). CTranslate2
+    runs that many forward passes in parallel, each on `cpu_threads` threads.
+    Longer audio goes through faster-whisper's own sequential long-form
+    decoding.
+
+    Whisper can loop on noise until its 448-token limit, so decoding stops
+    after `tokens_per_second` tokens per second of audio, well above the
+    rate of fast speech.
+
+    With `full_window` unset a batch is encoded only as long as its longest
+    utterance plus a second of silence instead of the whole 30 seconds. The
+    encoder's cost grows with its input, so a few seconds of speech encode
+    an order of magnitude faster, but Whisper was trained on full windows
+    and is less accurate on trimmed ones.
+    """
+
+    def __init__(self, model_path, compute_type="int8", cpu_threads=0, workers=1, beam_size=1, window=0.01, max_batch=8,
+                 tokens_per_second=8, full_window=True):
+        from faster_whisper import WhisperModel
+        from faster_whisper.tokenizer import Tokenizer
+        from faster_whisper.transcribe import get_suppressed_tokens
+
+        started = time.perf_counter()
+        self.model = WhisperModel(model_path, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads, num_workers=workers)
+        self.beam_size = beam_size
+        self.tokens_per_second = tokens_per_second
+        self.full_window = full_window
+        self.tokenizer = Tokenizer(self.model.hf_tokenizer, self.model.model.is_multilingual, task="transcribe", language="en")
+        self.prompt = self.model.get_prompt(self.tokenizer, [], without_timestamps=True)
+        self.suppress_tokens = get_suppressed_tokens(self.tokenizer, [-1])
+        self.sample_rate = self.model.feature_extractor.sampling_rate
+        self.window_samples = self.model.feature_extractor.n_samples
+        self.window_frames = self.model.feature_extractor.nb_max_frames
+        self.batcher = BatchWorkerPool(self._decode_batch, workers, window, max_batch, name="stt-batch")
+        with _stats_lock:
+            stt_stats['load_seconds'] += time.perf_counter() - started
+
+    def transcribe(self, samples):
+        """
+        Transcribe mono float32 samples at `self.sample_rate`.
+        """
+        with _stats_lock:
+            stt_stats['utterances'] += 1
+            stt_stats['audio_seconds'] += len(samples) / self.sample_rate
+        if len(samples) > self.window_samples:
+            started = time.perf_counter()
+            segments, _ = self.model.transcribe(samples, language="en", beam_size=self.beam_size, without_timestamps=True,
+                                                max_new_tokens=self.max_new_tokens(self.window_samples))
+            text = "".join(segment.text for segment in segments).strip()
+            with _stats_lock:
+                stt_stats['long_utterances'] += 1
+                stt_stats['inference_seconds'] += time.perf_counter() - started
+            return text
+
+        with self.batcher.preparing():
+            started = time.perf_counter()
+            features = self.model.feature_extractor(samples)[..., :-1]
+            with _stats_lock:
+                stt_stats['feature_seconds'] += time.perf_counter() - started
+        return self.batcher.submit((features, self.max_new_tokens(len(samples))))
+
+    def max_new_tokens(self, sample_count):
+        return min(self.model.max_length // 2, 4 + int(self.tokens_per_second * sample_count / self.sample_rate))
+
+    def transcribe_bytes(self, audio_bytes, sample_rate=None):
+        """
+        Transcribe raw 16-bit mono PCM at `sample_rate`, or, when no rate is
+        given, an encoded clip in any container PyAV can decode.
+        """
+        if sample_rate is None:
+            from faster_whisper.audio import decode_audio
+            samples = decode_audio(io.BytesIO(audio_bytes), self.sample_rate)
+        else:
+            from voice_assistant.audio_ingest import resample
+            samples = resample(np.frombuffer(audio_bytes, dtype="<i2").astype(np.float32) / 32768, sample_rate, self.sample_rate)
+        return self.transcribe(samples)
+
+    def _decode_batch(self, items):
+        started = time.perf_counter()
+        frames = self.window_frames
+        if not self.full_window:
+            frames = min(frames, max(features.shape[-1] for features, _ in items) + self.model.frames_per_second)
+            frames += frames % 2
+        encoder_output = self.model.encode(np.stack([np.pad(features, ((0, 0), (0, frames - features.shape[-1]))) for features, _ in items]))
+        results = self.model.model.generate(
+            encoder_output,
+            [self.prompt] * len(items),
+            beam_size=self.beam_size,
+            max_length=len(self.prompt) + max(max_new_tokens for _, max_new_tokens in items),
+            suppress_blank=True,
+            suppress_tokens=self.suppress_tokens,
+            return_scores=True,
+            return_no_speech_prob=True,
+        )
+        texts = []
+        for result in results:
+            tokens = result.sequences_ids[0]
+            # Same silence test as faster-whisper: likely no speech and a low-confidence decode
+            avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+            if result.no_speech_prob > 0.6 and avg_logprob < -1.0:
+                texts.append("")
+            else:
+                texts.append(self.tokenizer.decode(tokens).strip())
+
+        with _stats_lock:
+            stt_stats['batches'] += 1
+            stt_stats['max_batch'] = max(stt_stats['max_batch'], len(items))
+            stt_stats['inference_seconds'] += time.perf_counter() - started
+        return texts
+
+
+def get_local_transcriber(model_path=None):
+    """
+    Return the warm local Whisper model, loading it on first use.
+
+    Args:
+    model_path (str): A CTranslate2 Whisper model directory or a model size;
+        defaults to Config.LOCAL_STT_MODEL.
+    """
+    model_path = model_path or Config.LOCAL_STT_MODEL
+    with _lock:
+        transcriber = _transcribers.get(model_path)
+        if transcriber is None:
+            logging.info(f"Loading local Whisper model {model_path}")
+            transcriber = LocalTranscriber(
+                model_path, compute_type=Config.LOCAL_STT_COMPUTE_TYPE, cpu_threads=Config.LOCAL_STT_CPU_THREADS,
+                workers=Config.LOCAL_STT_WORKERS, beam_size=Config.LOCAL_STT_BEAM_SIZE,
+                window=Config.LOCAL_STT_BATCH_WINDOW, max_batch=Config.LOCAL_STT_BATCH_MAX,
+                tokens_per_second=Config.LOCAL_STT_TOKENS_PER_SECOND, full_window=Config.LOCAL_STT_FULL_WINDOW)
+            _transcribers[model_path] = transcriber
+        return transcriber
+
+
+def local_stt_metrics():
+    batches = stt_stats['batches']
+    seconds = stt_stats['audio_seconds']
+    return dict(stt_stats,
+                loaded=sorted(_transcribers),
+                avg_batch=(stt_stats['utterances'] - stt_stats['long_utterances']) / batches if batches else 0,
+                real_time_factor=(stt_stats['feature_seconds'] + stt_stats['inference_seconds']) / seconds if seconds else 0)
+
+
+if __name__ == "__main__":
+    # Real-time factor on the bundled test.mp3 (processing time / audio duration),
+    # for one utterance at a time and for 1-16 concurrent callers, against
+    # faster-whisper's own transcribe() called per utterance without batching.
+    # Usage: python -m voice_assistant.local_stt [model size or path]
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    model_path = sys.argv[1] if len(sys.argv) > 1 else Config.LOCAL_MODEL_PATH
+    started = time.perf_counter()
+    transcriber = get_local_transcriber(model_path)
+    print(f"Loaded {model_path or Config.LOCAL_STT_MODEL} ({Config.LOCAL_STT_COMPUTE_TYPE}) in {time.perf_counter() - started:.2f}s")
+
+    with open(Config.INPUT_AUDIO, "rb") as f:
+        clip = f.read()
+    from faster_whisper.audio import decode_audio
+    samples = decode_audio(io.BytesIO(clip), transcriber.sample_rate)
+    duration = len(samples) / transcriber.sample_rate
+    print(f"{Config.INPUT_AUDIO}: {duration:.2f}s -> {transcriber.transcribe(samples)!r}")
+
+    def unbatched(_):
+        segments, _ = transcriber.model.transcribe(samples, language="en", beam_size=Config.LOCAL_STT_BEAM_SIZE, without_timestamps=True,
+                                                   temperature=0, max_new_tokens=transcriber.max_new_tokens(len(samples)))
+        return "".join(segment.text for segment in segments)
+
+    def batched(_):
+        return transcriber.transcribe(samples)
+
+    for full_window in (True, False):
+        transcriber.full_window = full_window
+        runs = 5
+        latencies = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            transcriber.transcribe(samples)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        print(f"warm single utterance, {'full' if full_window else 'trimmed'} window: "
+              f"{latencies[runs // 2] * 1000:.0f} ms, RTF {latencies[runs // 2] / duration:.3f}")
+
+    for clients in (1, 4, 16):
+        utterances = clients * 2
+        for name, call, full_window in (("transcribe() per utterance", unbatched, True),
+                                        ("batched, full window", batched, True),
+                                        ("batched, trimmed window", batched, False)):
+            transcriber.full_window = full_window
+            stt_stats['batches'] = 0
+            with ThreadPoolExecutor(clients) as pool:
+                started = time.perf_counter()
+                list(pool.map(call, range(utterances)))
+                elapsed = time.perf_counter() - started
+            batching = f", {utterances / stt_stats['batches']:.1f} per batch" if call is batched else ""
+            print(f"{clients:2d} clients, {name:26s}: {utterances / elapsed:6.2f} utterances/s, "
+                  f"aggregate RTF {elapsed / (utterances * duration):.3f}{batching}")
@@ -1,9 +1,23 @@
+import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from pydantic import BaseModel
 from melo.api import TTS
+from melo import utils
 from config import Config
+import numpy as np
 import torch
-import uuid
+
+# Intra-op threads for each forward pass and inter-op threads across them; 0 keeps torch's default
+if Config.TORCH_NUM_THREADS:
+    torch.set_num_threads(Config.TORCH_NUM_THREADS)
+if Config.TORCH_NUM_INTEROP_THREADS:
+    torch.set_num_interop_threads(Config.TORCH_NUM_INTEROP_THREADS)
 
 app = FastAPI()
 
@@ -12,7 +26,6 @@ class TextToSpeechRequest(BaseModel):
     language: str = 'EN'
     accent: str = 'EN-US'
     speed: float = 1.0
-    filename: str = Field(default_factory=lambda: f"{uuid.uuid4()}.wav")
 
 def get_device():
     if torch.cuda.is_available():
@@ -21,22 +34,200 @@ def get_device():
         return 'mps'
     else:
         return 'cpu'
-device = get_device() 
+device = get_device()
 model = TTS(language='EN', device=device)
 speaker_ids = model.hps.data.spk2id
+sample_rate = model.hps.data.sampling_rate
+hop_length = model.hps.data.hop_length
+
+# Batch sizes and queueing per forward pass
+batch_stats = {"requests": 0, "pieces": 0, "batches": 0, "max_batch": 0, "padding_ratio_total": 0.0, "inference_seconds": 0.0}
+
+
+class MicroBatcher:
+    """
+    Group concurrent requests into batches for one worker thread.
+
+    `submit` queues a request's items and waits for their results. The worker
+    takes the first waiting request and, while `incoming` says more requests
+    are on their way (still being preprocessed by their callers), collects
+    them for up to `window` seconds or until the batch holds `max_batch`
+    items. It then calls `process_batch(items)` once for all of them; it must
+    return one result per item. A lone request is never held back, and
+    while a batch is running new requests pile up, so under load batches
+    fill without waiting at all.
+    """
+
+    def __init__(self, process_batch, window=0.01, max_batch=16):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.incoming = 0
+        self._queue = None
+        self._worker = None
+        # The model is not thread-safe: every batch runs on this one thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-batch")
+
+    async def submit(self, items):
+        """
+        Queue items that belong to one request and return their results in order.
+        """
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((list(items), future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout <= 0 or not self.incoming:
+                        entry = self._queue.get_nowait()
+                    else:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                batch.append(entry)
+                size += len(entry[0])
+            # Requests whose client went away are dropped before the forward pass
+            batch = [(items, future) for items, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self._executor, self.process_batch, [item for items, _ in batch for item in items])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            start = 0
+            for items, future in batch:
+                if not future.done():
+                    future.set_result(results[start:start + len(items)])
+                start += len(items)
+
+
+def prepare_pieces(request):
+    """
+    Split a request into sentence pieces and compute their text features.
+
+    This is the per-request front end (text normalization, phonemes and BERT
+    features), run in the request's own thread so it overlaps the batched
+    forward pass of earlier requests.
+    """
+    pieces = []
+    for text in model.split_sentences_into_pieces(request.text, model.language, quiet=True):
+        if model.language in ['EN', 'ZH_MIX_EN']:
+            text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
+        bert, ja_bert, phones, tones, lang_ids = utils.get_text_for_tts_infer(text, model.language, model.hps, device, model.symbol_to_id)
+        pieces.append({"bert": bert, "ja_bert": ja_bert, "phones": phones, "tones": tones, "lang_ids": lang_ids,
+                       "speaker": speaker_ids[request.accent], "speed": request.speed})
+    return pieces
+
+
+def synthesize_batch(pieces, sdp_ratio=0.2, noise_scale=0.6, noise_scale_w=0.8):
+    """
+    Synthesize sentence pieces, padding those with the same speed into forward passes.
+
+    Pieces are sorted by length before they are cut into passes of at most
+    `Config.TTS_BATCH_MAX`, so each pass pads as little as possible.
+
+    Returns:
+    list: One float32 waveform per piece.
+    """
+    started = time.perf_counter()
+    results = [None] * len(pieces)
+    groups = {}
+    for index, piece in enumerate(pieces):
+        groups.setdefault(piece['speed'], []).append(index)
+
+    passes = []
+    for speed, indices in groups.items():
+        indices.sort(key=lambda index: pieces[index]['phones'].size(0))
+        passes += [(speed, indices[start:start + Config.TTS_BATCH_MAX]) for start in range(0, len(indices), Config.TTS_BATCH_MAX)]
+
+    for speed, indices in passes:
+        lengths = [pieces[index]['phones'].size(0) for index in indices]
+        longest = max(lengths)
+
+        def padded(key):
+            # Right-pad the last dimension to the longest piece and stack
+            return torch.stack([
+                torch.nn.functional.pad(pieces[index][key], (0, longest - pieces[index][key].size(-1)))
+                for index in indices
+            ]).to(device)
+
+        with torch.inference_mode():
+            audio, _, y_mask, _ = model.model.infer(
+                padded('phones'), torch.LongTensor(lengths).to(device),
+                torch.LongTensor([pieces[index]['speaker'] for index in indices]).to(device),
+                padded('tones'), padded('lang_ids'), padded('bert'), padded('ja_bert'),
+                sdp_ratio=sdp_ratio, noise_scale=noise_scale, noise_scale_w=noise_scale_w, length_scale=1. / speed,
+            )
+            samples = (y_mask.sum(dim=(1, 2)).long() * hop_length).tolist()
+            audio = audio[:, 0].float().cpu().numpy()
+        for row, index in enumerate(indices):
+            results[index] = audio[row, :samples[row]]
+
+        batch_stats['padding_ratio_total'] += 1 - sum(lengths) / (longest * len(lengths))
+        batch_stats['batches'] += 1
+        batch_stats['max_batch'] = max(batch_stats['max_batch'], len(indices))
+
+    if device == 'cuda':
+        torch.cuda.empty_cache()
+    batch_stats['pieces'] += len(pieces)
+    batch_stats['inference_seconds'] += time.perf_counter() - started
+    return results
+
+
+def to_pcm(waveforms, speed):
+    # Join the pieces with the same short pause MeloTTS puts between sentences
+    pause = np.zeros(int(sample_rate * 0.05 / speed), dtype=np.float32)
+    audio = np.concatenate([part for waveform in waveforms for part in (waveform, pause)]) if waveforms else pause
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+batcher = MicroBatcher(synthesize_batch, window=Config.TTS_BATCH_WINDOW, max_batch=Config.TTS_BATCH_MAX)
 
 @app.post("/generate-audio/")
-def generate_audio(request: TextToSpeechRequest):
+async def generate_audio(request: TextToSpeechRequest):
+    """
+    Synthesize text and return it as raw 16-bit mono PCM in the response body.
+
+    The sample rate is in the X-Sample-Rate header. Concurrent requests are
+    synthesized together (see `MicroBatcher`).
+    """
     if request.accent not in speaker_ids:
         raise HTTPException(status_code=400, detail="Invalid accent specified")
-    
+
     try:
-        output_filename = request.filename
-        model.tts_to_file(request.text, speaker_ids[request.accent], output_filename, speed=request.speed)
-        return {"message": "Audio file generated successfully", "file_path": output_filename}
+        batcher.incoming += 1
+        try:
+            pieces = await run_in_threadpool(prepare_pieces, request)
+        finally:
+            batcher.incoming -= 1
+        waveforms = await batcher.submit(pieces)
+        batch_stats['requests'] += 1
+        return Response(content=to_pcm(waveforms, request.speed), media_type="audio/L16",
+                        headers={"X-Sample-Rate": str(sample_rate), "X-Channels": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+def metrics():
+    batches = batch_stats['batches']
+    return dict(batch_stats,
+                avg_batch=batch_stats['pieces'] / batches if batches else 0,
+                avg_padding_ratio=batch_stats['padding_ratio_total'] / batches if batches else 0,
+                torch_threads=torch.get_num_threads())
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=Config.TTS_PORT_LOCAL)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=Config.TTS_PORT_LOCAL)
@@ -1,9 +1,14 @@
 import requests
 from voice_assistant.config import Config
+from voice_assistant.providers import get_http_session
 
 
-def generate_audio_file_melotts(text, language='EN', accent='EN-US', speed=1.0, filename=None):
+def stream_audio_melotts(text, language='EN', accent='EN-US', speed=1.0, chunk_size=4096):
+    """
+    Synthesize text on the MeloTTS server and yield its raw 16-bit mono PCM as it downloads.
 
+    The server's sample rate is 44100 Hz (also sent in its X-Sample-Rate header).
+    """
     url = f"http://localhost:{Config.TTS_PORT_LOCAL}/generate-audio/"
 
     # Define the payload
@@ -14,30 +19,53 @@ def generate_audio_file_melotts(text, language='EN', accent='EN-US', speed=1.0,
         "speed": speed
     }
 
-    if filename:
-        payload["filename"] = filename
-    headers = {
-        "Content-Type": "application/json"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
+    with get_http_session().post(url, json=payload, stream=True) as response:
         response.raise_for_status()
+        yield from response.iter_content(chunk_size)
+
+
+def generate_audio_melotts(text, language='EN', accent='EN-US', speed=1.0):
+    """
+    Synthesize text on the MeloTTS server and return the whole PCM body.
+    """
+    return b"".join(stream_audio_melotts(text, language, accent, speed))
+
 
 if __name__ == "__main__":
+    # Throughput of a running server (python local_tts_api.py) for 1-64 concurrent clients.
+    # Start the server with TTS_BATCH_MAX=1 in config.py to compare against unbatched synthesis.
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    phrases = [
+        "Dr. Ali is available on Wednesday at nine in the morning.",
+        "Your meeting has been scheduled.",
+        "Which doctor would you like to see?",
+        "Sorry, that slot is no longer available. The next free slot is Thursday at ten thirty.",
+    ]
     try:
-        result = generate_audio_file_melotts(
-            text="What is the purpose of life?",
-            language="EN",
-            accent="EN-US",
-            speed=1.0,
-            filename="my_custom_audio.wav"
-        )
-        print("Audio file generated successfully")
-        print("File path:", result.get("file_path"))
-    except requests.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
-    except Exception as err:
-        print(f"Other error occurred: {err}")
\ No newline at end of file
+        generate_audio_melotts("Warm up.")
+    except requests.RequestException as err:
+        raise SystemExit(f"MeloTTS server is not reachable: {err}")
+
+    for clients in (1, 2, 4, 8, 16, 32, 64):
+        requests_per_client = 4
+        latencies = []
+
+        def client(index):
+            audio_bytes = 0
+            for turn in range(requests_per_client):
+                started = time.perf_counter()
+                audio_bytes += len(generate_audio_melotts(phrases[(index + turn) % len(phrases)]))
+                latencies.append(time.perf_counter() - started)
+            return audio_bytes
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            audio_seconds = sum(executor.map(client, range(clients))) / 2 / 44100
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        print(f"{clients:3d} clients: {clients * requests_per_client / elapsed:6.2f} requests/s, "
+              f"{audio_seconds / elapsed:6.2f} s of audio per second, "
+              f"p50 {latencies[len(latencies) // 2] * 1000:6.0f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.0f} ms")
+    print(get_http_session().get(f"http://localhost:{Config.TTS_PORT_LOCAL}/metrics").json())
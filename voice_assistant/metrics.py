@@ -0,0 +1,369 @@
+import bisect
+import contextvars
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+from voice_assistant.config import Config
+
+# Latency buckets 2^(1/4) apart from 10 us to 84 s, so quantiles read off them are within ~10%
+_BUCKETS = tuple(0.00001 * 2 ** (i / 4) for i in range(93))
+# Every fourth bucket (10 us, 20 us, 40 us, ... 84 s) is exported as a Prometheus histogram
+_EXPORTED_BUCKETS = range(0, len(_BUCKETS), 4)
+QUANTILES = (0.5, 0.95, 0.99)
+# Numeric span attributes that are also summed per stage and provider
+COUNTED_ATTRIBUTES = ("bytes", "tokens_in", "tokens_out")
+
+_histograms = {}
+_totals = {}
+_lock = threading.Lock()
+_current = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+_tracer = None
+
+
+class Histogram:
+    """
+    Latency distribution of one stage and provider in fixed log-spaced buckets.
+    """
+    __slots__ = ("counts", "count", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Estimate a quantile, interpolating geometrically inside its bucket and
+        clamping to the smallest and largest value seen.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = max(_BUCKETS[index - 1] if index else 0.0, self.min)
+                upper = min(_BUCKETS[index] if index < len(_BUCKETS) else self.max, self.max)
+                if upper <= lower or lower <= 0:
+                    return upper
+                return lower * (upper / lower) ** ((rank - seen) / count)
+            seen += count
+        return self.max
+
+
+class Span:
+    """
+    A timed stage of a turn, used as a context manager.
+
+    Spans opened inside another span (also across `run_stage` and tool
+    threads, which carry the context along) join its trace; a span with no
+    parent starts a new trace. On exit the duration goes into the histogram of
+    (name, provider) and the `COUNTED_ATTRIBUTES` into its totals; a span
+    that exits with an exception, or has an `error` attribute, is counted as
+    an error. When
+    `Config.TRACE_FILE` is set, every span of a trace is written to it as one
+    JSON line once the trace's root span ends.
+    """
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id", "started", "_token")
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current.get()
+        self.span_id = next(_span_ids)
+        if parent is None:
+            self.trace_id = os.urandom(8).hex()
+            self.parent_id = None
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        self._token = _current.set(self)
+        self.started = time.perf_counter()
+        if self.parent_id is None and _tracer is not None:
+            _tracer.begin(self.trace_id)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.started
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        _record(self.name, self.attributes.get('provider', ""), duration, self.attributes, 'error' in self.attributes)
+        if _tracer is not None:
+            _tracer.write(self, duration)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+def span(name, **attributes):
+    """
+    Time a block as a stage of the current trace.
+
+    Args:
+    name (str): The stage, e.g. 'transcribe', 'llm' or 'tts'.
+    **attributes: Recorded with the span; `provider` also labels the histogram.
+    """
+    return Span(name, **attributes)
+
+
+def annotate(**attributes):
+    """
+    Add attributes to the innermost open span, if any.
+    """
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def observe(name, seconds, provider="", **counts):
+    """
+    Record a duration without a span, for events too frequent to trace
+    (audio frames, socket sends).
+    """
+    _record(name, provider, seconds, counts, False)
+
+
+def _record(name, provider, seconds, attributes, error):
+    key = (name, provider)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+            _totals[key] = dict.fromkeys(COUNTED_ATTRIBUTES + ("errors",), 0)
+        histogram.observe(seconds)
+        totals = _totals[key]
+        for attribute in COUNTED_ATTRIBUTES:
+            value = attributes.get(attribute)
+            if value:
+                totals[attribute] += value
+        if error:
+            totals['errors'] += 1
+
+
+class _TraceWriter:
+    # Spans are buffered per trace and appended in one write when the root ends,
+    # so the lines of concurrent turns (and worker processes) never interleave
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def begin(self, trace_id):
+        with self._lock:
+            self._pending[trace_id] = []
+
+    def write(self, span, duration):
+        line = json.dumps({
+            "trace": span.trace_id, "span": span.span_id, "parent": span.parent_id, "name": span.name,
+            "start": time.time() - (time.perf_counter() - span.started), "duration_ms": round(duration * 1000, 3),
+            **span.attributes,
+        }, default=str) + "\n"
+        with self._lock:
+            if span.parent_id is None:
+                lines = self._pending.pop(span.trace_id, [])
+                lines.append(line)
+            elif span.trace_id in self._pending:
+                self._pending[span.trace_id].append(line)
+                return
+            else:
+                # Finished after its root, e.g. background compaction
+                lines = [line]
+            self._file.write("".join(lines))
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def enable_tracing(path):
+    """
+    Write spans to a JSON-lines file from now on; None turns tracing off.
+    """
+    global _tracer
+    previous, _tracer = _tracer, _TraceWriter(path) if path else None
+    if previous is not None:
+        previous.close()
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _totals.clear()
+
+
+def stage_metrics():
+    """
+    Summarize every stage and provider seen so far.
+
+    Returns:
+    dict: {stage: {provider: {"count", "errors", "mean", "p50", "p95", "p99", "max", ...totals}}},
+          durations in seconds.
+    """
+    with _lock:
+        summary = {}
+        for (name, provider), histogram in sorted(_histograms.items()):
+            entry = {"count": histogram.count, "mean": histogram.sum / histogram.count, "max": histogram.max}
+            for q in QUANTILES:
+                entry[f"p{q * 100:g}"] = histogram.quantile(q)
+            entry.update(_totals[(name, provider)])
+            summary.setdefault(name, {})[provider or "-"] = entry
+        return summary
+
+
+def stats_samples(prefix, stats, **labels):
+    """
+    Turn a flat stats dict, such as `history_stats`, into samples for `render_prometheus`.
+    """
+    for key, value in stats.items():
+        if isinstance(value, (int, float)):
+            yield f"voice_{prefix}_{key}", labels, value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def render_prometheus(samples=()):
+    """
+    Render the stage histograms and extra samples in the Prometheus text format.
+
+    Args:
+    samples (iterable): (name, labels, value) tuples, e.g. from `stats_samples`.
+    """
+    lines = [
+        "# HELP voice_stage_duration_seconds Time spent in each stage of a voice turn.",
+        "# TYPE voice_stage_duration_seconds histogram",
+    ]
+    quantiles = []
+    counters = {attribute: [] for attribute in COUNTED_ATTRIBUTES + ("errors",)}
+    with _lock:
+        for (name, provider), histogram in sorted(_histograms.items()):
+            labels = {"stage": name, "provider": provider}
+            cumulative = 0
+            previous = 0
+            for index in _EXPORTED_BUCKETS:
+                cumulative += sum(histogram.counts[previous:index + 1])
+                previous = index + 1
+                lines.append(f"voice_stage_duration_seconds_bucket{_format_labels(dict(labels, le=f'{_BUCKETS[index]:g}'))} {cumulative}")
+            lines.append(f"voice_stage_duration_seconds_bucket{_format_labels(dict(labels, le='+Inf'))} {histogram.count}")
+            lines.append(f"voice_stage_duration_seconds_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"voice_stage_duration_seconds_count{_format_labels(labels)} {histogram.count}")
+            for q in QUANTILES:
+                quantiles.append(f"voice_stage_duration_seconds_quantile{_format_labels(dict(labels, quantile=f'{q:g}'))} "
+                                 f"{_format_value(histogram.quantile(q))}")
+            for attribute, value in _totals[(name, provider)].items():
+                counters[attribute].append(f"voice_stage_{attribute}_total{_format_labels(labels)} {_format_value(value)}")
+
+    lines.append("# HELP voice_stage_duration_seconds_quantile Stage latency quantiles estimated from the histogram buckets.")
+    lines.append("# TYPE voice_stage_duration_seconds_quantile gauge")
+    lines += quantiles
+    for attribute, values in counters.items():
+        lines.append(f"# TYPE voice_stage_{attribute}_total counter")
+        lines += values
+
+    families = {}
+    for name, labels, value in samples:
+        families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for name, values in families.items():
+        lines.append(f"# TYPE {name} untyped")
+        lines += values
+    return "\n".join(lines) + "\n"
+
+
+enable_tracing(Config.TRACE_FILE)
+
+
+if __name__ == "__main__":
+    # Overhead of a span, accuracy of the bucketed quantiles, and a sample of the export formats.
+    import random
+    import tempfile
+
+    iterations = 200000
+    started = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    baseline = time.perf_counter() - started
+
+    def time_spans(label):
+        started = time.perf_counter()
+        with span("turn"):
+            for _ in range(iterations):
+                with span("tts", provider="openai", bytes=4096):
+                    pass
+        per_span = (time.perf_counter() - started - baseline) / iterations
+        print(f"{label}: {per_span * 1e6:.2f} us per span")
+        return per_span
+
+    reset()
+    time_spans("span, tracing off")
+    started = time.perf_counter()
+    for _ in range(iterations):
+        observe("send", 0.0001, provider="openai", bytes=4096)
+    observed = (time.perf_counter() - started - baseline) / iterations
+    print(f"observe: {observed * 1e6:.2f} us per call")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        enable_tracing(path)
+        traced = time_spans("span, tracing on ")
+        enable_tracing(None)
+        with open(path) as trace:
+            lines = trace.readlines()
+        assert len(lines) == iterations + 1 and json.loads(lines[-1])['name'] == "turn"
+    # A turn has roughly 30 spans and 100 observed frames and sends
+    print(f"per turn (30 spans, 100 observes): {(30 * traced + 100 * observed) * 1000:.2f} ms with tracing, "
+          f"against a turn latency of ~1000 ms")
+
+    # Quantile accuracy on log-normal latencies, as provider calls tend to be
+    reset()
+    rng = random.Random(7)
+    worst = 0.0
+    for median in (0.0003, 0.005, 0.08, 0.6, 3.0):
+        values = sorted(rng.lognormvariate(math.log(median), 0.6) for _ in range(20000))
+        for value in values:
+            observe("llm", value, provider=f"median {median}")
+        histogram = _histograms[("llm", f"median {median}")]
+        for q in QUANTILES:
+            exact = values[int(q * len(values)) - 1]
+            worst = max(worst, abs(histogram.quantile(q) / exact - 1))
+    print(f"worst quantile error against exact: {worst:.1%}")
+
+    reset()
+    with span("turn", session="demo"):
+        with span("transcribe", provider="groq", model="distil-whisper-large-v3-en", bytes=48000):
+            time.sleep(0.12)
+        with span("llm", provider="groq", tokens_in=850, tokens_out=42):
+            with span("tool", tool="show_available_doctors"):
+                time.sleep(0.01)
+            time.sleep(0.3)
+    print(render_prometheus(stats_samples("history", {"turns": 1, "prompt_tokens_max": 850})).count("\n"), "exposition lines, e.g.")
+    print("\n".join(line for line in render_prometheus().splitlines() if "quantile{" in line and 'stage="llm"' in line))
@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from voice_assistant.config import Config
+
+_executor = None
+_semaphores = {}
+_DONE = object()
+
+
+def get_executor():
+    """
+    Return the shared thread pool that runs blocking provider calls.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=Config.PIPELINE_MAX_WORKERS, thread_name_prefix="pipeline")
+    return _executor
+
+
+def _get_semaphore(stage):
+    semaphore = _semaphores.get(stage)
+    if semaphore is None:
+        semaphore = _semaphores[stage] = asyncio.Semaphore(Config.STAGE_CONCURRENCY.get(stage, Config.PIPELINE_MAX_WORKERS))
+    return semaphore
+
+
+async def run_stage(stage, func, *args, **kwargs):
+    """
+    Run a blocking provider call for a pipeline stage off the event loop.
+
+    At most `Config.STAGE_CONCURRENCY[stage]` calls of a stage run at once and
+    each call is bounded by `Config.STAGE_TIMEOUTS[stage]` seconds. The call
+    runs in a copy of the caller's context, so metric spans it opens join the
+    caller's trace.
+
+    Args:
+    stage (str): The pipeline stage, e.g. 'transcription', 'response' or 'tts'.
+    func (callable): The blocking function to run.
+
+    Returns:
+    The function's return value.
+
+    Raises:
+    asyncio.TimeoutError: If the call did not finish within the stage timeout.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    async with _get_semaphore(stage):
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(get_executor(), contextvars.copy_context().run, call), timeout=Config.STAGE_TIMEOUTS.get(stage))
+        except asyncio.TimeoutError:
+            logging.error(f"{stage} stage timed out after {Config.STAGE_TIMEOUTS.get(stage)}s")
+            raise
+
+
+async def stream_stage(stage, func, *args, **kwargs):
+    """
+    Iterate a blocking generator for a pipeline stage off the event loop.
+
+    The stage's concurrency slot is held for the whole stream, and each item
+    must arrive within `Config.STAGE_TIMEOUTS[stage]` seconds. The generator is
+    closed when iteration stops early so provider connections are released.
+
+    Args:
+    stage (str): The pipeline stage, e.g. 'tts'.
+    func (callable): A blocking function returning an iterator.
+
+    Raises:
+    asyncio.TimeoutError: If the next item did not arrive within the stage timeout.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    timeout = Config.STAGE_TIMEOUTS.get(stage)
+    # Every step of the generator runs in the same copy of the caller's context
+    context = contextvars.copy_context()
+    async with _get_semaphore(stage):
+        iterator = iter(await asyncio.wait_for(loop.run_in_executor(executor, context.run, functools.partial(func, *args, **kwargs)), timeout=timeout))
+        step = None
+        try:
+            while True:
+                step = executor.submit(context.run, next, iterator, _DONE)
+                try:
+                    item = await asyncio.wait_for(asyncio.wrap_future(step), timeout=timeout)
+                except asyncio.TimeoutError:
+                    logging.error(f"{stage} stage stream stalled for {timeout}s")
+                    raise
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            if step is not None and not step.done():
+                # Cancelled or timed out while the provider is producing an item in a
+                # worker thread: close the stream as soon as that item arrives, so an
+                # abandoned LLM or TTS stream stops instead of idling on its connection.
+                # The callback runs on that worker thread, right after its step.
+                step.add_done_callback(lambda _: _close_iterator(iterator))
+            else:
+                executor.submit(_close_iterator, iterator)
+
+
+def _close_iterator(iterator):
+    try:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+    except ValueError:
+        # Still running in another thread; it will finish on its own
+        pass
+
+
+if __name__ == "__main__":
+    # Load test with stub providers: many concurrent turns through one event loop.
+    import time
+
+    def stub_transcribe(audio):
+        time.sleep(0.2)
+        return "I would like to see Dr. Ali"
+
+    def stub_generate(text):
+        time.sleep(0.5)
+        return "Dr. Ali is available at 9:00."
+
+    def stub_tts(text):
+        time.sleep(0.3)
+        return b"\x00" * 16000
+
+    async def turn():
+        text = await run_stage("transcription", stub_transcribe, b"audio")
+        reply = await run_stage("response", stub_generate, text)
+        return await run_stage("tts", stub_tts, reply)
+
+    async def heartbeat(stop):
+        # Measures how long the event loop is blocked between ticks
+        worst = 0.0
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst = max(worst, time.perf_counter() - started - 0.01)
+        return worst
+
+    async def load_test(callers):
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(heartbeat(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(turn() for _ in range(callers)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        return elapsed, await ticker
+
+    async def main():
+        for callers in (1, 50, 200):
+            elapsed, lag = await load_test(callers)
+            print(f"{callers:4d} concurrent callers: {elapsed:6.2f}s wall, worst event loop lag {lag * 1000:.1f} ms")
+
+    asyncio.run(main())
+    print("serial (blocking calls in the event loop) would take 1.0s per caller")
@@ -0,0 +1,395 @@
+import asyncio
+import collections
+import json
+import logging
+import struct
+import time
+
+from fastapi import WebSocketDisconnect
+
+from voice_assistant import metrics
+
+# Version 1 is negotiated with this WebSocket subprotocol; clients that ask for
+# none get version 0, the original JSON-and-bare-text messages
+PROTOCOL_VERSION = 1
+SUBPROTOCOL = "voice-assistant.v1"
+
+# Every version 1 message is one binary frame: this header, then the payload.
+# version, message type, codec, flags (reserved, 0), sequence number
+HEADER = struct.Struct("!BBBBI")
+
+# Message types
+CONTROL = 1  # JSON object with a "type" field: session, interrupted, start_stream, stop_stream, stop
+TEXT = 2  # UTF-8 text for the chat, such as the greeting
+ERROR = 3  # UTF-8 error message
+TRANSCRIPT_PARTIAL = 4  # UTF-8 transcript of the utterance so far
+TRANSCRIPT_FINAL = 5  # UTF-8 transcript of the whole utterance
+RESPONSE_DELTA = 6  # UTF-8 text streamed from the LLM
+RESPONSE_END = 7  # empty; the response text is complete
+AUDIO_START = 8  # JSON stream format: encoding, sample_rate, channels
+AUDIO = 9  # a chunk of audio in the frame's codec
+AUDIO_END = 10  # empty; the audio stream is complete
+
+MESSAGE_NAMES = {
+    CONTROL: "control",
+    TEXT: "text",
+    ERROR: "error",
+    TRANSCRIPT_PARTIAL: "transcript_partial",
+    TRANSCRIPT_FINAL: "transcript_final",
+    RESPONSE_DELTA: "response_delta",
+    RESPONSE_END: "response_end",
+    AUDIO_START: "audio_start",
+    AUDIO: "audio",
+    AUDIO_END: "audio_end",
+}
+
+# Codecs of AUDIO frames
+NO_CODEC = 0
+PCM_S16LE = 1  # raw 16-bit little-endian mono PCM at the stream's sample rate
+ENCODED = 2  # a whole clip in a container (WebM, WAV, MP3...)
+
+# Send lanes, drained in this order: control and errors overtake text, text overtakes audio.
+# Messages keep their order within a lane, so audio_end never overtakes its audio.
+CONTROL_LANE, TEXT_LANE, AUDIO_LANE = range(3)
+_LANES = {CONTROL: CONTROL_LANE, ERROR: CONTROL_LANE, AUDIO_START: AUDIO_LANE, AUDIO: AUDIO_LANE, AUDIO_END: AUDIO_LANE}
+
+_JSON_PAYLOADS = {CONTROL, AUDIO_START}
+_TEXT_PAYLOADS = {TEXT, ERROR, TRANSCRIPT_PARTIAL, TRANSCRIPT_FINAL, RESPONSE_DELTA}
+
+# Totals across all connections, served by /protocol/metrics
+protocol_stats = {
+    "connections": 0,
+    "legacy_connections": 0,
+    "frames_sent": 0,
+    "bytes_sent": 0,
+    "frames_received": 0,
+    "protocol_errors": 0,
+    "partials_coalesced": 0,
+    "frames_cleared": 0,
+    "backpressure_waits": 0,
+    "backpressure_seconds": 0.0,
+    "max_queued_bytes": 0,
+    "send_timeouts": 0,
+    "send_errors": 0,
+}
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def negotiate(subprotocols):
+    """
+    Pick the protocol version for the subprotocols a client offered.
+
+    Returns:
+    tuple: The version and the subprotocol to accept, None for version 0.
+    """
+    if SUBPROTOCOL in subprotocols:
+        return PROTOCOL_VERSION, SUBPROTOCOL
+    return 0, None
+
+
+def encode_frame(message_type, payload=b"", seq=0, codec=NO_CODEC):
+    """
+    Frame a message for version 1. `payload` is bytes, text or, for control
+    and audio_start messages, a JSON-serializable dict.
+    """
+    if message_type in _JSON_PAYLOADS and not isinstance(payload, (bytes, str)):
+        payload = json.dumps(payload)
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return HEADER.pack(PROTOCOL_VERSION, message_type, codec, 0, seq) + payload
+
+
+def decode_frame(frame):
+    """
+    Split a version 1 frame into its message type, codec, sequence number and payload.
+
+    Control and audio_start payloads are decoded to dicts and text payloads
+    to str; audio stays bytes.
+    """
+    if len(frame) < HEADER.size:
+        raise ProtocolError(f"Frame of {len(frame)} bytes is shorter than its header")
+    version, message_type, codec, _, seq = HEADER.unpack_from(frame)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if message_type not in MESSAGE_NAMES:
+        raise ProtocolError(f"Unknown message type {message_type}")
+    payload = bytes(frame[HEADER.size:])
+    if message_type in _JSON_PAYLOADS:
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict) or (message_type == CONTROL and "type" not in payload):
+            raise ProtocolError(f"{MESSAGE_NAMES[message_type]} payload is not a JSON object")
+    elif message_type in _TEXT_PAYLOADS:
+        payload = payload.decode("utf-8", errors="replace")
+    return message_type, codec, seq, payload
+
+
+def parse_control_message(text):
+    """
+    Parse a JSON control message, or return None for other text.
+    """
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) and "type" in message else None
+
+
+def read_message(message, version):
+    """
+    Turn an ASGI websocket.receive message from the client into (message type, codec, payload).
+
+    Version 0 clients send control messages as JSON text (other text is read
+    as an empty control message) and audio as bare binary messages, of
+    unknown codec. Version 1 clients send only frames, so their text
+    messages are protocol errors.
+    """
+    protocol_stats['frames_received'] += 1
+    try:
+        if version == 0:
+            if message.get("text") is not None:
+                return CONTROL, NO_CODEC, parse_control_message(message["text"]) or {}
+            return AUDIO, NO_CODEC, message.get("bytes") or b""
+        if message.get("bytes") is None:
+            raise ProtocolError("Expected a binary frame")
+        message_type, codec, _, payload = decode_frame(message["bytes"])
+        if message_type not in (CONTROL, AUDIO):
+            raise ProtocolError(f"Clients cannot send {MESSAGE_NAMES[message_type]} messages")
+        return message_type, codec, payload
+    except ProtocolError:
+        protocol_stats['protocol_errors'] += 1
+        raise
+
+
+class SendQueue:
+    """
+    A bounded, prioritized queue of outgoing messages for one socket.
+
+    Messages are queued by `send` and written by one task per socket, so a
+    slow client never blocks the turn that produces them for longer than
+    flow control requires. The writer drains the control lane first, then
+    text, then audio (see `_LANES`).
+
+    Flow control: while `max_bytes` of payload are queued, audio producers
+    wait in `send` until the client has caught up, which in turn slows the
+    TTS stream feeding them. Control and text messages are small and never
+    wait; a partial transcript replaces one still waiting in the queue. A
+    single write that takes longer than `send_timeout` seconds drops the
+    client: the socket is closed and `send` raises WebSocketDisconnect.
+
+    Every message is numbered when it is queued, so a gap in a client's
+    sequence numbers shows messages dropped by coalescing or `clear`.
+    Version 0 connections get the same messages in the original format
+    (see `_encode_legacy`) and no sequence numbers.
+    """
+
+    def __init__(self, websocket, version=PROTOCOL_VERSION, max_bytes=256 * 1024, send_timeout=10.0):
+        self.websocket = websocket
+        self.version = version
+        self.max_bytes = max_bytes
+        self.send_timeout = send_timeout
+        self.queued_bytes = 0
+        self.error = None
+        self.closed = False
+        self._unsent = 0
+        self._lanes = [collections.deque() for _ in range(AUDIO_LANE + 1)]
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._writer = asyncio.create_task(self._run())
+        protocol_stats['connections'] += 1
+        if version == 0:
+            protocol_stats['legacy_connections'] += 1
+
+    async def send(self, message_type, payload=b"", codec=NO_CODEC):
+        """
+        Queue a message, waiting for room first if it is audio and the queue is full.
+        """
+        size = len(payload) if isinstance(payload, (bytes, str)) else 0
+        lane = _LANES.get(message_type, TEXT_LANE)
+        if lane == AUDIO_LANE and self.queued_bytes + size > self.max_bytes and self.queued_bytes:
+            protocol_stats['backpressure_waits'] += 1
+            started = time.perf_counter()
+            while self.error is None and self.queued_bytes + size > self.max_bytes and self.queued_bytes:
+                self._space.clear()
+                await self._space.wait()
+            waited = time.perf_counter() - started
+            protocol_stats['backpressure_seconds'] += waited
+            metrics.observe("send_wait", waited, bytes=size)
+        if self.error is not None:
+            raise WebSocketDisconnect(self.error)
+
+        if message_type == TRANSCRIPT_PARTIAL:
+            queue = self._lanes[lane]
+            for index, (queued_type, _, _, queued_size, _) in enumerate(queue):
+                if queued_type == TRANSCRIPT_PARTIAL:
+                    del queue[index]
+                    self._unsent -= 1
+                    self.queued_bytes -= queued_size
+                    protocol_stats['partials_coalesced'] += 1
+                    break
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        self._lanes[lane].append((message_type, codec, payload, size, self._seq))
+        self._unsent += 1
+        self.queued_bytes += size
+        protocol_stats['max_queued_bytes'] = max(protocol_stats['max_queued_bytes'], self.queued_bytes)
+        self._ready.set()
+
+    def clear(self, lane=AUDIO_LANE):
+        """
+        Drop the messages still waiting in a lane, such as the audio of a reply that was interrupted.
+
+        Returns:
+        int: The number of messages dropped.
+        """
+        queue = self._lanes[lane]
+        dropped = len(queue)
+        self._unsent -= dropped
+        self.queued_bytes -= sum(size for _, _, _, size, _ in queue)
+        queue.clear()
+        protocol_stats['frames_cleared'] += dropped
+        self._space.set()
+        return dropped
+
+    async def drain(self):
+        """
+        Wait until every queued message has been written, or the client was dropped.
+        """
+        while self.error is None and self._unsent:
+            self._space.clear()
+            await self._space.wait()
+
+    async def close(self):
+        """
+        Stop the writer, dropping whatever is still queued.
+        """
+        # The flag stops the writer even if wait_for swallows the cancellation of a send that just finished
+        self.closed = True
+        self._ready.set()
+        self._writer.cancel()
+        await asyncio.wait([self._writer])
+
+    async def _run(self):
+        while not self.closed:
+            if not any(self._lanes):
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            message_type, codec, payload, size, seq = next(lane for lane in self._lanes if lane).popleft()
+            frame = self._encode(message_type, codec, payload, seq)
+            started = time.perf_counter()
+            try:
+                if isinstance(frame, str):
+                    await asyncio.wait_for(self.websocket.send_text(frame), self.send_timeout)
+                else:
+                    await asyncio.wait_for(self.websocket.send_bytes(frame), self.send_timeout)
+            except asyncio.TimeoutError:
+                protocol_stats['send_timeouts'] += 1
+                logging.warning(f"Dropping client {self.websocket}: a frame took more than {self.send_timeout}s to send")
+                self._fail(1008)
+                try:
+                    await asyncio.wait_for(self.websocket.close(code=1008), self.send_timeout)
+                except Exception:
+                    pass
+                return
+            except Exception as e:
+                protocol_stats['send_errors'] += 1
+                logging.warning(f"Sending to client {self.websocket} failed: {e!r}")
+                self._fail(1006)
+                return
+            metrics.observe("send", time.perf_counter() - started, bytes=len(frame))
+            protocol_stats['frames_sent'] += 1
+            protocol_stats['bytes_sent'] += len(frame)
+            self._unsent -= 1
+            self.queued_bytes -= size
+            self._space.set()
+
+    def _fail(self, code):
+        self.error = code
+        for lane in self._lanes:
+            lane.clear()
+        self._unsent = 0
+        self.queued_bytes = 0
+        self._space.set()
+
+    def _encode(self, message_type, codec, payload, seq):
+        if self.version == 0:
+            return self._encode_legacy(message_type, payload)
+        return encode_frame(message_type, payload, seq, codec)
+
+    @staticmethod
+    def _encode_legacy(message_type, payload):
+        # The original protocol: bare audio chunks, bare chat text, "Error: ..." strings and JSON for the rest
+        if message_type == AUDIO:
+            return payload
+        if message_type == TEXT:
+            return payload
+        if message_type == ERROR:
+            return f"Error: {payload}"
+        if message_type == CONTROL:
+            return json.dumps(payload)
+        if message_type == AUDIO_START:
+            return json.dumps({"type": "audio_start", **payload})
+        if message_type in _TEXT_PAYLOADS:
+            return json.dumps({"type": MESSAGE_NAMES[message_type], "text": payload})
+        return json.dumps({"type": MESSAGE_NAMES[message_type]})
+
+
+if __name__ == "__main__":
+    # Bytes on the wire for one streamed reply (15 text deltas and 3 s of 16 kHz
+    # audio in 4 KiB chunks) in both versions, and peak server memory for a
+    # client that reads at 64 KiB/s while TTS produces 3 s of audio at once:
+    # without flow control every chunk piles up in the send path, with it
+    # the producer waits and the queue stays within max_bytes.
+    class FakeSocket:
+        def __init__(self, bytes_per_second=None):
+            self.bytes_per_second = bytes_per_second
+            self.sent = 0
+
+        async def send_text(self, text):
+            await self.send_bytes(text.encode("utf-8"))
+
+        async def send_bytes(self, data):
+            self.sent += len(data)
+            if self.bytes_per_second:
+                await asyncio.sleep(len(data) / self.bytes_per_second)
+
+    audio = [bytes(4096)] * 24
+    deltas = ["Dr. Ali ", "is free ", "at 9:00 ", "tomorrow. "] * 4
+
+    async def reply(queue):
+        await queue.send(AUDIO_START, {"encoding": "pcm_s16le", "sample_rate": 16000, "channels": 1})
+        for delta in deltas[:15]:
+            await queue.send(RESPONSE_DELTA, delta)
+        await queue.send(RESPONSE_END)
+        for chunk in audio:
+            await queue.send(AUDIO, chunk, codec=PCM_S16LE)
+        await queue.send(AUDIO_END)
+        await queue.drain()
+
+    async def main():
+        payload = sum(len(chunk) for chunk in audio) + sum(len(delta) for delta in deltas[:15])
+        for version in (0, 1):
+            socket = FakeSocket()
+            queue = SendQueue(socket, version)
+            await reply(queue)
+            await queue.close()
+            print(f"version {version}: {socket.sent} bytes on the wire for {payload} bytes of payload "
+                  f"(+{socket.sent - payload} overhead)")
+
+        for max_bytes in (float("inf"), 32 * 1024):
+            protocol_stats['max_queued_bytes'] = 0
+            socket = FakeSocket(bytes_per_second=64 * 1024)
+            queue = SendQueue(socket, max_bytes=max_bytes)
+            started = time.perf_counter()
+            await reply(queue)
+            await queue.close()
+            print(f"slow client, max_bytes {max_bytes}: peak queued {protocol_stats['max_queued_bytes']} bytes, "
+                  f"reply delivered in {time.perf_counter() - started:.2f}s")
+
+    asyncio.run(main())
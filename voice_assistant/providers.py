@@ -0,0 +1,137 @@
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI
+from groq import Groq
+from deepgram import DeepgramClient
+from elevenlabs.client import ElevenLabs
+from cartesia import Cartesia
+
+from voice_assistant.config import Config
+
+# Long-lived provider clients keyed by (provider, api_key)
+_clients = {}
+_http_clients = {}
+_counters = {}
+_voice_embeddings = {}
+_session = None
+_lock = threading.Lock()
+
+
+def _new_http_client():
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=Config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=Config.HTTP_TIMEOUT,
+    )
+
+
+def _get_client(provider, api_key, factory, pooled=True):
+    key = (provider, api_key)
+    with _lock:
+        counters = _counters.setdefault(provider, {"created": 0, "reused": 0})
+        client = _clients.get(key)
+        if client is not None:
+            counters['reused'] += 1
+            return client
+        http_client = _new_http_client() if pooled else None
+        client = factory(http_client)
+        _clients[key] = client
+        if http_client is not None:
+            _http_clients[key] = http_client
+        counters['created'] += 1
+        return client
+
+
+def get_openai_client(api_key):
+    """
+    Return the shared OpenAI client for an API key.
+    """
+    return _get_client('openai', api_key, lambda http_client: OpenAI(api_key=api_key, http_client=http_client))
+
+
+def get_groq_client(api_key):
+    """
+    Return the shared Groq client for an API key.
+    """
+    return _get_client('groq', api_key, lambda http_client: Groq(api_key=api_key, http_client=http_client))
+
+
+def get_elevenlabs_client(api_key):
+    """
+    Return the shared ElevenLabs client for an API key.
+    """
+    return _get_client('elevenlabs', api_key, lambda http_client: ElevenLabs(api_key=api_key, httpx_client=http_client))
+
+
+def get_deepgram_client(api_key):
+    """
+    Return the shared Deepgram client for an API key.
+
+    The Deepgram SDK manages its own HTTP connections, so only the client
+    object itself is reused.
+    """
+    return _get_client('deepgram', api_key, lambda http_client: DeepgramClient(api_key), pooled=False)
+
+
+def get_cartesia_client(api_key):
+    """
+    Return the shared Cartesia client for an API key.
+    """
+    return _get_client('cartesia', api_key, lambda http_client: Cartesia(api_key=api_key), pooled=False)
+
+
+def get_cartesia_voice_embedding(api_key, voice_id):
+    """
+    Return a Cartesia voice embedding, fetching it from the API only once.
+    """
+    key = (api_key, voice_id)
+    embedding = _voice_embeddings.get(key)
+    if embedding is None:
+        voice = get_cartesia_client(api_key).voices.get(id=voice_id)
+        embedding = _voice_embeddings[key] = voice["embedding"]
+    return embedding
+
+
+def get_http_session():
+    """
+    Return the shared requests session used for plain HTTP calls to local services.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=Config.HTTP_MAX_KEEPALIVE, pool_maxsize=Config.HTTP_MAX_CONNECTIONS)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def pool_metrics():
+    """
+    Report client reuse and connection pool usage per provider.
+
+    Returns:
+    dict: {"providers": {provider: {"created", "reused", "connections", "idle_connections"}},
+           "http_session_hosts": int, "voice_embeddings_cached": int}
+    """
+    with _lock:
+        providers = {provider: dict(counters, connections=0, idle_connections=0) for provider, counters in _counters.items()}
+        for (provider, _), http_client in _http_clients.items():
+            # httpx does not expose pool state publicly; read it defensively
+            pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+            for connection in getattr(pool, "connections", []):
+                providers[provider]['connections'] += 1
+                if connection.is_idle():
+                    providers[provider]['idle_connections'] += 1
+        session_hosts = len(_session.get_adapter("http://").poolmanager.pools) if _session is not None else 0
+        return {
+            "providers": providers,
+            "http_session_hosts": session_hosts,
+            "voice_embeddings_cached": len(_voice_embeddings),
+        }
@@ -0,0 +1,297 @@
+import bisect
+import datetime
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+# Rules without an end date are looked at this far past the reference date
+DEFAULT_HORIZON_DAYS = 365
+
+
+def horizon_end(today, after=None):
+    """
+    Return the last date an open-ended rule reaches for a query starting on `after`.
+
+    That is DEFAULT_HORIZON_DAYS past `today`, or past `after` when the query
+    starts beyond it.
+    """
+    last = today + datetime.timedelta(days=DEFAULT_HORIZON_DAYS - 1)
+    if after and after > last:
+        last = after + datetime.timedelta(days=DEFAULT_HORIZON_DAYS - 1)
+    return last
+
+
+def _minutes(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _day_starts(ranges, slot_minutes):
+    # Slot start times, in minutes after midnight, for "HH:MM-HH:MM" ranges
+    starts = set()
+    for time_range in ranges:
+        begin, end = (_minutes(part) for part in time_range.split("-"))
+        starts.update(range(begin, end - slot_minutes + 1, slot_minutes))
+    return sorted(starts)
+
+
+class AvailabilityRule:
+    """
+    Recurring availability for one doctor, expanded into slots only on demand.
+
+    A rule is weekly working hours split into `slot_minutes` slots, valid
+    from `start` to `end` (inclusive dates), with per-date `exceptions` that
+    replace the hours of that day and `holidays` with no slots at all. Only
+    the rule is stored, so memory does not depend on how far ahead it runs.
+
+    Either bound may be None, and is then filled in per query from the
+    caller's reference date `today` (the wall clock when not given): a rule
+    without a start runs from that date, and one without an end runs
+    `DEFAULT_HORIZON_DAYS` past it, or past the query's own start when that
+    lies beyond. An open-ended rule therefore rolls forward with `today`.
+
+    The roster form is:
+    {"slot_minutes": 15, "from": "2024-09-25", "until": "2025-09-24",
+     "weekly": {"monday": ["09:00-12:00", "14:00-17:00"], ...},
+     "exceptions": {"2024-10-02": ["10:00-12:00"]}, "holidays": ["2024-12-25"]}
+    """
+
+    def __init__(self, weekly, slot_minutes=15, start=None, end=None, exceptions=None, holidays=()):
+        self.slot_minutes = slot_minutes
+        self.weekly_ranges = {day: list(weekly.get(day, [])) for day in WEEKDAYS if weekly.get(day)}
+        self.exception_ranges = {date: list(ranges) for date, ranges in (exceptions or {}).items()}
+        self.holidays = sorted(holidays)
+        self.start = start
+        self.end = end
+
+        self._weekly = [_day_starts(weekly.get(day, []), slot_minutes) for day in WEEKDAYS]
+        self._exceptions = {date: _day_starts(ranges, slot_minutes) for date, ranges in self.exception_ranges.items()}
+        for date in holidays:
+            self._exceptions[date] = []
+        self._weekly_counts = [len(starts) for starts in self._weekly]
+
+    @classmethod
+    def from_dict(cls, spec):
+        """
+        Build a rule from its roster form.
+        """
+        return cls(
+            weekly={day.lower(): ranges for day, ranges in spec.get('weekly', {}).items()},
+            slot_minutes=int(spec.get('slot_minutes', 15)),
+            start=datetime.date.fromisoformat(spec['from']) if spec.get('from') else None,
+            end=datetime.date.fromisoformat(spec['until']) if spec.get('until') else None,
+            exceptions={datetime.date.fromisoformat(date): ranges for date, ranges in spec.get('exceptions', {}).items()},
+            holidays=[datetime.date.fromisoformat(date) for date in spec.get('holidays', [])],
+        )
+
+    def to_dict(self):
+        spec = {
+            "slot_minutes": self.slot_minutes,
+            "weekly": self.weekly_ranges,
+            "exceptions": {date.isoformat(): ranges for date, ranges in self.exception_ranges.items()},
+            "holidays": [date.isoformat() for date in self.holidays],
+        }
+        if self.start:
+            spec["from"] = self.start.isoformat()
+        if self.end:
+            spec["until"] = self.end.isoformat()
+        return spec
+
+    def window(self, start=None, end=None, today=None):
+        """
+        Clip [start, end) to the rule's dates, filling in missing bounds from `today`.
+
+        Returns:
+        tuple: (start, end) datetimes.
+        """
+        first, last = self._bounds(today, start.date() if start else None)
+        lower = datetime.datetime.combine(first, datetime.time())
+        upper = datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time())
+        start = max(start, lower) if start else lower
+        return start, min(end, upper) if end else upper
+
+    def covers(self, date, today=None, after=None, before=None):
+        """
+        Check whether a date is within the dates a query looks at.
+
+        The query starts on `after`, or, looking back, ends on `before` (see
+        `iter_from` and `iter_before`).
+        """
+        first, last = self._bounds_before(today, before) if before else self._bounds(today, after)
+        return first <= date <= last
+
+    def week_minutes(self):
+        """
+        Return the weekly slot starts in minutes after Monday midnight, ignoring exceptions and dates.
+        """
+        return [day * 24 * 60 + minute for day, starts in enumerate(self._weekly) for minute in starts]
+
+    def exception_slots(self):
+        """
+        Return the slots of the exception dates in time order, ignoring the rule's dates.
+        """
+        return [datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(minutes=minute)
+                for date, starts in sorted(self._exceptions.items()) for minute in starts]
+
+    def is_exception(self, date):
+        """
+        Check whether a date's hours come from `exceptions` or `holidays` rather than the weekly hours.
+        """
+        return date in self._exceptions
+
+    def _bounds(self, today, after=None):
+        # First and last dates a query starting on `after` looks at
+        today = today or datetime.date.today()
+        return self.start or today, self.end or horizon_end(today, after)
+
+    def _bounds_before(self, today, before):
+        # Same for a query looking back from `before`: past the horizon of an
+        # open-ended rule it looks back as far as it reaches ahead
+        first, last = self._bounds(today)
+        if self.end is None and before > last:
+            return max(first, before - datetime.timedelta(days=DEFAULT_HORIZON_DAYS - 1)), before
+        return first, last
+
+    def day_slots(self, date):
+        """
+        Return the slot start times of a date, in minutes after midnight.
+        """
+        if (self.start and date < self.start) or (self.end and date > self.end):
+            return []
+        starts = self._exceptions.get(date)
+        return self._weekly[date.weekday()] if starts is None else starts
+
+    def contains(self, slot):
+        """
+        Check whether a datetime is one of the rule's slots.
+        """
+        if slot.second or slot.microsecond:
+            return False
+        starts = self.day_slots(slot.date())
+        minute = slot.hour * 60 + slot.minute
+        i = bisect.bisect_left(starts, minute)
+        return i < len(starts) and starts[i] == minute
+
+    def iter_from(self, after=None, today=None):
+        """
+        Yield the rule's slots at or after `after`, in time order.
+        """
+        start, end = self.window(after, None, today)
+        date = start.date()
+        first = after.hour * 60 + after.minute + (1 if after.second or after.microsecond else 0) if after and date == after.date() else 0
+        for date in self._dates(date, end.date() - datetime.timedelta(days=1)):
+            starts = self.day_slots(date)
+            midnight = datetime.datetime.combine(date, datetime.time())
+            for minute in starts[bisect.bisect_left(starts, first):]:
+                yield midnight + datetime.timedelta(minutes=minute)
+            first = 0
+
+    def iter_before(self, before, today=None):
+        """
+        Yield the rule's slots strictly before `before`, latest first.
+        """
+        first, last = self._bounds_before(today, before.date())
+        date = min(before.date(), last)
+        limit = before.hour * 60 + before.minute + (1 if before.second or before.microsecond else 0) if date == before.date() else 24 * 60
+        for date in self._dates(date, first, reverse=True):
+            starts = self.day_slots(date)
+            midnight = datetime.datetime.combine(date, datetime.time())
+            for minute in reversed(starts[:bisect.bisect_left(starts, limit)]):
+                yield midnight + datetime.timedelta(minutes=minute)
+            limit = 24 * 60
+
+    def count(self, start=None, end=None, today=None):
+        """
+        Count the slots with start <= slot < end without expanding them.
+        """
+        start, end = self.window(start, end, today)
+        if start >= end:
+            return 0
+        if start.date() == end.date():
+            return self._count_day(start.date(), start, end)
+
+        # Partial first day, whole days by weeks, partial last day
+        total = self._count_day(start.date(), start, None)
+        first_whole, last_day = start.date() + datetime.timedelta(days=1), end.date()
+        days = (last_day - first_whole).days
+        weeks, remainder = divmod(days, 7)
+        total += weeks * sum(self._weekly_counts)
+        total += sum(self._weekly_counts[(first_whole.weekday() + offset) % 7] for offset in range(remainder))
+        for date, starts in self._exceptions.items():
+            if first_whole <= date < last_day:
+                total += len(starts) - self._weekly_counts[date.weekday()]
+        total += self._count_day(last_day, None, end)
+        return total
+
+    def _count_day(self, date, start, end):
+        starts = self.day_slots(date)
+        low = bisect.bisect_left(starts, start.hour * 60 + start.minute + (1 if start.second or start.microsecond else 0)) if start else 0
+        high = bisect.bisect_left(starts, end.hour * 60 + end.minute + (1 if end.second or end.microsecond else 0)) if end else len(starts)
+        return max(0, high - low)
+
+    def _dates(self, first, last, reverse=False):
+        # Dates from `first` to `last` (inclusive) that can have slots. With no
+        # weekly hours only the exception dates are visited, so a sparse rule
+        # with a long horizon is not walked day by day.
+        step = datetime.timedelta(days=-1 if reverse else 1)
+        if any(self._weekly_counts):
+            date = first
+            while (date >= last) if reverse else (date <= last):
+                yield date
+                date += step
+        else:
+            dates = sorted((date for date, starts in self._exceptions.items() if starts), reverse=reverse)
+            for date in dates:
+                if (last <= date <= first) if reverse else (first <= date <= last):
+                    yield date
+
+
+if __name__ == "__main__":
+    # Memory against the horizon length: rule doctors hold their rule and
+    # bookings only. Equivalence with explicit slots is in tests/test_recurrence.py.
+    import time
+    import tracemalloc
+    from voice_assistant.availability import AvailabilityStore, format_slot
+
+    start_day = datetime.date(2024, 9, 25)
+    specialties = ["Cardiologist", "Dentist"]
+
+    def make_spec(i, days):
+        return {
+            "slot_minutes": [15, 20, 30][i % 3],
+            "from": start_day.isoformat(),
+            "until": (start_day + datetime.timedelta(days=days - 1)).isoformat(),
+            "weekly": {"monday": ["09:00-12:00", "14:00-17:00"], "wednesday": ["08:30-12:10"],
+                       "friday": [f"{9 + i % 3:02d}:00-13:00"], "saturday": ["10:00-11:00"] if i % 2 else []},
+            "exceptions": {(start_day + datetime.timedelta(days=2 + 7 * i)).isoformat(): ["07:00-08:00"],
+                           (start_day + datetime.timedelta(days=5)).isoformat(): ["13:00-15:00"]},
+            "holidays": [(start_day + datetime.timedelta(days=12)).isoformat()],
+        }
+
+    def expand(rule):
+        return [format_slot(slot) for slot in rule.iter_from()]
+
+    doctor_count = 200
+    print(f"{doctor_count} doctors, 50 bookings each")
+    for days in (30, 365, 3650):
+        for label in ("explicit", "rule"):
+            roster = [{"name": f"Dr. {i}", "specialty": specialties[i % 2], "availability": make_spec(i, days)} for i in range(doctor_count)]
+            if label == "explicit":
+                roster = [{"name": entry['name'], "specialty": entry['specialty'],
+                           "available_slots": expand(AvailabilityRule.from_dict(entry['availability']))} for entry in roster]
+            tracemalloc.start()
+            store = AvailabilityStore(roster)
+            del roster
+            for i in range(doctor_count):
+                for slot in store.doctor_slots(f"Dr. {i}", limit=50):
+                    store.book(f"Dr. {i}", slot)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            started = time.perf_counter()
+            for _ in range(200):
+                store.next_slots(5, "Dentist", datetime.datetime(2024, 10, 20, 12))
+            next_us = (time.perf_counter() - started) / 200 * 1e6
+            started = time.perf_counter()
+            for _ in range(200):
+                store.query("Dentist", None, None, 10, 0, 5)
+            query_us = (time.perf_counter() - started) / 200 * 1e6
+            print(f"horizon {days:5} days, {label:8}: {memory / 1e6:8.2f} MB, next 5 slots {next_us:7.0f} us, doctor page {query_us:7.0f} us")
@@ -1,22 +1,26 @@
-from openai import OpenAI
-from groq import Groq
 import ollama
 import logging
 from voice_assistant.config import Config
+from voice_assistant import metrics
+from voice_assistant.providers import get_openai_client, get_groq_client
 from voice_assistant.agent_actions import *
+from voice_assistant.history import conversation_transcript, extractive_summary
+
+# The model each backend answers with
+RESPONSE_MODELS = {'openai': Config.OPENAI_LLM, 'groq': MODEL, 'ollama': Config.OLLAMA_LLM}
 
 def generate_response(model, api_key, chat_history, local_model_path=None):
 
     try:
         if model == 'openai':
-            client = OpenAI(api_key=api_key)
+            client = get_openai_client(api_key)
             response = client.chat.completions.create(
                 model=Config.OPENAI_LLM,
                 messages=chat_history
             )
             return response.choices[0].message.content
         elif model == 'groq':
-            client = Groq(api_key=api_key)
+            client = get_groq_client(api_key)
 
             return run_conversation(chat_history, client)
 
@@ -32,4 +36,84 @@ def generate_response(model, api_key, chat_history, local_model_path=None):
             raise ValueError("Unsupported response generation model")
     except Exception as e:
         logging.error(f"Failed to generate response: {e}")
-        return "Error in generating response"
\ No newline at end of file
+        return "Error in generating response"
+
+def generate_response_stream(model, api_key, chat_history, local_model_path=None, raise_errors=False):
+    """
+    Generate a response and yield its text as the model streams tokens.
+
+    Args:
+    model (str): The response backend.
+    api_key (str): The API key for the backend.
+    chat_history (list): The conversation so far; tool calls are appended to it.
+    local_model_path (str): Path to a local model, if any.
+    raise_errors (bool): Raise provider errors instead of yielding an error message,
+        so a router can fail over.
+    """
+    produced = False
+    metrics.annotate(model=RESPONSE_MODELS.get(model, model))
+    try:
+        if model == 'openai':
+            client = get_openai_client(api_key)
+            response = client.chat.completions.create(
+                model=Config.OPENAI_LLM,
+                messages=chat_history,
+                stream=True
+            )
+            deltas = (chunk.choices[0].delta.content for chunk in response if chunk.choices)
+        elif model == 'groq':
+            client = get_groq_client(api_key)
+            deltas = run_conversation_stream(chat_history, client)
+        elif model == 'ollama':
+            response = ollama.chat(
+                model=Config.OLLAMA_LLM,
+                messages=chat_history,
+                stream=True,
+            )
+            deltas = (chunk['message']['content'] for chunk in response)
+        elif model == 'local':
+            deltas = iter(["Generated response from local model"])
+        else:
+            raise ValueError("Unsupported response generation model")
+
+        for delta in deltas:
+            if delta:
+                produced = True
+                yield delta
+    except Exception as e:
+        logging.error(f"Failed to generate response: {e}")
+        if raise_errors:
+            raise
+        if not produced:
+            yield "Error in generating response"
+
+def summarize_conversation(model, api_key, previous_summary, messages, max_tokens=300):
+    """
+    Fold older conversation messages into a running summary.
+
+    Args:
+    model (str): The response backend used to write the summary.
+    api_key (str): The API key for the backend.
+    previous_summary (str): The summary so far, possibly empty.
+    messages (list): The messages leaving the prompt window.
+    max_tokens (int): Upper bound on the summary length.
+
+    Returns:
+    str: The updated summary.
+    """
+    prompt = [
+        {"role": "system", "content": "Summarize this conversation between a user and a doctor scheduling assistant for the assistant's own memory. "
+                                      "Keep the user's name, chosen doctors, dates, times and any booked or cancelled meetings. "
+                                      f"Answer in at most {max_tokens // 2} words."},
+        {"role": "user", "content": f"Summary so far:\n{previous_summary or '(none)'}\n\nNew messages:\n{conversation_transcript(messages)}"},
+    ]
+    if model == 'openai':
+        response = get_openai_client(api_key).chat.completions.create(model=Config.OPENAI_LLM, messages=prompt, max_tokens=max_tokens)
+        return response.choices[0].message.content.strip()
+    elif model == 'groq':
+        response = get_groq_client(api_key).chat.completions.create(model=MODEL, messages=prompt, max_tokens=max_tokens)
+        return response.choices[0].message.content.strip()
+    elif model == 'ollama':
+        response = ollama.chat(model=Config.OLLAMA_LLM, messages=prompt)
+        return response['message']['content'].strip()
+    return extractive_summary(previous_summary, messages, max_tokens)
@@ -0,0 +1,277 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from voice_assistant.availability import parse_slot, format_slot
+from voice_assistant.recurrence import AvailabilityRule
+
+_decoder = json.JSONDecoder()
+
+
+def iter_roster(path, chunk_size=1 << 20):
+    """
+    Stream the doctors of a JSON roster file one object at a time.
+
+    The file is a JSON array of {"name", "specialty", "available_slots"}
+    objects, optionally with an "availability" rule. It is read in `chunk_size` pieces and each object is decoded
+    with `JSONDecoder.raw_decode` as soon as it is complete, so memory holds
+    one chunk and one doctor instead of the whole document.
+
+    Yields:
+    tuple: (doctor dict, digest of the object's source text).
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        buffer = file.read(chunk_size)
+        position = _skip(buffer, 0, "[")
+        eof = False
+        while True:
+            position = _skip(buffer, position, ",")
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                doctor, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"Truncated roster file {path}") from None
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield doctor, hashlib.blake2b(buffer[position:end].encode("utf-8"), digest_size=16).digest()
+            position = end
+
+
+def _skip(buffer, position, separator):
+    # Skip whitespace and at most one separator character
+    while position < len(buffer) and buffer[position].isspace():
+        position += 1
+    if position < len(buffer) and buffer[position] == separator:
+        position += 1
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+    return position
+
+
+class RosterWatcher:
+    """
+    Keep an `AvailabilityStore` in step with a roster file.
+
+    `load` streams the initial roster into the store. After that the file is
+    polled every `interval` seconds and, when its size or mtime changes,
+    streamed again and compared doctor by doctor using a digest of each
+    object's source text. Only doctors whose entry changed are touched, and
+    they are patched in place: new slots are added, dropped slots removed,
+    doctors added or removed. Slots that are already booked
+    (`booked_slots()`, a set of (doctor, "YYYY-MM-DD HH:MM") pairs) are never
+    made free again, so live bookings survive a reload. A doctor whose
+    "availability" rule changed gets the new rule with their bookings carried
+    over.
+    """
+
+    def __init__(self, path, store=None, booked_slots=None, interval=2.0):
+        self.path = path
+        self.store = store
+        self.booked_slots = booked_slots or set
+        self.interval = interval
+        self.stats = {"reloads": 0, "doctors_added": 0, "doctors_removed": 0, "doctors_changed": 0,
+                      "slots_added": 0, "slots_removed": 0, "last_reload_seconds": 0.0}
+        self._digests = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """
+        Yield the doctors in the roster file, remembering their digests for later diffs.
+        """
+        self._signature = self._stat()
+        self._digests = {}
+        for doctor, digest in iter_roster(self.path):
+            if _valid(doctor):
+                self._digests[doctor['name']] = digest
+                yield doctor
+            else:
+                logging.error(f"Skipping invalid roster entry: {str(doctor)[:80]}")
+
+    def reload(self, force=False):
+        """
+        Apply the changes in the roster file to the store.
+
+        Returns:
+        dict | None: Counts of what changed, or None if the file is unchanged.
+        """
+        with self._lock:
+            signature = self._stat()
+            if signature == self._signature and not force:
+                return None
+            started = time.perf_counter()
+
+            digests = {}
+            changed = []
+            for doctor, digest in iter_roster(self.path):
+                if not _valid(doctor):
+                    continue
+                digests[doctor['name']] = digest
+                if self._digests.get(doctor['name']) != digest:
+                    changed.append(doctor)
+            removed = [name for name in self._digests if name not in digests]
+
+            added_pairs, removed_pairs = [], []
+            booked = collections.defaultdict(set)
+            for name, slot in (self.booked_slots() if changed else ()):
+                booked[name].add(slot)
+            counts = {"doctors_added": 0, "doctors_removed": 0, "doctors_changed": 0}
+            for doctor in changed:
+                kind = self._apply_doctor(doctor, booked, added_pairs, removed_pairs)
+                counts[kind] += 1
+            for name in removed:
+                current = self.store.get_doctor(name)
+                if current is not None:
+                    removed_pairs.extend((name, format_slot(slot)) for slot in current['slots'])
+                    self.store.remove_doctor(name)
+                    counts['doctors_removed'] += 1
+
+            self._digests = digests
+            self._signature = signature
+            elapsed = time.perf_counter() - started
+
+        for key, value in counts.items():
+            self.stats[key] += value
+        self.stats['slots_added'] += len(added_pairs)
+        self.stats['slots_removed'] += len(removed_pairs)
+        self.stats['reloads'] += 1
+        self.stats['last_reload_seconds'] = elapsed
+        logging.info(f"Reloaded roster in {elapsed * 1000:.0f} ms: {counts}, "
+                     f"{len(added_pairs)} slots added, {len(removed_pairs)} removed")
+        return dict(counts, slots_added=len(added_pairs), slots_removed=len(removed_pairs), seconds=elapsed)
+
+    def start(self):
+        """
+        Start polling the roster file in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="roster-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error(f"Failed to reload roster {self.path}: {e}")
+
+    def _apply_doctor(self, doctor, booked, added_pairs, removed_pairs):
+        name, specialty = doctor['name'], doctor['specialty']
+        rule = AvailabilityRule.from_dict(doctor['availability']) if doctor.get('availability') else None
+        wanted = {slot for slot in map(parse_slot, doctor.get('available_slots', [])) if slot is not None}
+        wanted = {slot for slot in wanted if format_slot(slot) not in booked[name]}
+        current = self.store.get_doctor(name)
+
+        if current is None or current['specialty'] != specialty or rule is not None or current['rule'] is not None:
+            if current is not None:
+                removed_pairs.extend((name, format_slot(slot)) for slot in current['slots'])
+            self.store.add_doctor(name, specialty, wanted, rule, booked[name])
+            added_pairs.extend((name, format_slot(slot)) for slot in self.store.get_doctor(name)['slots'])
+            return "doctors_added" if current is None else "doctors_changed"
+
+        have = set(current['slots'])
+        new_slots, gone_slots = sorted(wanted - have), sorted(have - wanted)
+        self.store.add_slots(name, new_slots)
+        self.store.remove_slots(name, gone_slots)
+        added_pairs.extend((name, format_slot(slot)) for slot in new_slots)
+        removed_pairs.extend((name, format_slot(slot)) for slot in gone_slots)
+        return "doctors_changed"
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+
+def _valid(doctor):
+    return isinstance(doctor, dict) and isinstance(doctor.get('name'), str) and isinstance(doctor.get('specialty'), str)
+
+
+if __name__ == "__main__":
+    # Measure initial load and incremental reload of a ~100 MB roster file.
+    import random
+    import resource
+    import tempfile
+    import tracemalloc
+    import datetime
+    from voice_assistant.availability import AvailabilityStore
+
+    doctor_count = 33000
+    slots_per_doctor = 100
+    start_day = datetime.datetime(2024, 9, 25, 8, 0)
+
+    def make_roster(count, seed):
+        generator = random.Random(seed)
+        return [
+            {
+                "name": f"Dr. {i}",
+                "specialty": f"Specialty {i % 40}",
+                "available_slots": [format_slot(start_day + datetime.timedelta(minutes=15 * generator.randrange(4000)))
+                                    for _ in range(slots_per_doctor)],
+            }
+            for i in range(count)
+        ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "doctors_data.json")
+        roster = make_roster(doctor_count, 1)
+        with open(path, "w") as file:
+            json.dump(roster, file, indent=4)
+        print(f"Roster file: {os.path.getsize(path) / 1e6:.0f} MB, {doctor_count} doctors x {slots_per_doctor} slots")
+
+        tracemalloc.start()
+        doctors = 0
+        for _ in iter_roster(path):
+            doctors += 1
+        streaming_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        with open(path) as file:
+            json.load(file)
+        json_load_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"Parse peak memory: streaming {streaming_peak / 1e6:.1f} MB vs json.load {json_load_peak / 1e6:.1f} MB")
+
+        started = time.perf_counter()
+        watcher = RosterWatcher(path)
+        store = AvailabilityStore(watcher.load())
+        watcher.store = store
+        print(f"Initial load into the store: {time.perf_counter() - started:.2f} s, process max RSS "
+              f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB (includes the benchmark's own copy of the roster)")
+
+        # Book a few slots, then edit 1% of the roster and drop/add some doctors
+        booked = set()
+        for doctor in roster[:500]:
+            slot = doctor['available_slots'][0]
+            if store.book(doctor['name'], slot):
+                booked.add((doctor['name'], slot))
+        watcher.booked_slots = lambda: booked
+        for doctor in random.sample(roster, doctor_count // 100):
+            doctor['available_slots'] = doctor['available_slots'][10:] + [format_slot(start_day - datetime.timedelta(days=1))]
+        del roster[-50:]
+        roster.extend(make_roster(50, 2)[i] | {"name": f"Dr. new {i}"} for i in range(50))
+        with open(path, "w") as file:
+            json.dump(roster, file, indent=4)
+
+        version = store.version
+        result = watcher.reload()
+        print(f"Reload: {result['seconds']:.2f} s, {result['doctors_changed']} changed, {result['doctors_added']} added, "
+              f"{result['doctors_removed']} removed, {result['slots_added']} slots added, {result['slots_removed']} removed")
+        still_booked = sum(not store.is_available(name, slot) for name, slot in booked)
+        print(f"Bookings kept through the reload: {still_booked}/{len(booked)}; store updated in place "
+              f"({store.version - version} index updates, no rebuild)")
+        started = time.perf_counter()
+        watcher.reload()
+        print(f"Poll with no change: {(time.perf_counter() - started) * 1e6:.0f} us")
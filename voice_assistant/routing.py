@@ -0,0 +1,407 @@
+import asyncio
+import collections
+import contextvars
+import logging
+import threading
+import time
+
+from voice_assistant import metrics
+from voice_assistant.api_key_manager import get_api_key
+from voice_assistant.config import Config
+from voice_assistant.pipeline import run_stage, stream_stage
+
+# Hedging and failover counters per stage
+routing_stats = {}
+_routers = {}
+_attempt = contextvars.ContextVar("routing_attempt", default=None)
+
+
+class HedgeLost(BaseException):
+    """
+    Raised inside a hedged attempt that reached a side effect after another attempt won.
+
+    Like GeneratorExit it is not an Exception, so provider code that logs and
+    swallows errors lets it through.
+    """
+
+
+def commit():
+    """
+    Claim the current hedged call for this attempt before doing anything with side effects.
+
+    Tool calls (bookings) and prompt edits must only happen in the attempt
+    whose answer is used. Outside a hedged call this always succeeds.
+
+    Raises:
+    HedgeLost: If a competing attempt has already been chosen.
+    """
+    attempt = _attempt.get()
+    if attempt is not None and not attempt[0].claim(attempt[1]):
+        raise HedgeLost()
+
+
+class _Race:
+    # The attempts of one routed call; the first to claim it is used
+    def __init__(self):
+        self.winner = None
+        self._lock = threading.Lock()
+
+    def claim(self, index):
+        with self._lock:
+            if self.winner is None:
+                self.winner = index
+            return self.winner == index
+
+
+class ProviderHealth:
+    """
+    Rolling latency and error rate of one backend, with a circuit breaker.
+
+    The circuit opens when at least `min_calls` of the last `window` calls
+    were made and `error_rate` of them failed. After `cooldown` seconds one
+    trial call is let through: success closes the circuit, failure opens it
+    again.
+    """
+
+    def __init__(self, window=20, min_calls=5, error_rate=0.5, cooldown=30.0):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.outcomes = collections.deque(maxlen=window)
+        self.latencies = collections.deque(maxlen=max(window, 50))
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self, now=None):
+        """
+        Whether a call may be sent now; in the half-open state this admits the one trial call.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and now - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.latencies.append(latency)
+            if self.state != "closed":
+                self._probing = False
+                if ok:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                else:
+                    self.state = "open"
+                    self.opened_at = time.monotonic()
+                return False
+            self.outcomes.append(ok)
+            if len(self.outcomes) >= self.min_calls and self.outcomes.count(False) >= self.error_rate * len(self.outcomes):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_abandoned(self, latency):
+        # A hedge loser: it took at least this long, but did not fail
+        with self._lock:
+            self.latencies.append(latency)
+            self._probing = False
+
+    def quantile(self, q):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < self.min_calls:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def snapshot(self):
+        with self._lock:
+            calls = len(self.outcomes)
+            return {
+                "state": self.state,
+                "error_rate": self.outcomes.count(False) / calls if calls else 0.0,
+                "calls": calls,
+            }
+
+
+class ProviderRouter:
+    """
+    Route the calls of one pipeline stage across its backends.
+
+    Backends are tried in the order given, skipping those whose circuit is
+    open. If the first has not produced a result (the whole result for
+    `call`, the first item for `stream`) within the hedge delay, the next one
+    is started as well and whichever answers first is used; the other is
+    closed. The delay is the primary's rolling p95 latency, capped at
+    `hedge_delay`, so only the slowest few percent of calls are hedged. An
+    attempt that fails hands over to the next backend at once.
+
+    Backend functions take `(model, api_key, *args)` like `transcribe_audio`
+    and must raise on failure. They run through `run_stage`/`stream_stage`,
+    so stage concurrency limits and timeouts still apply per attempt.
+    """
+
+    def __init__(self, stage, providers, hedge_delay=None, window=20, min_calls=5, error_rate=0.5, cooldown=30.0):
+        self.stage = stage
+        self.providers = list(dict.fromkeys(providers))
+        self.hedge_delay = hedge_delay
+        self.health = {provider: ProviderHealth(window, min_calls, error_rate, cooldown) for provider in self.providers}
+        self.stats = routing_stats.setdefault(stage, {"calls": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "failures": 0, "circuit_opens": 0})
+
+    def candidates(self):
+        """
+        Return the backends to try, in order, that are currently accepting calls.
+        """
+        now = time.monotonic()
+        available = [provider for provider in self.providers if self.health[provider].available(now)]
+        if not available:
+            # Everything is broken; probe the backend that has been resting longest
+            available = [min(self.providers, key=lambda provider: self.health[provider].opened_at)]
+        return available
+
+    def delay(self, provider):
+        if self.hedge_delay is None:
+            return None
+        p95 = self.health[provider].quantile(0.95)
+        return self.hedge_delay if p95 is None else min(self.hedge_delay, p95)
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Return the result of the first backend to answer.
+        """
+        results = self._race(func, args, kwargs, stream=False)
+        try:
+            async for result in results:
+                return result
+        finally:
+            await results.aclose()
+
+    def stream(self, func, *args, **kwargs):
+        """
+        Iterate the items of the first backend to produce one, as an async generator.
+        """
+        return self._race(func, args, kwargs, stream=True)
+
+    async def _race(self, func, args, kwargs, stream):
+        providers = self.candidates()
+        race = _Race()
+        events = asyncio.Queue()
+        tasks = []
+        hedges = set()
+        failed = set()
+        self.stats['calls'] += 1
+
+        def launch():
+            # Start the next backend; returns when to hedge on it, or None
+            provider = providers[len(tasks)]
+            tasks.append(asyncio.create_task(self._attempt(race, len(tasks), provider, func, args, kwargs, stream, events)))
+            delay = self.delay(provider)
+            return None if delay is None else time.monotonic() + delay
+
+        hedge_at = launch()
+        try:
+            while True:
+                timeout = None
+                if race.winner is None and hedge_at is not None and len(tasks) < len(providers):
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    kind, index, value = await asyncio.wait_for(events.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    logging.info(f"Hedging {self.stage} on {providers[len(tasks)]}: no answer from {providers[len(tasks) - 1]} yet")
+                    self.stats['hedged'] += 1
+                    hedges.add(len(tasks))
+                    hedge_at = launch()
+                    continue
+
+                if kind == "error":
+                    failed.add(index)
+                    if index == race.winner or len(failed) == len(providers):
+                        self.stats['failures'] += 1
+                        raise value
+                    if len(failed) == len(tasks):
+                        logging.warning(f"{self.stage} failed on {providers[index]}, failing over to {providers[len(tasks)]}: {value!r}")
+                        self.stats['failovers'] += 1
+                        hedge_at = launch()
+                    continue
+
+                if kind == "winner":
+                    self.stats['hedge_wins'] += index in hedges
+                    metrics.annotate(provider=providers[index], attempts=len(tasks))
+                    for other, task in enumerate(tasks):
+                        if other != index:
+                            task.cancel()
+                elif kind == "item":
+                    yield value
+                else:
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _attempt(self, race, index, provider, func, args, kwargs, stream, events):
+        # Runs one backend; only the attempt that claims the race reports items
+        _attempt.set((race, index))
+        health = self.health[provider]
+        started = time.perf_counter()
+        claimed = False
+
+        def claim():
+            if not race.claim(index):
+                raise HedgeLost()
+            events.put_nowait(("winner", index, None))
+            self._record(health, time.perf_counter() - started, True)
+            return True
+
+        try:
+            if stream:
+                async for item in stream_stage(self.stage, func, provider, get_api_key(provider), *args, **kwargs):
+                    claimed = claimed or claim()
+                    events.put_nowait(("item", index, item))
+            else:
+                result = await run_stage(self.stage, func, provider, get_api_key(provider), *args, **kwargs)
+                claimed = claim()
+                events.put_nowait(("item", index, result))
+            claimed = claimed or claim()
+            events.put_nowait(("done", index, None))
+        except HedgeLost:
+            health.record_abandoned(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            if not claimed:
+                health.record_abandoned(time.perf_counter() - started)
+            raise
+        except Exception as e:
+            self._record(health, time.perf_counter() - started, False)
+            events.put_nowait(("error", index, e))
+
+    def _record(self, health, latency, ok):
+        if health.record(latency, ok):
+            logging.warning(f"Circuit opened for {self.stage} backend after repeated errors")
+            self.stats['circuit_opens'] += 1
+
+    def snapshot(self):
+        return {
+            provider: dict(health.snapshot(), p50=health.quantile(0.5), p95=health.quantile(0.95))
+            for provider, health in self.health.items()
+        }
+
+
+def get_router(stage):
+    """
+    Return the router of a pipeline stage, built from its configured model and fallbacks.
+    """
+    router = _routers.get(stage)
+    if router is None:
+        primary, fallbacks = {
+            'transcription': (Config.TRANSCRIPTION_MODEL, Config.TRANSCRIPTION_FALLBACKS),
+            'response': (Config.RESPONSE_MODEL, Config.RESPONSE_FALLBACKS),
+            'tts': (Config.TTS_MODEL, Config.TTS_FALLBACKS),
+        }[stage]
+        router = _routers[stage] = ProviderRouter(
+            stage, [primary, *fallbacks],
+            hedge_delay=Config.HEDGE_DELAY.get(stage),
+            window=Config.CIRCUIT_WINDOW,
+            min_calls=Config.CIRCUIT_MIN_CALLS,
+            error_rate=Config.CIRCUIT_ERROR_RATE,
+            cooldown=Config.CIRCUIT_COOLDOWN,
+        )
+    return router
+
+
+def routing_metrics():
+    """
+    Report hedging counters and backend health per stage.
+
+    Returns:
+    dict: {stage: {"calls", "hedged", "hedge_wins", "failovers", "failures", "circuit_opens",
+                   "providers": {provider: {"state", "error_rate", "calls", "p50", "p95"}}}}
+    """
+    return {stage: dict(routing_stats[stage], providers=router.snapshot()) for stage, router in _routers.items()}
+
+
+if __name__ == "__main__":
+    # Fake backends with injected latency and errors, run through real routers.
+    import random
+
+    rng = random.Random(3)
+    behaviour = {}
+    bookings = []
+
+    def fake_transcribe(model, api_key, audio):
+        median, stall_rate, error_rate = behaviour[model]
+        time.sleep(rng.lognormvariate(0, 0.3) * median + (1.0 if rng.random() < stall_rate else 0.0))
+        if rng.random() < error_rate:
+            raise ConnectionError(f"{model} returned 503")
+        return f"transcribed by {model}"
+
+    def fake_generate(model, api_key, booking):
+        # Slow to its first token, and books a meeting before answering
+        median, stall_rate, error_rate = behaviour[model]
+        time.sleep(rng.lognormvariate(0, 0.3) * median + (1.0 if rng.random() < stall_rate else 0.0))
+        commit()
+        bookings.append(booking)
+        yield f"booked by {model}"
+        yield "."
+
+    def percentiles(latencies):
+        latencies = sorted(latencies)
+        return " ".join(f"p{q}={latencies[int(q / 100 * len(latencies)) - 1] * 1000:.0f}ms" for q in (50, 95, 99))
+
+    async def timed_calls(router, count, concurrency=16):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await router.call(fake_transcribe, b"audio")
+                except ConnectionError:
+                    pass
+                latencies.append(time.perf_counter() - started)
+        await asyncio.gather(*(one() for _ in range(count)))
+        return latencies
+
+    async def main():
+        # 1. Tail latency: the primary stalls for a second on 5% of calls
+        behaviour.update(groq=(0.05, 0.05, 0.0), openai=(0.08, 0.0, 0.0))
+        for label, hedge_delay in (("no hedging", None), ("hedged    ", 0.5)):
+            routing_stats.clear()
+            router = ProviderRouter("transcription", ["groq", "openai"], hedge_delay=hedge_delay)
+            latencies = await timed_calls(router, 600)
+            stats = routing_stats["transcription"]
+            print(f"{label}: {percentiles(latencies)}, extra backend calls {stats['hedged'] / stats['calls']:.1%}, "
+                  f"hedge wins {stats['hedge_wins']}, hedge delay now {router.delay('groq') * 1000 if hedge_delay else 0:.0f}ms")
+
+        # 2. Failover and circuit breaking: the primary fails every call, then recovers
+        routing_stats.clear()
+        behaviour.update(groq=(0.02, 0.0, 1.0), openai=(0.05, 0.0, 0.0))
+        router = ProviderRouter("transcription", ["groq", "openai"], hedge_delay=0.5, cooldown=0.5)
+        latencies = await timed_calls(router, 100, concurrency=1)
+        print(f"primary down: {percentiles(latencies)}, {routing_stats['transcription']}, groq circuit {router.health['groq'].state}")
+        behaviour.update(groq=(0.02, 0.0, 0.0))
+        await asyncio.sleep(0.5)
+        await timed_calls(router, 10, concurrency=1)
+        print(f"after cooldown, groq circuit {router.health['groq'].state}")
+        assert router.health['groq'].state == "closed"
+
+        # 3. Hedged completions with tool calls: every turn books exactly once
+        routing_stats.clear()
+        behaviour.update(groq=(0.05, 0.3, 0.0), openai=(0.06, 0.3, 0.0))
+        router = ProviderRouter("response", ["groq", "openai"], hedge_delay=0.1)
+
+        async def turn(number):
+            return "".join([delta async for delta in router.stream(fake_generate, number)])
+        replies = await asyncio.gather(*(turn(number) for number in range(200)))
+        stats = routing_stats["response"]
+        print(f"hedged tool turns: {stats['hedged']} hedged, {stats['hedge_wins']} won by the hedge, "
+              f"{len(bookings)} bookings for {len(replies)} turns, duplicates {len(bookings) - len(set(bookings))}")
+        assert sorted(bookings) == list(range(200)) and all(reply.endswith(".") for reply in replies)
+
+    asyncio.run(main())
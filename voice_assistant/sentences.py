@@ -0,0 +1,65 @@
+import re
+
+# Words ending in a period that do not end a sentence
+ABBREVIATIONS = {"dr", "mr", "mrs", "ms", "prof", "st", "jr", "sr", "vs", "etc", "e.g", "i.e", "no", "approx", "appt", "dept"}
+
+_BOUNDARY = re.compile(r"([.!?]+)[\"')\]]*\s+|\n+")
+
+
+class SentenceSegmenter:
+    """
+    Split streamed LLM text into sentences as soon as they are complete.
+
+    A sentence ends at ".", "!" or "?" followed by whitespace, or at a line
+    break. Periods after abbreviations like "Dr." and after single letters do
+    not end a sentence, so "Dr. Ali is free at 9:00." stays in one piece.
+    """
+
+    def __init__(self, min_chars=2):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """
+        Add streamed text and return the sentences it completed.
+        """
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _BOUNDARY.finditer(self._buffer):
+            if match.group(1) == "." and self._is_abbreviation(self._buffer[start:match.start()]):
+                continue
+            sentence = self._buffer[start:match.end()].strip()
+            if len(sentence) < self.min_chars:
+                continue
+            sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """
+        Return whatever text is left once the stream has ended, or None.
+        """
+        sentence, self._buffer = self._buffer.strip(), ""
+        return sentence or None
+
+    @staticmethod
+    def _is_abbreviation(text):
+        words = text.split()
+        if not words:
+            return False
+        word = words[-1].lower().lstrip("(\"'")
+        return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+
+def split_sentences(text):
+    """
+    Split complete text into the same sentences the streaming segmenter produces.
+    """
+    segmenter = SentenceSegmenter()
+    sentences = segmenter.feed(text)
+    tail = segmenter.flush()
+    if tail:
+        sentences.append(tail)
+    return sentences
@@ -0,0 +1,142 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id):
+    """
+    Check that a client-supplied session id has the form `new_session_id` produces.
+    """
+    return isinstance(session_id, str) and _SESSION_ID.match(session_id) is not None
+
+
+class SessionStore:
+    """
+    Conversation state shared by every worker process through SQLite in WAL mode.
+
+    Each session is one row holding its state as JSON: the conversation
+    history, its summary and the patient's name. The state is written after
+    every turn, so when a client reconnects with its session id, whichever
+    worker accepts the connection picks the conversation up where it was,
+    including after the previous worker restarted. Sessions untouched for
+    `ttl` seconds are treated as gone and removed by `purge`. Concurrent
+    writers for the same session (a client reconnecting before its old
+    socket closed) simply overwrite each other; the last turn wins.
+    """
+
+    def __init__(self, path, ttl=24 * 3600, busy_timeout=10.0):
+        self.path = path
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated REAL NOT NULL
+        ) WITHOUT ROWID""")
+
+    def load(self, session_id):
+        """
+        Return the saved state of a session, or None if it is unknown or expired.
+        """
+        row = self._connection().execute(
+            "SELECT state FROM sessions WHERE id = ? AND updated >= ?", (session_id, time.time() - self.ttl)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id, state):
+        """
+        Store the state of a session, replacing what was saved before.
+        """
+        self._connection().execute(
+            "INSERT INTO sessions (id, state, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET state = excluded.state, updated = excluded.updated",
+            (session_id, json.dumps(state, separators=(",", ":"), default=str), time.time()))
+
+    def delete(self, session_id):
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def purge(self):
+        """
+        Remove expired sessions. Returns the number removed.
+        """
+        return self._connection().execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,)).rowcount
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _connection(self):
+        # sqlite3 connections are per thread; each worker thread opens its own
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+
+def _worker(path, worker, sessions, turns, results):
+    # One worker process running its own conversations, saving after each turn
+    store = SessionStore(path)
+    latencies = []
+    for session_id in sessions:
+        messages = []
+        for turn in range(turns):
+            messages += [{"role": "user", "content": f"Turn {turn}: I'd like to see Dr. Ali on Wednesday at {9 + turn % 8}:00"},
+                         {"role": "assistant", "content": "Dr. Ali is free on Wednesday, September 25 at 9:00 AM. Shall I book it?"}]
+            started = time.perf_counter()
+            store.save(session_id, {"history": {"summary": "", "messages": messages}, "patient_name": f"patient {worker}"})
+            latencies.append(time.perf_counter() - started)
+    results.put(latencies)
+
+
+if __name__ == "__main__":
+    # Several worker processes save turns at once; a "restarted" process then
+    # resumes every conversation from the shared database.
+    import multiprocessing
+    import os
+    import tempfile
+
+    process_count = 8
+    sessions_per_process = 25
+    turns = 20
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.db")
+        SessionStore(path)
+        sessions = [[new_session_id() for _ in range(sessions_per_process)] for _ in range(process_count)]
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_worker, args=(path, index, sessions[index], turns, results))
+                     for index in range(process_count)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        latencies = sorted(latency for _ in processes for latency in results.get())
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+        print(f"{len(latencies)} turn saves from {process_count} processes in {elapsed:.2f}s: "
+              f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+        # Every worker is gone; a new one picks up each conversation at its last turn
+        store = SessionStore(path)
+        started = time.perf_counter()
+        resumed = [store.load(session_id) for worker_sessions in sessions for session_id in worker_sessions]
+        elapsed = time.perf_counter() - started
+        complete = sum(state is not None and len(state['history']['messages']) == 2 * turns for state in resumed)
+        print(f"Resumed {complete}/{len(resumed)} sessions after restart, {elapsed / len(resumed) * 1000:.2f} ms per load")
+        assert complete == len(resumed)
+        assert store.load(new_session_id()) is None
+
+        store.ttl = 0
+        time.sleep(0.01)
+        print(f"Expired sessions purged: {store.purge()}")
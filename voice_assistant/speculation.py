@@ -0,0 +1,258 @@
+import asyncio
+import logging
+
+from voice_assistant import metrics
+from voice_assistant.pipeline import run_stage
+from voice_assistant.sentences import split_sentences
+from voice_assistant.tts_cache import normalize_text
+
+# Totals across all sessions, served by /speculation/metrics
+speculation_stats = {
+    "rounds": 0,
+    "predicted": 0,
+    "over_budget": 0,
+    "synthesized": 0,
+    "synthesized_chars": 0,
+    "already_cached": 0,
+    "cancelled": 0,
+    "errors": 0,
+    "sentences_spoken": 0,
+    "hits": 0,
+    "late": 0,
+    "wasted": 0,
+    "wasted_chars": 0,
+}
+
+# Speculative syntheses running at once across every session
+_slots = None
+
+
+class Speculator:
+    """
+    Synthesize a session's likely next replies into the TTS cache while the user speaks.
+
+    Predictions come from the intent router: the answers its current state
+    makes likely (see `IntentRouter.likely_responses`) and, as partial
+    transcripts arrive, the answer it would give to what the user has said
+    so far (see `IntentRouter.preview`). Their sentences are synthesized in
+    the background by `synthesize(sentence)`, which stores them in the TTS
+    cache and returns whether it had to synthesize anything. When the reply
+    is spoken its sentences then play straight from the cache.
+
+    A round of speculation runs from one reply to the next and is capped at
+    `max_sentences` sentences and `max_chars` characters, since hosted TTS
+    bills by the character. `spoken` is told every sentence of the reply, and
+    `settle` closes the round: predicted sentences that were spoken are hits,
+    synthesized ones that were not are wasted.
+    """
+
+    def __init__(self, router, synthesize, max_sentences=6, max_chars=600, concurrency=2):
+        global _slots
+        self.router = router
+        self.synthesize = synthesize
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+        self.last_response = ""
+        self._syntheses = {}
+        self._started = set()
+        self._spoken = set()
+        self._over_budget = set()
+        self._chars = 0
+        self._predicting = set()
+        if _slots is None:
+            _slots = asyncio.Semaphore(concurrency)
+
+    def speculate(self, partial_text=None):
+        """
+        Start synthesizing the replies predicted from the state and the user's words so far.
+        """
+        task = asyncio.create_task(self._speculate(partial_text))
+        self._predicting.add(task)
+        task.add_done_callback(self._predicting.discard)
+
+    def spoken(self, sentence):
+        """
+        Record a sentence of the reply as it is handed to TTS.
+        """
+        speculation_stats['sentences_spoken'] += 1
+        key = normalize_text(sentence)
+        task = self._syntheses.get(key)
+        if task is None:
+            return
+        self._spoken.add(key)
+        if task.done() and not task.cancelled() and task.result() is not None:
+            speculation_stats['hits'] += 1
+        else:
+            # Still synthesizing; the reply synthesizes it again
+            speculation_stats['late'] += 1
+
+    def stop(self):
+        """
+        Cancel speculative syntheses that have not started; the reply is about to need the TTS backend.
+        """
+        for key, task in self._syntheses.items():
+            if key not in self._started:
+                task.cancel()
+
+    def settle(self, response=""):
+        """
+        Close the round after a reply was spoken, counting its hits and waste.
+        """
+        self.stop()
+        for key, task in self._syntheses.items():
+            if key in self._spoken:
+                continue
+            if key not in self._started:
+                speculation_stats['cancelled'] += 1
+            elif task.done() and task.result():
+                speculation_stats['wasted'] += 1
+                speculation_stats['wasted_chars'] += len(key)
+        speculation_stats['rounds'] += 1
+        self.last_response = response
+        self._syntheses = {}
+        self._started = set()
+        self._spoken = set()
+        self._over_budget = set()
+        self._chars = 0
+
+    async def _speculate(self, partial_text):
+        try:
+            responses = await run_stage("response", self._predict, partial_text, self.last_response)
+        except Exception as e:
+            logging.error(f"Failed to predict replies: {e}")
+            return
+        for response in responses:
+            for sentence in split_sentences(response):
+                key = normalize_text(sentence)
+                if key in self._syntheses or key in self._over_budget:
+                    continue
+                speculation_stats['predicted'] += 1
+                if len(self._syntheses) >= self.max_sentences or self._chars + len(key) > self.max_chars:
+                    speculation_stats['over_budget'] += 1
+                    self._over_budget.add(key)
+                    continue
+                self._chars += len(key)
+                self._syntheses[key] = asyncio.create_task(self._synthesize(key, sentence))
+
+    def _predict(self, partial_text, last_response):
+        responses = []
+        if partial_text:
+            routed = self.router.preview(partial_text)
+            if routed is not None:
+                responses.append(routed['response'])
+        return responses + self.router.likely_responses(last_response)
+
+    async def _synthesize(self, key, sentence):
+        # Returns whether the sentence had to be synthesized, or None if that failed
+        async with _slots:
+            self._started.add(key)
+            try:
+                with metrics.span("tts_speculative", chars=len(sentence)) as span:
+                    synthesized = bool(await run_stage("tts", self.synthesize, sentence))
+                    span.set(synthesized=synthesized)
+            except Exception as e:
+                logging.warning(f"Speculative synthesis failed: {e}")
+                speculation_stats['errors'] += 1
+                return None
+        if synthesized:
+            speculation_stats['synthesized'] += 1
+            speculation_stats['synthesized_chars'] += len(sentence)
+        else:
+            speculation_stats['already_cached'] += 1
+        return synthesized
+
+
+def speculation_metrics():
+    spoken = speculation_stats['sentences_spoken']
+    synthesized = speculation_stats['synthesized']
+    return dict(speculation_stats,
+                hit_rate=speculation_stats['hits'] / spoken if spoken else 0,
+                waste_rate=speculation_stats['wasted'] / synthesized if synthesized else 0)
+
+
+if __name__ == "__main__":
+    # Replay the labelled transcript corpus in simulated time and compare the
+    # TTS cache hit rate on spoken sentences, and the characters synthesized,
+    # with and without speculation. Users speak 3 words a second and pause a
+    # second before answering; streaming transcription publishes a partial
+    # transcript every 4 words, except for the last words, which are only
+    # transcribed once the user stops. A sentence takes 0.4 s to synthesize.
+    # Turns the router leaves to the LLM speak nothing here, so any speculation
+    # on them is wasted.
+    import json
+    import os
+    import time
+    from voice_assistant.availability import AvailabilityStore
+    from voice_assistant.intent_router import IntentRouter
+
+    time_scale = 0.02  # simulated seconds per real second
+    words_per_second = 3
+    think_seconds = 1.0
+    synthesis_seconds = 0.4
+
+    root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils")
+    with open(os.path.join(root, "doctors_data.json")) as file:
+        doctors = json.load(file)
+    with open(os.path.join(root, "sample_transcripts.json")) as file:
+        conversations = json.load(file)
+
+    async def replay(speculate):
+        cache = set()
+        counts = {"spoken": 0, "cached": 0, "synthesized_chars": 0}
+
+        def synthesize(sentence):
+            key = normalize_text(sentence)
+            if key in cache:
+                return False
+            time.sleep(synthesis_seconds * time_scale)
+            cache.add(key)
+            counts['synthesized_chars'] += len(key)
+            return True
+
+        for stat in speculation_stats:
+            speculation_stats[stat] = 0
+        for conversation in conversations:
+            store = AvailabilityStore(doctors)
+
+            def book(doctor_name, patient_name, requested_time):
+                return json.dumps({"status": "success" if store.book(doctor_name, requested_time) else "error"})
+
+            router = IntentRouter(store, book, conversation.get('today', "2024-09-24"))
+            speculator = Speculator(router, synthesize)
+            for turn in conversation['turns']:
+                await asyncio.sleep(think_seconds * time_scale)
+                words = turn['user'].split()
+                if speculate:
+                    speculator.speculate()
+                for end in range(4, len(words), 4):
+                    await asyncio.sleep(4 / words_per_second * time_scale)
+                    if speculate:
+                        speculator.speculate(" ".join(words[:end]))
+                await asyncio.sleep((len(words) % 4 or 4) / words_per_second * time_scale)
+
+                speculator.stop()
+                routed = router.route(turn['user'])
+                response = routed['response'] if routed else ""
+                for sentence in split_sentences(response):
+                    speculator.spoken(sentence)
+                    counts['spoken'] += 1
+                    counts['cached'] += normalize_text(sentence) in cache
+                    await run_stage("tts", synthesize, sentence)
+                speculator.settle(response)
+            await asyncio.sleep(synthesis_seconds * time_scale * 4)
+        return counts, speculation_metrics()
+
+    async def main():
+        baseline, _ = await replay(False)
+        counts, stats = await replay(True)
+        print(f"{len(conversations)} conversations, {counts['spoken']} routed sentences spoken")
+        print(f"TTS cache hit rate on spoken sentences: {baseline['cached'] / baseline['spoken']:.0%} without speculation, "
+              f"{counts['cached'] / counts['spoken']:.0%} with")
+        print(f"Sentences ready when spoken thanks to a prediction: {stats['hits']} ({stats['hit_rate']:.0%}), "
+              f"{stats['late']} predicted but still synthesizing")
+        print(f"Characters synthesized: {baseline['synthesized_chars']} -> {counts['synthesized_chars']} "
+              f"(+{counts['synthesized_chars'] / baseline['synthesized_chars'] - 1:.0%}); "
+              f"{stats['wasted']} of {stats['synthesized']} speculative sentences wasted ({stats['wasted_chars']} chars), "
+              f"{stats['cancelled']} cancelled before starting, {stats['over_budget']} over budget")
+
+    asyncio.run(main())
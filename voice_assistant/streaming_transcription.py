@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+from voice_assistant import metrics
+from voice_assistant.transcription import transcribe_audio
+from voice_assistant.utils import pcm_to_wav
+
+
+class StreamingTranscriber:
+    """
+    Transcribe the segments of one utterance while the user is still speaking.
+
+    Each VAD segment is sent to the transcription router as soon as it closes.
+    Whenever a prefix of the segments has been transcribed `on_partial` is
+    awaited with the text so far; `finish` waits for the rest and returns the
+    whole transcript, so only the last segment is left to transcribe once the
+    user stops talking.
+    """
+
+    def __init__(self, router, sample_rate, local_model_path=None, on_partial=None):
+        self.router = router
+        self.sample_rate = sample_rate
+        self.local_model_path = local_model_path
+        self.on_partial = on_partial
+        self._tasks = []
+        self._texts = []
+        self._published = 0
+
+    def add_segment(self, pcm_bytes):
+        """
+        Start transcribing a finished segment of 16-bit mono PCM.
+        """
+        index = len(self._tasks)
+        self._texts.append(None)
+        self._tasks.append(asyncio.create_task(self._transcribe(index, pcm_bytes)))
+
+    async def finish(self):
+        """
+        Wait for every segment and return the utterance transcript.
+
+        Cancelling the wait leaves the segments transcribing, so the
+        utterance can still be finished later (see `finish_utterances`).
+        """
+        await asyncio.shield(asyncio.gather(*self._tasks, return_exceptions=True))
+        return self._joined(len(self._texts))
+
+    def cancel(self):
+        """
+        Abandon the utterance and its outstanding transcriptions.
+        """
+        for task in self._tasks:
+            task.cancel()
+
+    async def _transcribe(self, index, pcm_bytes):
+        wav_bytes = pcm_to_wav(pcm_bytes, self.sample_rate)
+        try:
+            with metrics.span("transcribe_segment", provider=self.router.providers[0], bytes=len(pcm_bytes), segment=index):
+                text = await self.router.call(transcribe_audio, wav_bytes, self.local_model_path, raise_errors=True)
+        except Exception as e:
+            logging.error(f"Failed to transcribe segment: {e}")
+            text = ""
+        self._texts[index] = text or ""
+
+        # Publish partial text only for the in-order prefix of finished segments
+        done = self._published
+        while done < len(self._texts) and self._texts[done] is not None:
+            done += 1
+        if done > self._published and self.on_partial is not None:
+            self._published = done
+            try:
+                await self.on_partial(self._joined(done))
+            except Exception as e:
+                logging.error(f"Failed to publish partial transcript: {e}")
+
+    def _joined(self, count):
+        return " ".join(text.strip() for text in self._texts[:count] if text and text.strip())
+
+
+async def finish_utterances(utterances):
+    """
+    Wait for several utterances, oldest first, and join their transcripts.
+
+    A turn cut short while waiting can hand the same list, plus whatever the
+    user said next, to the following turn: no words are lost either way.
+    """
+    texts = [await utterance.finish() for utterance in utterances]
+    return " ".join(text for text in texts if text)
@@ -1,84 +1,296 @@
 import logging
-import elevenlabs
-from openai import OpenAI
-from deepgram import DeepgramClient, SpeakOptions
-from elevenlabs.client import ElevenLabs
-from cartesia import Cartesia
-import pyaudio
+import numpy as np
+from deepgram import SpeakOptions
 import soundfile as sf
 import json
 
-from voice_assistant.local_tts_generation import generate_audio_file_melotts
-def text_to_speech(model, api_key, text, output_file_path, local_model_path=None):
-    
+from voice_assistant.config import Config
+from voice_assistant import metrics
+from voice_assistant.local_tts_generation import generate_audio_melotts, stream_audio_melotts
+from voice_assistant.sentences import split_sentences
+from voice_assistant.tts_cache import TTSCache, make_cache_key
+from voice_assistant.utils import pcm_to_wav
+from voice_assistant.providers import (
+    get_openai_client,
+    get_deepgram_client,
+    get_elevenlabs_client,
+    get_cartesia_client,
+    get_cartesia_voice_embedding,
+)
+
+def text_to_speech(model, api_key, text, output_file_path=None, local_model_path=None):
+    """
+    Convert text to speech with the selected provider.
+
+    Args:
+    model (str): The TTS backend.
+    api_key (str): The API key for the backend.
+    text (str): The text to speak.
+    output_file_path (str): Optionally also write the audio to this path.
+    local_model_path (str): Path to a local model, if any.
+
+    Returns:
+    bytes | None: The encoded audio, or None if synthesis failed.
+    """
     try:
         if model == 'openai':
-            client = OpenAI(api_key=api_key)
+            client = get_openai_client(api_key)
             speech_response = client.audio.speech.create(
                 model="tts-1",
                 voice="fable",
                 input=text
             )
 
-            speech_response.stream_to_file(output_file_path)
+            audio_bytes = speech_response.content
 
         elif model == 'deepgram':
-            client = DeepgramClient(api_key=api_key)
+            client = get_deepgram_client(api_key)
             options = SpeakOptions(
                 model="aura-arcas-en", 
                 encoding="linear16",
                 container="wav"
             )
             SPEAK_OPTIONS = {"text": text}
-            response = client.speak.v("1").save(output_file_path, SPEAK_OPTIONS, options)
+            response = client.speak.v("1").stream_memory(SPEAK_OPTIONS, options)
+            audio_bytes = response.stream_memory.getvalue()
         elif model == 'elevenlabs':
             ELEVENLABS_VOICE_ID = "Paul J."
-            client = ElevenLabs(api_key=api_key)
+            client = get_elevenlabs_client(api_key)
             audio = client.generate(
                 text=text, voice=ELEVENLABS_VOICE_ID, output_format="mp3_22050_32", model="eleven_turbo_v2"
             )
-            elevenlabs.save(audio, output_file_path)
+            audio_bytes = audio if isinstance(audio, bytes) else b"".join(audio)
         elif model == "cartesia":
 
-            client = Cartesia(api_key=api_key)
+            client = get_cartesia_client(api_key)
             voice_id = "f114a467-c40a-4db8-964d-aaba89cd08fa"#"a0e99841-438c-4a64-b679-ae501e7d6091"
-            voice = client.voices.get(id=voice_id)
+            voice_embedding = get_cartesia_voice_embedding(api_key, voice_id)
             model_id = "sonic-english"
 
+            rate = 44100
             output_format = {
                 "container": "raw",
-                "encoding": "pcm_f32le",
-                "sample_rate": 44100,
+                "encoding": "pcm_s16le",
+                "sample_rate": rate,
             }
 
-            p = pyaudio.PyAudio()
-            rate = 44100
-
-            stream = None
-
+            chunks = []
             for output in client.tts.sse(
                 model_id=model_id,
                 transcript=text,
-                voice_embedding=voice["embedding"],
+                voice_embedding=voice_embedding,
                 stream=True,
                 output_format=output_format,
             ):
-                buffer = output["audio"]
+                chunks.append(output["audio"])
 
-                if not stream:
-                    stream = p.open(format=pyaudio.paFloat32, channels=1, rate=rate, output=True)
-                stream.write(buffer)
-
-            stream.stop_stream()
-            stream.close()
-            p.terminate()
+            audio_bytes = pcm_to_wav(b"".join(chunks), rate)
 
         elif model == "melotts":
-            generate_audio_file_melotts(text=text, filename=output_file_path)
+            # The MeloTTS server answers with raw PCM
+            audio_bytes = pcm_to_wav(generate_audio_melotts(text=text), TTS_STREAM_SAMPLE_RATES['melotts'])
         elif model == 'local':
-            with open(output_file_path, "wb") as f:
-                f.write(b"Local TTS audio data")
+            audio_bytes = b"Local TTS audio data"
         else:
             raise ValueError("Unsupported TTS model")
+
+        if output_file_path:
+            with open(output_file_path, "wb") as f:
+                f.write(audio_bytes)
+        return audio_bytes
     except Exception as e:
-        logging.error(f"Failed to convert text to speech: {e}")
\ No newline at end of file
+        logging.error(f"Failed to convert text to speech: {e}")
+        return None
+
+
+# Sample rate of the 16-bit mono PCM each backend streams
+TTS_STREAM_SAMPLE_RATES = {
+    'openai': 24000,
+    'deepgram': 24000,
+    'elevenlabs': 22050,
+    'cartesia': 44100,
+    'melotts': 44100,
+    'local': 16000,
+}
+
+# Voice each backend speaks with; part of the TTS cache key
+TTS_VOICES = {
+    'openai': "fable",
+    'deepgram': "aura-arcas-en",
+    'elevenlabs': "Paul J.",
+    'cartesia': "f114a467-c40a-4db8-964d-aaba89cd08fa",
+    'melotts': "EN-US",
+    'local': "local",
+}
+
+tts_cache = TTSCache(Config.TTS_CACHE_MEMORY_BYTES, Config.TTS_CACHE_DIR, Config.TTS_CACHE_DISK_BYTES)
+
+def get_tts_stream_format(model):
+    """
+    Describe the audio frames `text_to_speech_stream` yields for a backend.
+    """
+    return {"encoding": "pcm_s16le", "sample_rate": TTS_STREAM_SAMPLE_RATES[model], "channels": 1}
+
+def text_to_speech_stream(model, api_key, text, local_model_path=None, chunk_size=4096, use_cache=True, sample_rate=None):
+    """
+    Convert text to speech and yield audio as it is synthesized.
+
+    Frames are raw 16-bit little-endian mono PCM at the rate given by
+    `get_tts_stream_format`, split on whole samples. Completed syntheses are
+    stored in `tts_cache` and replayed from it for the same model, voice and
+    normalized text.
+
+    Args:
+    model (str): The TTS backend.
+    api_key (str): The API key for the backend.
+    text (str): The text to speak.
+    local_model_path (str): Path to a local model, if any.
+    chunk_size (int): Preferred frame size in bytes.
+    use_cache (bool): Look up and store the result in the TTS cache.
+    sample_rate (int): Resample to this rate if the backend speaks at another one, e.g. when
+        a fallback backend stands in mid-response.
+    """
+    if model not in TTS_STREAM_SAMPLE_RATES:
+        raise ValueError("Unsupported TTS model")
+    metrics.annotate(voice=TTS_VOICES[model])
+    stream = _align_samples(_raw_speech_stream(model, api_key, text, chunk_size))
+    if use_cache:
+        stream = _cached_stream(get_tts_cache_key(model, text), stream, chunk_size)
+    if sample_rate and sample_rate != TTS_STREAM_SAMPLE_RATES[model]:
+        stream = _resample_stream(stream, TTS_STREAM_SAMPLE_RATES[model], sample_rate)
+    return stream
+
+def get_tts_cache_key(model, text):
+    """
+    Return the TTS cache key of a phrase spoken by a backend.
+    """
+    audio_format = f"pcm_s16le@{TTS_STREAM_SAMPLE_RATES[model]}"
+    return make_cache_key(model, TTS_VOICES[model], text, audio_format)
+
+def prewarm_tts_cache(model, api_key, phrases):
+    """
+    Synthesize phrases into the TTS cache ahead of time.
+
+    Phrases are split into sentences the same way streamed responses are, so
+    a prewarmed sentence is reused wherever it appears in a longer reply.
+
+    Returns:
+    int: The number of sentences synthesized.
+    """
+    synthesized = 0
+    for phrase in phrases:
+        for sentence in split_sentences(phrase):
+            if get_tts_cache_key(model, sentence) in tts_cache:
+                continue
+            for _ in text_to_speech_stream(model, api_key, sentence):
+                pass
+            synthesized += 1
+    return synthesized
+
+def _cached_stream(key, stream, chunk_size):
+    with metrics.span("tts_cache_read") as span:
+        audio = tts_cache.get(key)
+        span.set(hit=audio is not None, bytes=len(audio or b""))
+    metrics.annotate(cached=audio is not None)
+    if audio is not None:
+        stream.close()
+        for start in range(0, len(audio), chunk_size):
+            yield audio[start:start + chunk_size]
+        return
+
+    chunks = []
+    try:
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        stream.close()
+    # Only complete syntheses reach this point
+    tts_cache.put(key, b"".join(chunks))
+
+def _raw_speech_stream(model, api_key, text, chunk_size):
+    if model == 'openai':
+        client = get_openai_client(api_key)
+        with client.audio.speech.with_streaming_response.create(
+            model="tts-1",
+            voice=TTS_VOICES['openai'],
+            input=text,
+            response_format="pcm"
+        ) as response:
+            yield from response.iter_bytes(chunk_size)
+
+    elif model == 'deepgram':
+        client = get_deepgram_client(api_key)
+        options = SpeakOptions(
+            model=TTS_VOICES['deepgram'],
+            encoding="linear16",
+            container="none",
+            sample_rate=TTS_STREAM_SAMPLE_RATES['deepgram']
+        )
+        response = client.speak.v("1").stream_raw({"text": text}, options)
+        try:
+            yield from response.iter_bytes(chunk_size)
+        finally:
+            response.close()
+
+    elif model == 'elevenlabs':
+        client = get_elevenlabs_client(api_key)
+        yield from client.generate(
+            text=text, voice=TTS_VOICES['elevenlabs'], output_format="pcm_22050", model="eleven_turbo_v2", stream=True
+        )
+
+    elif model == "cartesia":
+        client = get_cartesia_client(api_key)
+        voice_embedding = get_cartesia_voice_embedding(api_key, TTS_VOICES['cartesia'])
+        output_format = {
+            "container": "raw",
+            "encoding": "pcm_s16le",
+            "sample_rate": TTS_STREAM_SAMPLE_RATES['cartesia'],
+        }
+        for output in client.tts.sse(
+            model_id="sonic-english",
+            transcript=text,
+            voice_embedding=voice_embedding,
+            stream=True,
+            output_format=output_format,
+        ):
+            yield output["audio"]
+
+    elif model == "melotts":
+        yield from stream_audio_melotts(text=text, accent=TTS_VOICES['melotts'], chunk_size=chunk_size)
+
+    elif model == 'local':
+        yield b"\x00\x00" * 1600
+
+def _align_samples(chunks, sample_width=2):
+    # Providers may split a chunk mid-sample; carry the odd bytes into the next one
+    remainder = b""
+    try:
+        for chunk in chunks:
+            chunk = remainder + chunk
+            cut = len(chunk) - len(chunk) % sample_width
+            remainder = chunk[cut:]
+            if cut:
+                yield chunk[:cut]
+    finally:
+        chunks.close()
+
+def _resample_stream(chunks, from_rate, to_rate):
+    # Linear interpolation carried across chunk boundaries; good enough for speech
+    step = from_rate / to_rate
+    position = 0.0  # next output sample, in input samples from the start of `samples`
+    samples = np.zeros(0, dtype=np.float32)
+    try:
+        for chunk in chunks:
+            samples = np.concatenate([samples, np.frombuffer(chunk, dtype="<i2").astype(np.float32)])
+            times = np.arange(position, len(samples) - 1, step)
+            if len(times):
+                resampled = np.interp(times, np.arange(len(samples)), samples)
+                yield np.clip(np.round(resampled), -32768, 32767).astype("<i2").tobytes()
+                position = times[-1] + step
+            # Keep the samples the next output still interpolates between
+            consumed = min(int(position), len(samples) - 1)
+            samples = samples[consumed:]
+            position -= consumed
+    finally:
+        chunks.close()
@@ -1,8 +1,5 @@
 from colorama import Fore, init
-from openai import OpenAI
-from groq import Groq
 from deepgram import (
-    DeepgramClient,
     PrerecordedOptions,
     FileSource,
 )
@@ -10,6 +7,15 @@ import json
 import logging
 import requests
 import time
+from voice_assistant.providers import get_openai_client, get_groq_client, get_deepgram_client, get_http_session
+from voice_assistant.utils import read_audio_bytes
+from voice_assistant.audio_ingest import ingest_audio
+from voice_assistant.local_stt import get_local_transcriber
+from voice_assistant.config import Config
+from voice_assistant import metrics
+
+# The model each backend transcribes with
+TRANSCRIPTION_MODELS = {'openai': "whisper-1", 'groq': "distil-whisper-large-v3-en", 'deepgram': "nova-2", 'fastwhisperapi': "base", 'local': Config.LOCAL_MODEL_PATH or Config.LOCAL_STT_MODEL}
 
 fast_url = "http://localhost:8000"
 checked_fastwhisperapi = False
@@ -20,45 +26,63 @@ def check_fastwhisperapi():
     if not checked_fastwhisperapi:
         infopoint = fast_url + "/info"
         try:
-            response = requests.get(infopoint)
+            response = get_http_session().get(infopoint)
             if response.status_code != 200:
                 raise Exception("FastWhisperAPI is not running")
         except Exception:
             raise Exception("FastWhisperAPI is not running")
         checked_fastwhisperapi = True
 
-def transcribe_audio(model, api_key, audio_file_path, local_model_path=None):
+def transcribe_audio(model, api_key, audio, local_model_path=None, raise_errors=False):
+    """
+    Transcribe audio with the selected provider.
+
+    Args:
+    model (str): The transcription backend.
+    api_key (str): The API key for the backend.
+    audio (bytes | file-like | str): Audio bytes, a binary file-like object, or a file path.
+    local_model_path (str): Path to a local model, if any.
+    raise_errors (bool): Raise provider errors instead of logging them and returning None,
+        so a router can fail over.
+
+    The audio is normalized for the backend first (see `ingest_audio`); a
+    clip with no speech in it is not sent at all and transcribes to "".
+    """
     try:
+        raw_bytes = read_audio_bytes(audio)
+        with metrics.span("ingest", provider=model, bytes=len(raw_bytes)) as span:
+            audio_bytes, audio_filename = ingest_audio(raw_bytes, model)
+            span.set(bytes_out=len(audio_bytes))
+        if not audio_bytes:
+            return ""
+        metrics.annotate(model=TRANSCRIPTION_MODELS.get(model, model), bytes_sent=len(audio_bytes))
         if model == 'openai':
-            client = OpenAI(api_key=api_key)
-            with open(audio_file_path, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language='en'
-                )
+            client = get_openai_client(api_key)
+            transcription = client.audio.transcriptions.create(
+                model=TRANSCRIPTION_MODELS['openai'],
+                file=(audio_filename, audio_bytes),
+                language='en'
+            )
             return transcription.text
         elif model == 'groq':
-            client = Groq(api_key=api_key)
-            with open(audio_file_path, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    model="distil-whisper-large-v3-en",#"whisper-large-v3",
-                    file=audio_file,
-                    language='en'
-                )
+            client = get_groq_client(api_key)
+            transcription = client.audio.transcriptions.create(
+                model=TRANSCRIPTION_MODELS['groq'],#"whisper-large-v3",
+                file=(audio_filename, audio_bytes),
+                language='en'
+            )
             return transcription.text
         elif model == 'deepgram':
             try:
-                deepgram = DeepgramClient(api_key)
+                deepgram = get_deepgram_client(api_key)
 
-                with open(audio_file_path, "rb") as file:
-                    buffer_data = file.read()
+                buffer_data = audio_bytes
 
                 payload: FileSource = {
                     "buffer": buffer_data,
                 }
                 options = PrerecordedOptions(
-                    model="nova-2",
+                    model=TRANSCRIPTION_MODELS['deepgram'],
                     smart_format=True,
                 )
                 response = deepgram.listen.prerecorded.v("1").transcribe_file(payload, options)
@@ -71,6 +95,8 @@ def transcribe_audio(model, api_key, audio_file_path, local_model_path=None):
 
             except Exception as e:
                 print(f"Exception: {e}")
+                if raise_errors:
+                    raise
         
         elif model == 'fastwhisperapi':
             global fast_url
@@ -79,10 +105,10 @@ def transcribe_audio(model, api_key, audio_file_path, local_model_path=None):
             endpoint = fast_url + "/v1/transcriptions"
 
             files = {
-                'file': (audio_file_path, open(audio_file_path, 'rb')),
+                'file': (audio_filename, audio_bytes),
             }
             data = {
-                'model': "base",
+                'model': TRANSCRIPTION_MODELS['fastwhisperapi'],
                 'language': "en",
                 'initial_prompt': None,
                 'vad_filter': True,
@@ -91,14 +117,19 @@ def transcribe_audio(model, api_key, audio_file_path, local_model_path=None):
                 'Authorization': 'Bearer dummy_api_key',
                 
             }
-            response = requests.post(endpoint, files=files, data=data, headers=headers)
+            response = get_http_session().post(endpoint, files=files, data=data, headers=headers)
             response_json = response.json()
             return response_json.get('text', 'No text found in the response.')
           
         elif model == 'local':
-            return "Transcribed text from local model"
+            transcriber = get_local_transcriber(local_model_path)
+            # Ingest hands over raw PCM; if it could not decode the upload, the model's own decoder tries
+            sample_rate = Config.INGEST_SAMPLE_RATE if audio_filename == "audio.pcm" else None
+            return transcriber.transcribe_bytes(audio_bytes, sample_rate)
         else:
             raise ValueError("Unsupported transcription model")
     except Exception as e:
         logging.error(Fore.RED + f"Failed to transcribe audio: {e}" + Fore.RESET)
+        if raise_errors:
+            raise
         raise Exception("Error in transcribing audio")
\ No newline at end of file
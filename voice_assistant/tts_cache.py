@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """
+    Normalize text for cache lookups: Unicode NFKC, collapsed whitespace, trimmed.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def make_cache_key(model, voice, text, audio_format):
+    """
+    Content address of a synthesized phrase.
+
+    Args:
+    model (str): The TTS backend.
+    voice (str): The voice used by the backend.
+    text (str): The spoken text; normalized before hashing.
+    audio_format (str): The encoding of the cached audio, e.g. "pcm_s16le@24000".
+    """
+    material = "\x1f".join([model, voice, audio_format, normalize_text(text)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Two-tier cache of synthesized speech keyed by `make_cache_key`.
+
+    Recently used audio is kept in an in-memory LRU capped at `memory_bytes`.
+    Every entry is also written to `disk_dir`, which is capped at `disk_bytes`
+    by evicting the least recently used files. Disk hits are promoted back
+    into memory.
+    """
+
+    def __init__(self, memory_bytes, disk_dir=None, disk_bytes=0):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bytes_saved": 0}
+        if disk_dir and disk_bytes:
+            self._load_disk_index()
+
+    def get(self, key):
+        """
+        Return cached audio for a key, or None on a miss.
+        """
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                self.stats['bytes_saved'] += len(audio)
+                return audio
+            on_disk = key in self._disk
+
+        audio = self._read_disk(key) if on_disk else None
+        with self._lock:
+            if audio is None:
+                self.stats['misses'] += 1
+                return None
+            if key in self._disk:
+                # Evicted since it was read; the audio is still good to serve
+                self._disk.move_to_end(key)
+            self.stats['disk_hits'] += 1
+            self.stats['bytes_saved'] += len(audio)
+            self._put_memory(key, audio)
+            return audio
+
+    def put(self, key, audio):
+        """
+        Store synthesized audio under a key in both tiers.
+        """
+        if not audio or len(audio) > self.memory_bytes:
+            return
+        with self._lock:
+            self._put_memory(key, audio)
+            self.stats['stores'] += 1
+            write_disk = self.disk_dir and self.disk_bytes and key not in self._disk
+        if write_disk:
+            self._write_disk(key, audio)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def _put_memory(self, key, audio):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.stats['evictions'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".audio")
+
+    def _load_disk_index(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".audio"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name[:-len(".audio")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), "rb") as file:
+                audio = file.read()
+            os.utime(self._path(key))
+            return audio
+        except OSError:
+            with self._lock:
+                self._disk_size -= self._disk.pop(key, 0)
+            return None
+
+    def _write_disk(self, key, audio):
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                file.write(audio)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.error(f"Failed to write TTS cache entry: {e}")
+            return
+        with self._lock:
+            if key in self._disk:
+                # Another thread missing the same key wrote it first and counted it
+                self._disk.move_to_end(key)
+            else:
+                self._disk[key] = len(audio)
+                self._disk_size += len(audio)
+            evicted = []
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
@@ -1,7 +1,9 @@
 # voice_assistant/utils.py
 
+import io
 import os
 import logging
+import wave
 
 def delete_file(file_path):
     """
@@ -19,3 +21,61 @@ def delete_file(file_path):
         logging.error(f"Permission denied when trying to delete file: {file_path}")
     except OSError as e:
         logging.error(f"Error deleting file {file_path}: {e}")
+
+def read_audio_bytes(audio):
+    """
+    Return the raw bytes of an audio input.
+
+    Args:
+    audio (bytes | file-like | str): Audio bytes, a binary file-like object, or a path to an audio file.
+    """
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return bytes(audio)
+    if hasattr(audio, "read"):
+        return audio.read()
+    with open(audio, "rb") as audio_file:
+        return audio_file.read()
+
+def guess_audio_filename(audio_bytes, default="audio.webm"):
+    """
+    Name in-memory audio with an extension matching its container.
+
+    Providers that take a multipart upload detect the format from the file name,
+    so the name has to match what is actually in the buffer.
+
+    Args:
+    audio_bytes (bytes): The audio data.
+    default (str): The name to use when the container is not recognized.
+    """
+    header = audio_bytes[:12]
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "audio.wav"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "audio.webm"
+    if header[:4] == b"OggS":
+        return "audio.ogg"
+    if header[:4] == b"fLaC":
+        return "audio.flac"
+    if header[4:8] == b"ftyp":
+        return "audio.m4a"
+    if header[:3] == b"ID3" or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "audio.mp3"
+    return default
+
+def pcm_to_wav(pcm_bytes, sample_rate, channels=1, sample_width=2):
+    """
+    Wrap raw little-endian PCM samples in a WAV container, in memory.
+
+    Args:
+    pcm_bytes (bytes): The PCM samples.
+    sample_rate (int): Samples per second.
+    channels (int): Number of interleaved channels.
+    sample_width (int): Bytes per sample.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm_bytes)
+    return buffer.getvalue()
@@ -0,0 +1,136 @@
+import collections
+
+import numpy as np
+
+
+class VoiceActivityDetector:
+    """
+    Energy / zero-crossing voice activity detection over streamed 16-bit mono PCM.
+
+    The knobs mirror `audio.record_audio`: a frame is speech when its RMS energy
+    is above `energy_threshold` (adapted to the background level when
+    `dynamic_energy_threshold` is set) and it is not dominated by zero
+    crossings. Speech must last `phrase_threshold` seconds to start an
+    utterance, and `pause_threshold` seconds of silence end it.
+
+    Shorter pauses of `segment_pause` seconds split a long utterance into
+    segments once at least `min_segment` seconds have been collected, so the
+    caller can transcribe the start of an utterance while the user is still
+    talking.
+
+    `process` returns a list of events:
+    ("speech_start", None), ("segment", pcm_bytes) and ("utterance_end", None).
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=30, energy_threshold=300, dynamic_energy_threshold=True,
+                 pause_threshold=0.8, phrase_threshold=0.1, segment_pause=0.3, min_segment=1.0,
+                 max_zero_crossing_rate=0.35, pre_roll=0.3):
+        self.sample_rate = sample_rate
+        self.frame_samples = int(sample_rate * frame_ms / 1000)
+        self.frame_seconds = self.frame_samples / sample_rate
+        self.energy_threshold = energy_threshold
+        self.dynamic_energy_threshold = dynamic_energy_threshold
+        self.pause_threshold = pause_threshold
+        self.phrase_threshold = phrase_threshold
+        self.segment_pause = segment_pause
+        self.min_segment = min_segment
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        # Same adaptation constants as speech_recognition.Recognizer
+        self._damping = 0.15 ** self.frame_seconds
+        self._ratio = 1.5
+
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._pre_roll = collections.deque(maxlen=max(1, int(pre_roll / self.frame_seconds)))
+        self._speaking = False
+        self._speech_run = 0.0
+        self._silence_run = 0.0
+        self._segment = []
+        self._segment_speech = 0.0
+
+    @property
+    def speaking(self):
+        return self._speaking
+
+    def process(self, pcm_bytes):
+        """
+        Feed PCM bytes and return the events they triggered.
+        """
+        samples = np.frombuffer(pcm_bytes[:len(pcm_bytes) - len(pcm_bytes) % 2], dtype="<i2")
+        self._pending = np.concatenate([self._pending, samples])
+        frame_count = len(self._pending) // self.frame_samples
+        if not frame_count:
+            return []
+        frames = self._pending[:frame_count * self.frame_samples].reshape(frame_count, self.frame_samples)
+        self._pending = self._pending[frame_count * self.frame_samples:]
+
+        floats = frames.astype(np.float32)
+        energies = np.sqrt(np.mean(floats * floats, axis=1))
+        signs = np.signbit(frames)
+        zero_crossing_rates = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / self.frame_samples
+
+        events = []
+        for frame, energy, zero_crossing_rate in zip(frames, energies, zero_crossing_rates):
+            self._process_frame(frame, float(energy), float(zero_crossing_rate), events)
+        return events
+
+    def flush(self):
+        """
+        End the current utterance, e.g. when the client stops streaming.
+        """
+        events = []
+        if self._speaking:
+            self._end_segment(events)
+            events.append(("utterance_end", None))
+        self._reset()
+        return events
+
+    def _is_speech(self, energy, zero_crossing_rate):
+        if energy > 2 * self.energy_threshold:
+            return True
+        return energy > self.energy_threshold and zero_crossing_rate < self.max_zero_crossing_rate
+
+    def _process_frame(self, frame, energy, zero_crossing_rate, events):
+        speech = self._is_speech(energy, zero_crossing_rate)
+
+        if not self._speaking:
+            if not speech and self.dynamic_energy_threshold:
+                target = energy * self._ratio
+                self.energy_threshold = self.energy_threshold * self._damping + target * (1 - self._damping)
+            self._pre_roll.append(frame)
+            self._speech_run = self._speech_run + self.frame_seconds if speech else 0.0
+            if self._speech_run >= self.phrase_threshold:
+                self._speaking = True
+                self._segment = list(self._pre_roll)
+                self._segment_speech = self._speech_run
+                self._silence_run = 0.0
+                self._pre_roll.clear()
+                events.append(("speech_start", None))
+            return
+
+        self._segment.append(frame)
+        if speech:
+            self._silence_run = 0.0
+            self._segment_speech += self.frame_seconds
+            return
+
+        self._silence_run += self.frame_seconds
+        if self._silence_run >= self.pause_threshold:
+            self._end_segment(events)
+            events.append(("utterance_end", None))
+            self._reset()
+        elif self._silence_run >= self.segment_pause and self._segment_speech >= self.min_segment:
+            self._end_segment(events)
+
+    def _end_segment(self, events):
+        if self._segment and self._segment_speech > 0:
+            events.append(("segment", np.concatenate(self._segment).astype("<i2").tobytes()))
+        self._segment = []
+        self._segment_speech = 0.0
+
+    def _reset(self):
+        self._speaking = False
+        self._speech_run = 0.0
+        self._silence_run = 0.0
+        self._segment = []
+        self._segment_speech = 0.0
+        self._pre_roll.clear()